@@ -0,0 +1,175 @@
+"""Local disk cache of model artifacts downloaded from registry or S3."""
+import os
+import json
+import time
+import uuid
+import fcntl
+import shutil
+import hashlib
+import tempfile
+import contextlib
+
+# empty disables the cache, every load downloads into a new temp folder
+ARTIFACT_CACHE_DIR = os.getenv(
+    "ARTIFACT_CACHE_DIR", os.path.expanduser("~/.cache/stock_return_prediction/artifacts")
+)
+ARTIFACT_CACHE_MAX_BYTES = int(os.getenv("ARTIFACT_CACHE_MAX_BYTES", str(2 * 1024**3)))
+# entries used more recently are not evicted, another worker may be loading them
+ARTIFACT_CACHE_GRACE_SECONDS = float(os.getenv("ARTIFACT_CACHE_GRACE_SECONDS", "600"))
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def tree_manifest(root):
+    """
+    sha256 and size of every file under root, by relative path
+    """
+    files = {}
+    for folder, _, names in os.walk(root):
+        for name in names:
+            path = os.path.join(folder, name)
+            files[os.path.relpath(path, root)] = {
+                "sha256": file_sha256(path),
+                "size": os.path.getsize(path),
+            }
+    return files
+
+
+@contextlib.contextmanager
+def file_lock(path):
+    """
+    exclusive lock shared by processes and threads, released on exit.
+    the holder may remove the lock file, a lock taken on a removed file is taken again
+    """
+    while True:
+        f = open(path, "a")
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            if os.fstat(f.fileno()).st_ino == os.stat(path).st_ino:
+                break
+        except FileNotFoundError:
+            pass
+        f.close()
+    try:
+        yield
+    finally:
+        fcntl.flock(f, fcntl.LOCK_UN)
+        f.close()
+
+
+class ArtifactCache:
+    """
+    artifacts are stored once per (run_id, artifact path) in
+    cache_dir/entries/<sha256 of key>/data, with manifest.json holding sha256
+    of every file. downloads go to a temp folder and are renamed into place
+    under a per entry file lock, so worker processes download each artifact once.
+    files are checked against the manifest on every hit, a mismatch downloads again.
+    least recently used entries are removed above max_bytes, except entries
+    used in the last grace_seconds: a path returned by fetch in any process
+    stays on disk while it is loaded, the cache may exceed max_bytes meanwhile.
+    """
+
+    def __init__(
+        self,
+        cache_dir=ARTIFACT_CACHE_DIR,
+        max_bytes=ARTIFACT_CACHE_MAX_BYTES,
+        grace_seconds=ARTIFACT_CACHE_GRACE_SECONDS,
+    ):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.grace_seconds = grace_seconds
+        self.entries_dir = os.path.join(cache_dir, "entries") if cache_dir else None
+
+    def entry_dir(self, run_id, artifact_path):
+        key = f"{run_id}/{artifact_path}"
+        return os.path.join(self.entries_dir, hashlib.sha256(key.encode()).hexdigest())
+
+    def fetch(self, run_id, artifact_path, download):
+        """
+        local path of artifact, download(dst_dir) is called on a miss
+        and returns the downloaded path inside dst_dir
+        """
+        if not self.entries_dir:
+            return download(tempfile.mkdtemp())
+
+        os.makedirs(self.entries_dir, exist_ok=True)
+        entry = self.entry_dir(run_id, artifact_path)
+        with file_lock(entry + ".lock"):
+            path = self._verified_path(entry)
+            if path is None:
+                path = self._store(entry, run_id, artifact_path, download)
+        self._evict(keep=entry)
+        return path
+
+    def _verified_path(self, entry):
+        manifest_path = os.path.join(entry, "manifest.json")
+        if not os.path.exists(manifest_path):
+            return None
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        data_dir = os.path.join(entry, "data")
+        if tree_manifest(data_dir) != manifest["files"]:
+            print(f"artifact cache entry {manifest['key']} is corrupted, download again")
+            shutil.rmtree(entry, ignore_errors=True)
+            return None
+        # mtime of manifest is the last use, for eviction
+        os.utime(manifest_path)
+        return os.path.join(data_dir, manifest["root"])
+
+    def _store(self, entry, run_id, artifact_path, download):
+        tmp = os.path.join(self.entries_dir, f".tmp-{uuid.uuid4().hex}")
+        data_dir = os.path.join(tmp, "data")
+        os.makedirs(data_dir)
+        try:
+            downloaded = download(data_dir)
+            files = tree_manifest(data_dir)
+            manifest = {
+                "key": f"{run_id}/{artifact_path}",
+                "root": os.path.relpath(downloaded, data_dir),
+                "files": files,
+                "size": sum(file["size"] for file in files.values()),
+                "created": time.time(),
+            }
+            with open(os.path.join(tmp, "manifest.json"), "w") as f:
+                json.dump(manifest, f)
+            shutil.rmtree(entry, ignore_errors=True)
+            os.rename(tmp, entry)
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+        print(f"artifact {run_id}/{artifact_path} downloaded into cache")
+        return os.path.join(entry, "data", manifest["root"])
+
+    def _evict(self, keep):
+        with file_lock(os.path.join(self.cache_dir, "evict.lock")):
+            in_use_since = time.time() - self.grace_seconds
+            entries = []
+            for name in os.listdir(self.entries_dir):
+                if name.startswith(".") or name.endswith(".lock"):
+                    continue
+                # manifest is read without the entry lock,
+                # an entry replaced or removed meanwhile by another worker is skipped
+                manifest_path = os.path.join(self.entries_dir, name, "manifest.json")
+                try:
+                    last_use = os.path.getmtime(manifest_path)
+                    with open(manifest_path) as f:
+                        size = json.load(f)["size"]
+                except (OSError, ValueError, KeyError):
+                    continue
+                entries.append((last_use, size, name))
+            total = sum(size for _, size, _ in entries)
+            for last_use, size, name in sorted(entries):
+                if total <= self.max_bytes or last_use > in_use_since:
+                    break
+                entry = os.path.join(self.entries_dir, name)
+                if entry == keep:
+                    continue
+                with file_lock(entry + ".lock"):
+                    shutil.rmtree(entry, ignore_errors=True)
+                    os.remove(entry + ".lock")
+                total -= size
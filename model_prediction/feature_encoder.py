@@ -0,0 +1,90 @@
+"""Columnar feature encoder, a vectorized replacement of DictVectorizer.transform."""
+# the same file is in model_training/code and model_prediction:
+# training and prediction images are built from their own folder only.
+# change both, model_prediction/tests/unit/test_feature_encoder.py checks they are equal
+import pickle
+
+import numpy as np
+from scipy import sparse
+
+
+class FeatureEncoder:
+    """
+    build the same matrix as a fitted DictVectorizer,
+    same column order, one-hot 'column=value' for categorical columns
+    and numerical columns as they are,
+    but directly from numpy arrays instead of one python dict per row.
+    numerical values are always stored, unknown categories are left out,
+    so the sparse matrix has the same layout as DictVectorizer output.
+    """
+
+    def __init__(self, feature_names, separator="=", dtype=np.float64, sparse_output=True):
+        self.feature_names_ = list(feature_names)
+        self.vocabulary_ = {name: i for i, name in enumerate(self.feature_names_)}
+        self.separator = separator
+        self.dtype = dtype
+        self.sparse = sparse_output
+
+    @classmethod
+    def from_dict_vectorizer(cls, dv):
+        """
+        reuse vocabulary of a fitted DictVectorizer
+        """
+        return cls(dv.feature_names_, dv.separator, dv.dtype, dv.sparse)
+
+    def category_index(self, column):
+        """
+        map category value to column index, for one categorical column
+        """
+        prefix = f"{column}{self.separator}"
+        return {
+            name[len(prefix):]: i
+            for name, i in self.vocabulary_.items()
+            if name.startswith(prefix)
+        }
+
+    def transform(self, df, categorical, numerical):
+        """
+        encode dataframe columns, return csr matrix or dense array
+        """
+        n_rows = len(df)
+        numerical = [col for col in numerical if col in self.vocabulary_]
+        values = [df[numerical].to_numpy(dtype=self.dtype)]
+        cols = [np.broadcast_to([self.vocabulary_[col] for col in numerical], values[0].shape)]
+        stored = [np.ones(values[0].shape, dtype=bool)]
+        for col in categorical:
+            codes = df[col].map(self.category_index(col)).to_numpy(dtype=np.float64)
+            known = ~np.isnan(codes)
+            values.append(np.ones((n_rows, 1), dtype=self.dtype))
+            cols.append(np.where(known, codes, len(self.feature_names_)).astype(np.int64)[:, None])
+            stored.append(known[:, None])
+        values = np.hstack(values)
+        cols = np.hstack(cols)
+        stored = np.hstack(stored)
+
+        if not self.sparse:
+            X = np.zeros((n_rows, len(self.feature_names_) + 1), dtype=self.dtype)
+            X[np.arange(n_rows)[:, None], cols] = np.where(stored, values, 0)
+            return X[:, :-1]
+
+        # sort columns within each row, unknown categories sort last
+        order = np.argsort(cols, axis=1, kind="stable")
+        values = np.take_along_axis(values, order, axis=1)
+        cols = np.take_along_axis(cols, order, axis=1)
+        stored = np.take_along_axis(stored, order, axis=1)
+        indptr = np.concatenate([[0], np.cumsum(stored.sum(axis=1))])
+        return sparse.csr_matrix(
+            (values[stored], cols[stored], indptr),
+            shape=(n_rows, len(self.feature_names_)),
+        )
+
+
+def load_encoder(artifact_path):
+    """
+    read dv.pkl, either a pickled DictVectorizer or FeatureEncoder
+    """
+    with open(artifact_path, "rb") as f:
+        dv = pickle.load(f)
+    if isinstance(dv, FeatureEncoder):
+        return dv
+    return FeatureEncoder.from_dict_vectorizer(dv)
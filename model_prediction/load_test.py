@@ -0,0 +1,86 @@
+"""Load test /predict endpoints, throughput and latency percentiles.
+
+python load_test.py --url http://localhost:9696/predict --url http://localhost:9697/predict
+"""
+import json
+import time
+import argparse
+import threading
+
+import numpy as np
+import requests
+
+
+def run_client(url, body, headers, deadline, latencies, errors):
+    session = requests.Session()
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        try:
+            response = session.post(url, data=body, headers=headers, timeout=30)
+            ok = response.status_code == 200
+        except requests.RequestException:
+            ok = False
+        if ok:
+            latencies.append(time.perf_counter() - start)
+        else:
+            errors.append(1)
+
+
+def load_test(url, body, headers, concurrency=16, duration=20, warmup=2):
+    """
+    post body from concurrency clients for duration seconds,
+    return requests per second and latency percentiles in ms
+    """
+    run_client(url, body, headers, time.perf_counter() + warmup, [], [])
+    latencies, errors = [], []
+    deadline = time.perf_counter() + duration
+    clients = [
+        threading.Thread(
+            target=run_client, args=(url, body, headers, deadline, latencies, errors)
+        )
+        for _ in range(concurrency)
+    ]
+    for client in clients:
+        client.start()
+    for client in clients:
+        client.join()
+    latencies_ms = np.array(latencies) * 1000
+    return {
+        "url": url,
+        "requests": len(latencies),
+        "errors": len(errors),
+        "rps": round(len(latencies) / duration, 1),
+        "p50_ms": round(float(np.percentile(latencies_ms, 50)), 1),
+        "p95_ms": round(float(np.percentile(latencies_ms, 95)), 1),
+        "p99_ms": round(float(np.percentile(latencies_ms, 99)), 1),
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--url", action="append", required=True, help="repeat to compare")
+    parser.add_argument("--data", default="json_records.json", help="json records file")
+    parser.add_argument("--rows", type=int, default=0, help="rows per request, 0 all")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=20, help="seconds per url")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    with open(args.data) as f:
+        records = json.load(f)
+    if args.rows:
+        records = records[: args.rows]
+    request_body = json.dumps(records)
+    request_headers = {"Content-Type": "application/json"}
+    for endpoint in args.url:
+        print(
+            load_test(
+                endpoint,
+                request_body,
+                request_headers,
+                args.concurrency,
+                args.duration,
+            )
+        )
@@ -0,0 +1,182 @@
+"""Prometheus text format metrics of the prediction service, without dependencies.
+
+METRICS_ENABLED=0 turns every observation into a no-op.
+metrics are per process, with gunicorn every worker reports its own.
+"""
+import os
+import time
+import bisect
+import threading
+import contextlib
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1").lower() not in ("0", "false", "no")
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+DEFAULT_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0,
+)
+
+REGISTRY = []
+_disabled_timer = contextlib.nullcontext()
+
+
+def format_labels(labelnames, values, extra=()):
+    pairs = list(zip(labelnames, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (
+        (name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in pairs
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+class Counter:
+    """
+    monotonic counter, one value per combination of label values
+    """
+
+    kind = "counter"
+
+    def __init__(self, name, documentation, labelnames=(), enabled=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.enabled = METRICS_ENABLED if enabled is None else enabled
+        self._lock = threading.Lock()
+        self._values = {}
+        REGISTRY.append(self)
+
+    def inc(self, amount=1, **labels):
+        if not self.enabled:
+            return
+        key = tuple(labels[name] for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(tuple(labels[name] for name in self.labelnames), 0)
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for key, value in sorted(values.items()):
+            yield f"{self.name}{format_labels(self.labelnames, key)} {value}"
+
+
+class CallbackCounter:
+    """
+    counter read from a function when metrics are rendered,
+    for counts kept elsewhere like prediction cache hits
+    """
+
+    kind = "counter"
+
+    def __init__(self, name, documentation, callback):
+        self.name = name
+        self.documentation = documentation
+        self.callback = callback
+        REGISTRY.append(self)
+
+    def samples(self):
+        yield f"{self.name} {self.callback()}"
+
+
+class Histogram:
+    """
+    cumulative bucket counts, sum and count of observed values per label values
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS,
+                 enabled=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self.enabled = METRICS_ENABLED if enabled is None else enabled
+        self._lock = threading.Lock()
+        self._values = {}
+        REGISTRY.append(self)
+
+    def observe(self, value, **labels):
+        if not self.enabled:
+            return
+        key = tuple(labels[name] for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                # bucket counts, +Inf bucket, sum
+                counts = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[index] += 1
+            counts[-1] += value
+
+    def time(self, **labels):
+        """
+        context manager observing elapsed seconds
+        """
+        if not self.enabled:
+            return _disabled_timer
+        return _Timer(self, labels)
+
+    def count(self, **labels):
+        counts = self._values.get(tuple(labels[name] for name in self.labelnames))
+        return 0 if counts is None else sum(counts[:-1])
+
+    def samples(self):
+        with self._lock:
+            values = {key: list(counts) for key, counts in self._values.items()}
+        for key, counts in sorted(values.items()):
+            cumulative = 0
+            bounds = [str(bound) for bound in self.buckets] + ["+Inf"]
+            for bound, count in zip(bounds, counts[:-1]):
+                cumulative += count
+                labels = format_labels(self.labelnames, key, [("le", bound)])
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = format_labels(self.labelnames, key)
+            yield f"{self.name}_sum{labels} {counts[-1]}"
+            yield f"{self.name}_count{labels} {cumulative}"
+
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+
+
+def render():
+    """
+    all registered metrics in prometheus text exposition format
+    """
+    lines = []
+    for metric in REGISTRY:
+        lines.append(f"# HELP {metric.name} {metric.documentation}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(metric.samples())
+    return "\n".join(lines) + "\n"
+
+
+REQUESTS = Counter(
+    "predict_requests_total", "predict requests by response status", ["status"]
+)
+REQUEST_SECONDS = Histogram("predict_request_seconds", "predict request latency")
+ROWS = Counter("predict_rows_total", "feature rows predicted")
+STAGE_SECONDS = Histogram(
+    "predict_stage_seconds",
+    "time per stage: load_model_artifact, load_artifact, prepare_features, "
+    "model_predict, format_date",
+    ["stage"],
+)
+MODEL_LOADS = Counter(
+    "model_loads_total", "models loaded by source: registry, s3, local", ["source"]
+)
@@ -0,0 +1,118 @@
+"""Coalesce concurrent prediction requests into one encode and predict call."""
+import os
+import time
+import queue
+import threading
+from concurrent.futures import Future
+
+import pandas as pd
+
+# 0 disables micro batching
+PREDICT_BATCH_WINDOW_MS = float(os.getenv("PREDICT_BATCH_WINDOW_MS", "0"))
+PREDICT_BATCH_MAX_ROWS = int(os.getenv("PREDICT_BATCH_MAX_ROWS", "2048"))
+
+
+class MicroBatcher:
+    """
+    requests are queued, a worker thread takes the first one and waits
+    up to window_ms for more, until max_rows rows, then predicts them at once
+    and gives every request back its own rows in order.
+    only requests with the same columns and dtypes are predicted together,
+    so date in epoch milliseconds and date typed columns are not mixed.
+    if a batch fails its requests are predicted one by one,
+    so only a bad request gets the error.
+    """
+
+    def __init__(self, predict_fn, window_ms=PREDICT_BATCH_WINDOW_MS,
+                 max_rows=PREDICT_BATCH_MAX_ROWS):
+        self.predict_fn = predict_fn
+        self.window = window_ms / 1000
+        self.max_rows = max_rows
+        self._queue = queue.Queue()
+        self._worker_pid = None
+        self._lock = threading.Lock()
+
+    def submit(self, raw_data):
+        """
+        queue one request dataframe, return future of its prediction dataframe
+        """
+        self._start_worker()
+        future = Future()
+        self._queue.put((raw_data, future))
+        return future
+
+    def predict(self, raw_data):
+        """
+        blocking version of submit, same result as predict_fn(raw_data)
+        """
+        return self.submit(raw_data).result()
+
+    def _start_worker(self):
+        # threads do not survive fork, start one per process
+        if self._worker_pid == os.getpid():
+            return
+        with self._lock:
+            if self._worker_pid == os.getpid():
+                return
+            self._queue = queue.Queue()
+            self._worker_pid = os.getpid()
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def _collect(self):
+        """
+        block for the first request, then take more until window ends or max_rows
+        """
+        batch = [self._queue.get()]
+        n_rows = len(batch[0][0])
+        wait_until = time.monotonic() + self.window
+        while n_rows < self.max_rows:
+            try:
+                item = self._queue.get(timeout=max(wait_until - time.monotonic(), 0))
+            except queue.Empty:
+                break
+            batch.append(item)
+            n_rows += len(item[0])
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            groups = {}
+            for raw_data, future in batch:
+                key = tuple(raw_data.dtypes.astype(str).items())
+                groups.setdefault(key, []).append((raw_data, future))
+            for items in groups.values():
+                self._predict_group(items)
+
+    def _predict_group(self, items):
+        items = [(raw_data, future) for raw_data, future in items
+                 if future.set_running_or_notify_cancel()]
+        if not items:
+            return
+        try:
+            combined = pd.concat([raw_data for raw_data, _ in items], ignore_index=True)
+            prediction = self.predict_fn(combined)
+        except Exception as e:
+            if len(items) == 1:
+                items[0][1].set_exception(e)
+                return
+            for raw_data, future in items:
+                try:
+                    future.set_result(self.predict_fn(raw_data))
+                except Exception as request_error:
+                    future.set_exception(request_error)
+            return
+        start = 0
+        for raw_data, future in items:
+            stop = start + len(raw_data)
+            future.set_result(prediction.iloc[start:stop].reset_index(drop=True))
+            start = stop
+
+
+def from_env(predict_fn):
+    """
+    micro batcher if PREDICT_BATCH_WINDOW_MS > 0, else None
+    """
+    if PREDICT_BATCH_WINDOW_MS <= 0:
+        return None
+    return MicroBatcher(predict_fn, PREDICT_BATCH_WINDOW_MS, PREDICT_BATCH_MAX_ROWS)
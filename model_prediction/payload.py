@@ -0,0 +1,134 @@
+"""Request and response body formats of the predict endpoint."""
+import json
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+JSON = "application/json"
+ARROW = "application/vnd.apache.arrow.stream"
+PARQUET = "application/vnd.apache.parquet"
+# column oriented json is json with orient=columns parameter
+JSON_COLUMNS = "application/json; orient=columns"
+
+# media type of response body per format
+CONTENT_TYPES = {JSON: JSON, JSON_COLUMNS: JSON, ARROW: ARROW, PARQUET: PARQUET}
+
+MEDIA_TYPES = {
+    "application/json": JSON,
+    "application/vnd.apache.arrow.stream": ARROW,
+    "application/x-arrow": ARROW,
+    "application/vnd.apache.parquet": PARQUET,
+    "application/x-parquet": PARQUET,
+}
+
+
+class UnsupportedFormat(Exception):
+    """
+    content type (status 415) or accept header (status 406) with no supported format
+    """
+
+    def __init__(self, message, status):
+        super().__init__(message)
+        self.status = status
+
+
+class InvalidBody(Exception):
+    """
+    request body that does not decode in its format (status 400)
+    """
+
+    status = 400
+
+
+def parse_media_type(value):
+    """
+    split 'type/subtype; key=value' into media type and parameters
+    """
+    parts = [part.strip() for part in value.split(";")]
+    params = {}
+    for part in parts[1:]:
+        if "=" in part:
+            key, val = part.split("=", 1)
+            params[key.strip().lower()] = val.strip().strip('"').lower()
+    return parts[0].lower(), params
+
+
+def resolve_format(value):
+    """
+    format of one media type, None if not supported
+    """
+    media_type, params = parse_media_type(value)
+    if media_type in ("*/*", "application/*"):
+        return JSON
+    fmt = MEDIA_TYPES.get(media_type)
+    if fmt == JSON and params.get("orient") == "columns":
+        return JSON_COLUMNS
+    return fmt
+
+
+def request_format(content_type):
+    """
+    format of request body, json when content type is missing
+    """
+    if not content_type:
+        return JSON
+    fmt = resolve_format(content_type)
+    if fmt is None:
+        raise UnsupportedFormat(f"unsupported content type {content_type}", 415)
+    return fmt
+
+
+def response_format(accept):
+    """
+    best supported format in accept header by q value,
+    json records when accept is missing
+    """
+    if not accept:
+        return JSON
+    choices = []
+    for position, value in enumerate(accept.split(",")):
+        _, params = parse_media_type(value)
+        try:
+            quality = float(params.get("q", 1))
+        except ValueError:
+            quality = 0
+        fmt = resolve_format(value)
+        if fmt is not None and quality > 0:
+            choices.append((-quality, position, fmt))
+    if not choices:
+        raise UnsupportedFormat(f"no supported format in accept {accept}", 406)
+    return min(choices)[2]
+
+
+def decode(body, fmt):
+    """
+    request body to dataframe,
+    json is either list of records or dict of columns
+    """
+    # malformed json and arrow errors are both value errors
+    try:
+        if fmt == ARROW:
+            return pa.ipc.open_stream(body).read_all().to_pandas()
+        if fmt == PARQUET:
+            return pq.read_table(pa.BufferReader(body)).to_pandas()
+        return pd.DataFrame(json.loads(body))
+    except ValueError as e:
+        raise InvalidBody(f"invalid request body: {e}") from e
+
+
+def encode(df, fmt):
+    """
+    dataframe to response body
+    """
+    if fmt in (ARROW, PARQUET):
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        sink = pa.BufferOutputStream()
+        if fmt == ARROW:
+            with pa.ipc.new_stream(sink, table.schema) as writer:
+                writer.write_table(table)
+        else:
+            pq.write_table(table, sink)
+        return sink.getvalue().to_pybytes()
+    orient = "list" if fmt == JSON_COLUMNS else "records"
+    return json.dumps(df.to_dict(orient=orient))
@@ -1,10 +1,21 @@
 """This module handles model prediction logic for the ML pipeline."""
 import os
-import pickle
+import threading
+import time
 
-import mlflow
 import pandas as pd
-import requests
+
+import metrics
+from artifact_cache import ArtifactCache
+from feature_encoder import FeatureEncoder, load_encoder
+from prediction_cache import PREDICTION_CACHE_URL, PredictionCache, backend_from_url
+from served_log import ServedLog
+
+MODEL_REFRESH_SECONDS = float(os.getenv("MODEL_REFRESH_SECONDS", "300"))
+MLFLOW_PROBE_TIMEOUT = float(os.getenv("MLFLOW_PROBE_TIMEOUT", "5"))
+
+# mlflow and requests are imported where models are loaded,
+# they take seconds to import and are not needed to predict
 
 
 def is_mlflow_server_alive():
@@ -13,13 +24,20 @@ def is_mlflow_server_alive():
     this function is neccassery for gunicorn to handle connection error
     """
     tracking_uri = os.getenv("MLFLOW_TRACKING_URI", "")
+    if not tracking_uri:
+        return False
+    import requests
+
     try:
-        response = requests.get(tracking_uri, timeout=5)
+        response = requests.get(tracking_uri, timeout=MLFLOW_PROBE_TIMEOUT)
         return response.status_code == 200
     except requests.RequestException:
         return False
 
 
+artifact_cache = ArtifactCache()
+
+
 def get_model_location(run_id, model_name="model"):
     """
     get model location from environment variable,
@@ -39,45 +57,89 @@ def get_model_location(run_id, model_name="model"):
     return s3_uri
 
 
-def get_run_id_from_registry(model_name="model", model_stage="Production"):
+def get_registry_version(model_name="model", model_stage="Production"):
     """
-    get run_id from model registry, if model load from registry.
-    i can load model and artifacts from registry directly without run_id,
-    i need run_id as model version as output.
+    model version in model_stage of the registry
     """
+    import mlflow
+
     client = mlflow.tracking.MlflowClient()
     versions = client.get_latest_versions(model_name, stages=[model_stage])
     if not versions:
         raise Exception("No model found in the specified stage.")
-    return versions[0].run_id
+    return versions[0]
+
+
+def get_run_id_from_registry(model_name="model", model_stage="Production"):
+    """
+    get run_id from model registry, if model load from registry.
+    i can load model and artifacts from registry directly without run_id,
+    i need run_id as model version as output.
+    """
+    return get_registry_version(model_name, model_stage).run_id
 
 
 def load_model_from_registry(model_name, artifact_name):
     """
     load model from mlflow model registry,
-    load model in production
+    load model in production.
+    the production version is read once and that version is downloaded,
+    so a promotion in between cannot cache another model under its run_id.
+    model and artifact are downloaded once per run_id into artifact_cache
     """
+    import mlflow
+
     mlflow_tracking_uri = os.getenv("MLFLOW_TRACKING_URI", "http://localhost:5000")
     mlflow.set_tracking_uri(mlflow_tracking_uri)
-    model = mlflow.pyfunc.load_model(f"models:/{model_name}/Production")
-    registry_run_id = get_run_id_from_registry()
-    artifact = mlflow.artifacts.download_artifacts(
-        run_id=registry_run_id, artifact_path=artifact_name
+    version = get_registry_version(model_name)
+    registry_run_id = version.run_id
+    model_path = artifact_cache.fetch(
+        registry_run_id,
+        model_name,
+        lambda dst_path: mlflow.artifacts.download_artifacts(
+            artifact_uri=f"models:/{model_name}/{version.version}", dst_path=dst_path
+        ),
+    )
+    model = mlflow.pyfunc.load_model(model_path)
+    artifact = artifact_cache.fetch(
+        registry_run_id,
+        artifact_name,
+        lambda dst_path: mlflow.artifacts.download_artifacts(
+            run_id=registry_run_id, artifact_path=artifact_name, dst_path=dst_path
+        ),
     )
 
     print("load model and artifact from MLflow server")
+    metrics.MODEL_LOADS.inc(source="registry")
     return (model, artifact, registry_run_id)
 
 
 def load_model_from_s3(run_id, artifact_name):
     """
-    load model based on run_id from s3 bucket
+    load model based on run_id from s3 bucket,
+    downloaded once per run_id into artifact_cache
     """
+    import mlflow
+
     model_location = get_model_location(run_id)
-    model = mlflow.pyfunc.load_model(model_location)
+    model_path = artifact_cache.fetch(
+        run_id,
+        model_location,
+        lambda dst_path: mlflow.artifacts.download_artifacts(
+            artifact_uri=model_location, dst_path=dst_path
+        ),
+    )
+    model = mlflow.pyfunc.load_model(model_path)
     artifact_uri = model_location.rsplit("/", 1)[0] + "/" + artifact_name
-    artifact_path = mlflow.artifacts.download_artifacts(artifact_uri=artifact_uri)
+    artifact_path = artifact_cache.fetch(
+        run_id,
+        artifact_uri,
+        lambda dst_path: mlflow.artifacts.download_artifacts(
+            artifact_uri=artifact_uri, dst_path=dst_path
+        ),
+    )
     print("load model from S3")
+    metrics.MODEL_LOADS.inc(source="s3")
     return (model, artifact_path, run_id)
 
 
@@ -86,10 +148,13 @@ def load_model_from_local(model_example_path, artifact_name):
     sample model saved in local folder,
     if anything in cloud is not reachable, read from local
     """
+    import mlflow
+
     model = mlflow.pyfunc.load_model(model_example_path)
     artifacts = model_example_path.rsplit("/", 1)[0] + "/" + artifact_name
     run_id = "test"
     print("load model from test examples")
+    metrics.MODEL_LOADS.inc(source="local")
     return (model, artifacts, run_id)
 
 
@@ -100,41 +165,230 @@ def load_model_artifact(
     load model and arfifacts
     if mlflow server is alive read from mlflow server,
     if not read from s3 bucket based on run_id,
-    if s3 cannot reach or run_id not found, read from local
+    if s3 cannot reach or run_id not found, read from local.
+    returns (model, artifact, run_id, source), source is registry, s3 or local
     """
     if is_mlflow_server_alive():
         try:
-            return load_model_from_registry(model_name, artifact_name)
+            return (*load_model_from_registry(model_name, artifact_name), "registry")
         except Exception:
             print("Mlflow server not accessible. try to load model from S3 bucket")
 
     run_id = os.getenv("MLFLOW_RUN_ID")
     if run_id:
         try:
-            return load_model_from_s3(run_id, artifact_name)
+            return (*load_model_from_s3(run_id, artifact_name), "s3")
         except Exception:
             print("S3 not accessible or model not founnd")
             try:
-                return load_model_from_local(model_example_path, artifact_name)
+                model = load_model_from_local(model_example_path, artifact_name)
+                return (*model, "local")
             except Exception:
                 print("failed to load model")
     else:
         print("run_id not found")
-    return load_model_from_local(model_example_path, artifact_name)
+    return (*load_model_from_local(model_example_path, artifact_name), "local")
 
 
 def load_artifact(artifact_path):
     """
-    load artifacts
+    load dict vectorizer artifact as columnar feature encoder
+    """
+    return load_encoder(artifact_path)
+
+
+class BoosterModel:
+    """
+    xgboost flavor of a pyfunc model, predict calls the booster directly
+    on the sparse matrix from the encoder, without pyfunc schema enforcement
+    and dataframe conversion
+    """
+
+    def __init__(self, booster, pyfunc_model, iteration_range=(0, 0)):
+        self.booster = booster
+        self.metadata = pyfunc_model.metadata
+        self.iteration_range = iteration_range
+
+    def predict(self, X):
+        return self.booster.inplace_predict(X, iteration_range=self.iteration_range)
+
+
+def pyfunc_iteration_range(raw_model):
     """
-    with open(artifact_path, "rb") as f:
-        dv = pickle.load(f)
-    return dv
+    trees pyfunc predicts with: sklearn models use best_iteration
+    after early stopping, like XGBModel.predict, a plain Booster uses all trees
+    """
+    if not hasattr(raw_model, "get_booster") or raw_model.booster == "gblinear":
+        return (0, 0)
+    best_iteration = raw_model.get_booster().attr("best_iteration")
+    if best_iteration is None:
+        return (0, 0)
+    return (0, int(best_iteration) + 1)
+
+
+def native_model(model):
+    """
+    use the booster directly if the model has xgboost flavor,
+    other flavors are used through pyfunc
+    """
+    flavors = getattr(getattr(model, "metadata", None), "flavors", None) or {}
+    if "xgboost" not in flavors:
+        return model
+    try:
+        raw_model = model.get_raw_model()
+    except Exception:
+        print("failed to unwrap xgboost model, predict with pyfunc")
+        return model
+    booster = raw_model.get_booster() if hasattr(raw_model, "get_booster") else raw_model
+    return BoosterModel(booster, model, pyfunc_iteration_range(raw_model))
+
+
+# first element of the model key when a tracking uri is set but the registry cannot be read
+REGISTRY_UNKNOWN = "registry-unknown"
+
+
+def loaded_model_key(key, run_id, source):
+    """
+    model key of the model a load returned, key is get_model_key before the load.
+    the registry run_id is the loaded run_id when the model came from the registry,
+    so a promotion during the load is not loaded again, and source:run_id otherwise,
+    so a fallback model after a failed registry load is reloaded on next refresh
+    """
+    if source == "registry":
+        return (run_id, key[1], key[2])
+    if key[0] is None:
+        return key
+    return (f"{source}:{run_id}", key[1], key[2])
+
+
+def get_model_key(model_name="model"):
+    """
+    identify the model load_model_artifact would pick right now, without loading it.
+    production run_id in registry if mlflow server is alive,
+    plus MODEL_LOCATION and MLFLOW_RUN_ID environment variables.
+    the run_id is REGISTRY_UNKNOWN if MLFLOW_TRACKING_URI is set
+    but the server is down or the production version cannot be read
+    """
+    registry_run_id = None
+    if os.getenv("MLFLOW_TRACKING_URI"):
+        registry_run_id = REGISTRY_UNKNOWN
+        if is_mlflow_server_alive():
+            try:
+                registry_run_id = get_run_id_from_registry(model_name)
+            except Exception:
+                print("failed to read production version from registry")
+    return (registry_run_id, os.getenv("MODEL_LOCATION"), os.getenv("MLFLOW_RUN_ID"))
+
+
+class ModelHolder:
+    """
+    keep model, dict vectorizer and run_id in memory for the whole process.
+    a background thread checks the model key every refresh_seconds,
+    and only reloads when the key changed. refresh_seconds <= 0 disables checking.
+    """
+
+    def __init__(self, refresh_seconds=MODEL_REFRESH_SECONDS):
+        self.refresh_seconds = refresh_seconds
+        self._lock = threading.Lock()
+        self._key = None
+        self._loaded = None
+        self._refresher_pid = None
+
+    def _load(self, key):
+        """
+        load model, key is get_model_key before loading,
+        return (model key of the loaded model, (model, dv, run_id))
+        """
+        with metrics.STAGE_SECONDS.time(stage="load_model_artifact"):
+            model, artifact_path, run_id, source = load_model_artifact()
+        with metrics.STAGE_SECONDS.time(stage="load_artifact"):
+            dv = load_artifact(artifact_path)
+        return loaded_model_key(key, run_id, source), (native_model(model), dv, run_id)
+
+    def preload(self):
+        """
+        load model now without starting the refresh thread,
+        with gunicorn --preload the master loads it once and forked workers
+        share it copy-on-write, each starts its refresh thread on first get
+        """
+        if self._loaded is None:
+            with self._lock:
+                if self._loaded is None:
+                    self._key, self._loaded = self._load(get_model_key())
+        return self._loaded
+
+    @property
+    def ready(self):
+        return self._loaded is not None
+
+    def get(self):
+        """
+        return (model, dv, run_id), load on first call
+        """
+        self.preload()
+        self._start_refresher()
+        return self._loaded
+
+    def get_keyed(self):
+        """
+        return ((model, dv, run_id), model key of that model) as one consistent pair
+        """
+        self.get()
+        with self._lock:
+            return self._loaded, self._key
+
+    def refresh(self):
+        """
+        reload model if model key changed, return True if reloaded.
+        while the registry cannot be read the current model is kept,
+        loading now would fall back to S3 or the local test model
+        """
+        key = get_model_key()
+        if self._loaded is not None and (key == self._key or key[0] == REGISTRY_UNKNOWN):
+            return False
+        loaded_key, loaded = self._load(key)
+        with self._lock:
+            self._key, self._loaded = loaded_key, loaded
+        print(f"model reloaded, model version {loaded[2]}")
+        return True
+
+    def _start_refresher(self):
+        # threads do not survive fork, so start one per process (gunicorn worker)
+        if self.refresh_seconds <= 0 or self._refresher_pid == os.getpid():
+            return
+        with self._lock:
+            if self._refresher_pid == os.getpid():
+                return
+            self._refresher_pid = os.getpid()
+        thread = threading.Thread(target=self._refresh_loop, daemon=True)
+        thread.start()
+
+    def _refresh_loop(self):
+        while True:
+            time.sleep(self.refresh_seconds)
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"model refresh failed, keep serving current model: {e}")
+
+
+model_holder = ModelHolder()
+prediction_cache = PredictionCache(backend=backend_from_url(PREDICTION_CACHE_URL))
+served_log = ServedLog()
+metrics.CallbackCounter(
+    "prediction_cache_hits_total", "rows served from prediction cache",
+    lambda: prediction_cache.hits,
+)
+metrics.CallbackCounter(
+    "prediction_cache_misses_total", "rows predicted by the model",
+    lambda: prediction_cache.misses,
+)
 
 
 def prepare_features(raw_data, dv):
     """
-    prepare features in dataframe to dict vectorizer
+    prepare features in dataframe with columnar encoder,
+    dv is either a fitted DictVectorizer or FeatureEncoder
     """
     categorical = ["sector"]
     numerical = [
@@ -148,24 +402,44 @@ def prepare_features(raw_data, dv):
         "spread",
         "vix_avg",
     ]
-    dicts = raw_data[categorical + numerical].to_dict(orient="records")
-    X = dv.transform(dicts)
+    if not isinstance(dv, FeatureEncoder):
+        dv = FeatureEncoder.from_dict_vectorizer(dv)
+    X = dv.transform(raw_data, categorical, numerical)
     return X
 
 
-def predict(raw_data):
+def predict(raw_data, serving=True):
     """
     calculate prediction from new data passed in
-    and model dict vectorizer loaded
+    and model dict vectorizer held in memory by model_holder,
+    when serving, rows predicted before by the same model come from prediction_cache
+    and served rows are appended to served_log when SERVED_LOG_DIR is set,
+    batch jobs pass serving=False to skip both
     """
-    model, artifact_path, run_id = load_model_artifact()
-    dv = load_artifact(artifact_path)
-    X = prepare_features(raw_data, dv)
-    prediction = model.predict(X)
+    (model, dv, run_id), model_key = model_holder.get_keyed()
+    with metrics.STAGE_SECONDS.time(stage="prepare_features"):
+        X = prepare_features(raw_data, dv)
+    with metrics.STAGE_SECONDS.time(stage="model_predict"):
+        if serving:
+            # model key with source and locations, a run_id alone can name different models
+            cache_key = "|".join(str(part) for part in (run_id, *model_key))
+            prediction = prediction_cache.predict(model, X, cache_key)
+        else:
+            prediction = model.predict(X)
     raw_data["predicted_1m_return"] = prediction
     raw_data["model_version"] = run_id
-    raw_data["date"] = pd.to_datetime(raw_data["date"], errors="coerce", unit="ms")
-    raw_data["date"] = raw_data["date"].dt.strftime("%Y-%m-%d")
+    with metrics.STAGE_SECONDS.time(stage="format_date"):
+        # json records carry date as epoch milliseconds, arrow and parquet as dates
+        if pd.api.types.is_numeric_dtype(raw_data["date"]):
+            raw_data["date"] = pd.to_datetime(
+                raw_data["date"], errors="coerce", unit="ms"
+            )
+        else:
+            raw_data["date"] = pd.to_datetime(raw_data["date"], errors="coerce")
+        raw_data["date"] = raw_data["date"].dt.strftime("%Y-%m-%d")
+    metrics.ROWS.inc(len(raw_data))
+    if serving:
+        served_log.append(raw_data)
     return raw_data
 
 
@@ -1,28 +1,79 @@
 """Flask API for serving machine learning predictions."""
-import pandas as pd
-from flask import Flask, request, jsonify
-from predict import predict
+import os
+
+from flask import Flask, Response, request
+
+import metrics
+import payload
+import micro_batch
+from predict import predict, model_holder
 
 app = Flask("monthly_stock_return_prediction")
+# coalesce concurrent requests when PREDICT_BATCH_WINDOW_MS is set,
+# needs gunicorn --threads to have concurrent requests in one worker
+batcher = micro_batch.from_env(predict)
+predict_fn = batcher.predict if batcher else predict
+
+# load model when the app is imported, with gunicorn --preload
+# the master loads it once before forking workers
+if os.getenv("PRELOAD_MODEL", "0") == "1":
+    model_holder.preload()
 
 
 @app.route("/predict", methods=["POST"])
 def predict_endpoint():
     '''
-    handle post request for model prediction
+    handle post request for model prediction,
+    count requests by status and time them
     '''
-    new_data = request.get_json()
-    new_data_df = pd.DataFrame(new_data)
-    prediction = predict(new_data_df)
+    with metrics.REQUEST_SECONDS.time():
+        status = 500
+        try:
+            response = app.make_response(predict_response())
+            status = response.status_code
+            return response
+        finally:
+            metrics.REQUESTS.inc(status=str(status))
 
-    columns_to_return = ["ticker", "date", "predicted_1m_return", "model_version"]
-    result = prediction[columns_to_return].to_dict(orient="records")
 
-    return jsonify(result)
+def predict_response():
+    '''
+    prediction of request body,
+    body format from Content-Type and response format from Accept header:
+    json records (default), json columns, arrow stream or parquet
+    '''
+    try:
+        request_format = payload.request_format(request.headers.get("Content-Type"))
+        response_format = payload.response_format(request.headers.get("Accept"))
+    except payload.UnsupportedFormat as e:
+        return {"error": str(e)}, e.status
+
+    try:
+        new_data_df = payload.decode(request.get_data(), request_format)
+    except payload.InvalidBody as e:
+        return {"error": str(e)}, e.status
+    prediction = predict_fn(new_data_df)
+
+    columns_to_return = ["ticker", "date", "predicted_1m_return", "model_version"]
+    body = payload.encode(prediction[columns_to_return], response_format)
+    return Response(body, content_type=payload.CONTENT_TYPES[response_format])
 
 @app.route("/health", methods=["GET"])
 def health():
     return {"status": "ok"}, 200
 
+@app.route("/ready", methods=["GET"])
+def ready():
+    '''
+    ok only once a model is loaded, for readiness probes
+    '''
+    if not model_holder.ready:
+        return {"status": "loading"}, 503
+    return {"status": "ok", "model_version": model_holder.get()[2]}, 200
+
+@app.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
 if __name__ == "__main__":
     app.run(debug=True, host="0.0.0.0", port=9696)
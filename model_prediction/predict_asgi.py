@@ -0,0 +1,142 @@
+"""ASGI API for serving predictions, same contract as predict_app.
+
+one process holds one model, requests are handled on the event loop
+and prediction runs in a bounded thread pool.
+"""
+import os
+import asyncio
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+
+from starlette.routing import Route
+from starlette.responses import Response, JSONResponse
+from starlette.applications import Starlette
+
+import metrics
+import payload
+import micro_batch
+from predict import predict, model_holder
+
+# threads running predictions, xgboost releases the GIL while predicting
+PREDICT_THREADS = int(os.getenv("PREDICT_THREADS", "4"))
+# requests running or waiting for a thread, more are rejected with 503
+PREDICT_QUEUE = int(os.getenv("PREDICT_QUEUE", "64"))
+
+executor = ThreadPoolExecutor(max_workers=PREDICT_THREADS, thread_name_prefix="predict")
+# coalesce concurrent requests when PREDICT_BATCH_WINDOW_MS is set
+batcher = micro_batch.from_env(predict)
+in_flight = 0
+
+columns_to_return = ["ticker", "date", "predicted_1m_return", "model_version"]
+
+
+def predict_body(body, request_format, response_format):
+    """
+    decode, predict and encode one request body, runs in executor
+    """
+    new_data_df = payload.decode(body, request_format)
+    prediction = predict(new_data_df)
+    return payload.encode(prediction[columns_to_return], response_format)
+
+
+async def predict_batched(body, request_format, response_format):
+    """
+    decode and encode in executor, predict in micro batch with other requests
+    """
+    loop = asyncio.get_running_loop()
+    new_data_df = await loop.run_in_executor(
+        executor, payload.decode, body, request_format
+    )
+    prediction = await asyncio.wrap_future(batcher.submit(new_data_df))
+    return await loop.run_in_executor(
+        executor, payload.encode, prediction[columns_to_return], response_format
+    )
+
+
+async def predict_endpoint(request):
+    """
+    handle post request for model prediction,
+    count requests by status and time them
+    """
+    with metrics.REQUEST_SECONDS.time():
+        status = 500
+        try:
+            response = await predict_response(request)
+            status = response.status_code
+            return response
+        finally:
+            metrics.REQUESTS.inc(status=str(status))
+
+
+async def predict_response(request):
+    """
+    prediction of request body, formats are negotiated like predict_app
+    """
+    global in_flight
+    try:
+        request_format = payload.request_format(request.headers.get("content-type"))
+        response_format = payload.response_format(request.headers.get("accept"))
+    except payload.UnsupportedFormat as e:
+        return JSONResponse({"error": str(e)}, status_code=e.status)
+
+    if in_flight >= PREDICT_QUEUE:
+        return JSONResponse(
+            {"error": "too many requests in progress"},
+            status_code=503,
+            headers={"Retry-After": "1"},
+        )
+    in_flight += 1
+    try:
+        body = await request.body()
+        if batcher is not None:
+            result = await predict_batched(body, request_format, response_format)
+        else:
+            loop = asyncio.get_running_loop()
+            result = await loop.run_in_executor(
+                executor, predict_body, body, request_format, response_format
+            )
+    except payload.InvalidBody as e:
+        return JSONResponse({"error": str(e)}, status_code=e.status)
+    finally:
+        in_flight -= 1
+    return Response(result, media_type=payload.CONTENT_TYPES[response_format])
+
+
+async def health(request):
+    return JSONResponse({"status": "ok"})
+
+
+async def ready(request):
+    """
+    ok only once a model is loaded, for readiness probes
+    """
+    if not model_holder.ready:
+        return JSONResponse({"status": "loading"}, status_code=503)
+    return JSONResponse({"status": "ok", "model_version": model_holder.get()[2]})
+
+
+async def metrics_endpoint(request):
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    # load model before accepting requests, shared by all of them
+    await asyncio.get_running_loop().run_in_executor(executor, model_holder.get)
+    yield
+
+
+app = Starlette(
+    routes=[
+        Route("/predict", predict_endpoint, methods=["POST"]),
+        Route("/health", health, methods=["GET"]),
+        Route("/ready", ready, methods=["GET"]),
+        Route("/metrics", metrics_endpoint, methods=["GET"]),
+    ],
+    lifespan=lifespan,
+)
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run(app, host="0.0.0.0", port=9696)
@@ -1,8 +1,135 @@
+"""Backfill predictions over a features parquet, one month at a time."""
 import os
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
 import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
 import predict
 
-data = pd.read_parquet('features.parquet', engine='pyarrow')
-predicted_return = predict.predict(data)
-os.makedirs("output", exist_ok=True)
-predicted_return.to_parquet('output/backfill.parquet')
\ No newline at end of file
+
+def month_key(month_start):
+    """
+    output partition name of a month, month=2024-05
+    """
+    return f"month={pd.Timestamp(month_start):%Y-%m}"
+
+
+def month_path(output_path, month_start):
+    return os.path.join(output_path, month_key(month_start), "part-0.parquet")
+
+
+def list_months(dataset, batch_rows):
+    """
+    distinct month starts in the input, only date column is read
+    """
+    months = set()
+    for batch in dataset.to_batches(columns=["date"], batch_size=batch_rows):
+        dates = pd.to_datetime(batch.column("date").to_pandas())
+        months.update(dates.dt.to_period("M").dt.start_time.dropna().unique())
+    return sorted(months)
+
+
+def predict_month(input_path, output_path, month_start, batch_rows):
+    """
+    stream rows of one month through encode, predict and write,
+    at most batch_rows rows in memory. the output file is renamed into place
+    when the month is complete, so an interrupted month is done again on resume.
+    returns number of rows predicted
+    """
+    dataset = ds.dataset(input_path, format="parquet")
+    month_start = pd.Timestamp(month_start)
+    date_type = dataset.schema.field("date").type
+    month_filter = (ds.field("date") >= pa.scalar(month_start, date_type)) & (
+        ds.field("date") < pa.scalar(month_start + pd.offsets.MonthBegin(1), date_type)
+    )
+    columns = [name for name in dataset.schema.names if name != "__index_level_0__"]
+
+    path = month_path(output_path, month_start)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    writer = None
+    n_rows = 0
+    for batch in dataset.to_batches(
+        columns=columns, filter=month_filter, batch_size=batch_rows
+    ):
+        if batch.num_rows == 0:
+            continue
+        predicted = predict.predict(batch.to_pandas(), serving=False)
+        table = pa.Table.from_pandas(predicted, preserve_index=False)
+        if writer is None:
+            writer = pq.ParquetWriter(path + ".tmp", table.schema)
+        writer.write_table(table.cast(writer.schema))
+        n_rows += batch.num_rows
+    if writer is not None:
+        writer.close()
+        os.replace(path + ".tmp", path)
+    return n_rows
+
+
+def backfill(
+    input_path="features.parquet",
+    output_path="output/backfill",
+    batch_rows=50_000,
+    workers=0,
+    resume=True,
+):
+    """
+    predict every month of input_path into output_path/month=YYYY-MM/,
+    months already written are skipped when resume is True.
+    workers > 0 predicts months in a process pool, each process loads the model once
+    """
+    dataset = ds.dataset(input_path, format="parquet")
+    months = list_months(dataset, batch_rows)
+    todo = [
+        month
+        for month in months
+        if not (resume and os.path.exists(month_path(output_path, month)))
+    ]
+    print(f"backfill {len(todo)} of {len(months)} months into {output_path}")
+
+    if workers > 0:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {
+                month: executor.submit(
+                    predict_month, input_path, output_path, month, batch_rows
+                )
+                for month in todo
+            }
+            for month, future in futures.items():
+                print(f"{month_key(month)}: {future.result()} rows")
+    else:
+        for month in todo:
+            n_rows = predict_month(input_path, output_path, month, batch_rows)
+            print(f"{month_key(month)}: {n_rows} rows")
+    return todo
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--input", default="features.parquet", help="features parquet file or folder"
+    )
+    parser.add_argument(
+        "--output", default="output/backfill", help="output folder, one per month"
+    )
+    parser.add_argument(
+        "--batch-rows", type=int, default=50_000, help="rows in memory at a time"
+    )
+    parser.add_argument(
+        "--workers", type=int, default=0, help="processes, 0 runs in this process"
+    )
+    parser.add_argument(
+        "--no-resume",
+        dest="resume",
+        action="store_false",
+        help="predict months already in output again",
+    )
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    backfill(args.input, args.output, args.batch_rows, args.workers, args.resume)
@@ -0,0 +1,189 @@
+"""Cache of predictions keyed by model version and encoded feature row."""
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+# rows kept in process, 0 disables the cache
+PREDICTION_CACHE_SIZE = int(os.getenv("PREDICTION_CACHE_SIZE", "100000"))
+# optional shared backend, redis://host:6379/0 or sqlite:///path/to/cache.db
+PREDICTION_CACHE_URL = os.getenv("PREDICTION_CACHE_URL", "")
+
+
+def row_hashes(X):
+    """
+    uint64 hash of every row of the encoded feature matrix
+    """
+    dense = X.toarray() if hasattr(X, "toarray") else np.asarray(X)
+    return pd.util.hash_pandas_object(pd.DataFrame(dense), index=False).to_numpy()
+
+
+class MemoryBackend:
+    """
+    shared backend stand-in with the redis mget and mset calls, for tests
+    """
+
+    def __init__(self):
+        self.store = {}
+
+    def mget(self, keys):
+        return [self.store.get(key) for key in keys]
+
+    def mset(self, mapping):
+        self.store.update(mapping)
+
+
+class SqliteBackend:
+    """
+    shared on disk backend, one sqlite file for all processes on a host
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        with self._connection() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS prediction (key TEXT PRIMARY KEY, value BLOB)"
+            )
+
+    def _connection(self):
+        if getattr(self._local, "connection", None) is None:
+            self._local.connection = sqlite3.connect(self.path, timeout=5)
+        return self._local.connection
+
+    def mget(self, keys):
+        connection = self._connection()
+        found = {}
+        # sqlite limits number of parameters of one statement
+        for i in range(0, len(keys), 500):
+            chunk = keys[i : i + 500]
+            rows = connection.execute(
+                "SELECT key, value FROM prediction WHERE key IN "
+                f"({','.join('?' * len(chunk))})",
+                chunk,
+            ).fetchall()
+            found.update(rows)
+        return [found.get(key) for key in keys]
+
+    def mset(self, mapping):
+        with self._connection() as connection:
+            connection.executemany(
+                "INSERT OR REPLACE INTO prediction VALUES (?, ?)", mapping.items()
+            )
+
+
+def backend_from_url(url):
+    """
+    shared backend from PREDICTION_CACHE_URL, None if not set
+    """
+    if not url:
+        return None
+    if url.startswith("sqlite:///"):
+        return SqliteBackend(url[len("sqlite:///") :])
+    if url.startswith("redis://"):
+        import redis
+
+        return redis.Redis.from_url(url)
+    raise ValueError(f"unsupported prediction cache url {url}")
+
+
+class PredictionCache:
+    """
+    lru of predictions in process, keyed by model key and row hash,
+    in front of an optional shared backend with mget and mset.
+    the model key names the model version and where it was loaded from.
+    local entries are dropped when the model key changes, shared keys contain it,
+    so predictions of another model are never returned.
+    hits are tracked apart from values, a NaN prediction is cached like any other.
+    """
+
+    def __init__(self, max_size=PREDICTION_CACHE_SIZE, backend=None):
+        self.max_size = max_size
+        self.backend = backend
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._model_key = None
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": len(self._entries),
+            "max_size": self.max_size,
+        }
+
+    def _local_get(self, model_key, hashes):
+        """
+        cached values and mask of rows found
+        """
+        values = np.full(len(hashes), np.nan, dtype=np.float64)
+        found = np.zeros(len(hashes), dtype=bool)
+        with self._lock:
+            if model_key != self._model_key:
+                self._entries.clear()
+                self._model_key = model_key
+            for i, row_hash in enumerate(hashes.tolist()):
+                value = self._entries.get(row_hash)
+                if value is not None:
+                    self._entries.move_to_end(row_hash)
+                    values[i] = value
+                    found[i] = True
+        return values, found
+
+    def _local_put(self, model_key, hashes, values):
+        with self._lock:
+            if model_key != self._model_key:
+                return
+            for row_hash, value in zip(hashes.tolist(), values.tolist()):
+                self._entries[row_hash] = value
+                self._entries.move_to_end(row_hash)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def predict(self, model, X, model_key):
+        """
+        model.predict(X) for rows not cached, cached values for the others
+        """
+        if self.max_size <= 0:
+            return model.predict(X)
+        hashes = row_hashes(X)
+        values, found = self._local_get(model_key, hashes)
+        missing = np.flatnonzero(~found)
+
+        if self.backend is not None and len(missing):
+            keys = [f"{model_key}:{row_hash}" for row_hash in hashes[missing].tolist()]
+            shared = self.backend.mget(keys)
+            shared_found = [i for i, value in enumerate(shared) if value is not None]
+            if shared_found:
+                shared_values = np.array([float(shared[i]) for i in shared_found])
+                values[missing[shared_found]] = shared_values
+                self._local_put(model_key, hashes[missing[shared_found]], shared_values)
+                found[missing[shared_found]] = True
+                missing = np.flatnonzero(~found)
+
+        with self._lock:
+            self.hits += len(values) - len(missing)
+            self.misses += len(missing)
+        if len(missing) == 0:
+            return values.astype(np.float32)
+
+        # unique rows only, a batch may repeat the same features
+        unique_hashes, first, inverse = np.unique(
+            hashes[missing], return_index=True, return_inverse=True
+        )
+        predicted = np.asarray(model.predict(X[missing[first]]), dtype=np.float64)
+        values[missing] = predicted[inverse]
+        self._local_put(model_key, unique_hashes, predicted)
+        if self.backend is not None:
+            self.backend.mset(
+                {
+                    f"{model_key}:{row_hash}": repr(value)
+                    for row_hash, value in zip(unique_hashes.tolist(), predicted.tolist())
+                }
+            )
+        return values.astype(np.float32)
@@ -36,7 +36,7 @@ docker run -d \
     -p 9696:8080 \
     ${LOCAL_IMAGE_NAME} 
 
-until docker exec my-prediction-app curl -s http://localhost:8080/health | grep ok; do
+until docker exec my-prediction-app curl -s http://localhost:8080/ready | grep ok; do
     echo "Still waiting..."
     sleep 1
 done
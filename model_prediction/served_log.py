@@ -0,0 +1,104 @@
+"""Append-only log of served prediction batches, read by the monitoring stream consumer.
+
+SERVED_LOG_DIR enables it. every process appends to its own
+served-<host>-<pid>.jsonl file, so gunicorn workers never interleave lines.
+one line is one served batch:
+{"served_at": epoch seconds, "model_version": run id, "columns": {name: [values]}}
+lines are written by a background thread, a full queue drops the batch
+instead of slowing down the request.
+"""
+import os
+import json
+import time
+import queue
+import socket
+import threading
+
+import metrics
+
+SERVED_LOG_DIR = os.getenv("SERVED_LOG_DIR", "")
+SERVED_LOG_QUEUE = int(os.getenv("SERVED_LOG_QUEUE", "1000"))
+
+DROPPED = metrics.Counter(
+    "served_log_dropped_total", "served batches not logged because the queue was full"
+)
+
+
+def encode_batch(raw_data, served_at):
+    """
+    one json line of a prediction dataframe, nan values are written as null
+    """
+    frame = raw_data.drop(columns=["model_version"])
+    columns = {
+        name: frame[name].astype(object).where(frame[name].notna(), None).tolist()
+        for name in frame.columns
+    }
+    model_version = raw_data["model_version"].iloc[0] if len(raw_data) else None
+    record = {"served_at": served_at, "model_version": model_version, "columns": columns}
+    return json.dumps(record) + "\n"
+
+
+class ServedLog:
+    """
+    queue of served batches, written to log_dir by one thread per process
+    """
+
+    def __init__(self, log_dir=SERVED_LOG_DIR, max_queue=SERVED_LOG_QUEUE):
+        self.log_dir = log_dir
+        self.max_queue = max_queue
+        self._queue = queue.Queue(max_queue)
+        self._worker_pid = None
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return bool(self.log_dir)
+
+    def path(self):
+        return os.path.join(self.log_dir, f"served-{socket.gethostname()}-{os.getpid()}.jsonl")
+
+    def append(self, raw_data):
+        """
+        queue a prediction dataframe with predicted_1m_return and model_version,
+        it must not be changed afterwards
+        """
+        if not self.enabled or not len(raw_data):
+            return
+        self._start_worker()
+        try:
+            self._queue.put_nowait((raw_data, time.time()))
+        except queue.Full:
+            DROPPED.inc()
+
+    def flush(self):
+        """
+        wait until every queued batch is written
+        """
+        if self._worker_pid == os.getpid():
+            self._queue.join()
+
+    def _start_worker(self):
+        # threads do not survive fork, start one per process
+        if self._worker_pid == os.getpid():
+            return
+        with self._lock:
+            if self._worker_pid == os.getpid():
+                return
+            self._queue = queue.Queue(self.max_queue)
+            self._worker_pid = os.getpid()
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def _run(self):
+        os.makedirs(self.log_dir, exist_ok=True)
+        with open(self.path(), "a", encoding="utf-8") as f:
+            while True:
+                raw_data, served_at = self._queue.get()
+                try:
+                    f.write(encode_batch(raw_data, served_at))
+                    # flush when the queue is drained, readers skip a partial last line
+                    if self._queue.empty():
+                        f.flush()
+                except Exception as error:
+                    print(f"served log write failed: {error}")
+                finally:
+                    self._queue.task_done()
@@ -0,0 +1,91 @@
+"""Startup benchmark: time until /ready and latency of the first /predict.
+
+python startup_benchmark.py --mode lazy --mode preload --mode asgi
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+
+import requests
+
+MODES = {
+    "lazy": ["gunicorn", "--workers", "4", "predict_app:app"],
+    "preload": ["gunicorn", "--workers", "4", "--preload", "predict_app:app"],
+    "asgi": ["uvicorn", "predict_asgi:app", "--workers", "1"],
+}
+MODE_ENV = {"preload": {"PRELOAD_MODEL": "1"}}
+
+
+def server_command(mode, port):
+    command = MODES[mode]
+    if command[0] == "gunicorn":
+        return command[:1] + ["--bind", f"127.0.0.1:{port}"] + command[1:]
+    return command + ["--host", "127.0.0.1", "--port", str(port)]
+
+
+def wait_until(check, timeout):
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        try:
+            if check():
+                return True
+        except requests.RequestException:
+            pass
+        time.sleep(0.05)
+    return False
+
+
+def benchmark(mode, body, port=9711, timeout=120):
+    """
+    start server in mode, return seconds until /health and /ready are ok
+    and seconds of the first /predict
+    """
+    url = f"http://127.0.0.1:{port}"
+    env = dict(os.environ, **MODE_ENV.get(mode, {}))
+    start = time.perf_counter()
+    server = subprocess.Popen(
+        server_command(mode, port),
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        wait_until(lambda: requests.get(f"{url}/health", timeout=1).ok, timeout)
+        health_seconds = time.perf_counter() - start
+        # lazy mode loads model on first request, /ready stays 503 until then
+        if mode != "lazy":
+            wait_until(lambda: requests.get(f"{url}/ready", timeout=1).ok, timeout)
+        ready_seconds = time.perf_counter() - start
+        request_start = time.perf_counter()
+        response = requests.post(
+            f"{url}/predict",
+            data=body,
+            headers={"Content-Type": "application/json"},
+            timeout=timeout,
+        )
+        first_predict_seconds = time.perf_counter() - request_start
+        response.raise_for_status()
+    finally:
+        server.terminate()
+        server.wait()
+    return {
+        "mode": mode,
+        "health_s": round(health_seconds, 2),
+        "ready_s": round(ready_seconds, 2),
+        "first_predict_s": round(first_predict_seconds, 3),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--mode", action="append", choices=sorted(MODES))
+    parser.add_argument("--data", default="json_records.json")
+    args = parser.parse_args()
+    with open(args.data) as f:
+        request_body = json.dumps(json.load(f)[:20])
+    for server_mode in args.mode or sorted(MODES):
+        print(benchmark(server_mode, request_body))
+        sys.stdout.flush()
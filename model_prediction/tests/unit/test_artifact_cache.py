@@ -0,0 +1,132 @@
+import os
+import time
+import shutil
+import threading
+
+import predict
+from artifact_cache import ArtifactCache
+
+
+class FakeRegistry:
+    # file based registry, every run has a copy of the local model artifacts
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.downloads = []
+
+    def download(self, run_id, artifact_path):
+        def download_into(dst_path):
+            time.sleep(self.latency)
+            self.downloads.append((run_id, artifact_path))
+            source = os.path.join('artifacts', artifact_path)
+            target = os.path.join(dst_path, artifact_path)
+            if os.path.isdir(source):
+                shutil.copytree(source, target)
+            else:
+                shutil.copy(source, target)
+            return target
+        return download_into
+
+
+def test_hit_and_corrupted_entry(tmp_path):
+    cache = ArtifactCache(str(tmp_path))
+    registry = FakeRegistry()
+    first = cache.fetch('run-1', 'model', registry.download('run-1', 'model'))
+    second = cache.fetch('run-1', 'model', registry.download('run-1', 'model'))
+    assert first == second and len(registry.downloads) == 1
+    assert sorted(os.listdir(first)) == sorted(os.listdir('artifacts/model'))
+
+    with open(os.path.join(first, 'model.xgb'), 'ab') as f:
+        f.write(b'corrupted')
+    cache.fetch('run-1', 'model', registry.download('run-1', 'model'))
+    assert len(registry.downloads) == 2
+
+
+# workers asking at the same time download once
+def test_concurrent_fetch_downloads_once(tmp_path):
+    cache = ArtifactCache(str(tmp_path))
+    registry = FakeRegistry(latency=0.2)
+    paths = []
+    threads = [threading.Thread(target=lambda: paths.append(
+        cache.fetch('run-1', 'dv.pkl', registry.download('run-1', 'dv.pkl'))))
+        for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(set(paths)) == 1 and registry.downloads == [('run-1', 'dv.pkl')]
+
+
+def last_used(cache, run_id, artifact_path, seconds_ago):
+    manifest_path = os.path.join(cache.entry_dir(run_id, artifact_path), 'manifest.json')
+    used = time.time() - seconds_ago
+    os.utime(manifest_path, (used, used))
+
+
+def test_eviction(tmp_path):
+    model_size = sum(os.path.getsize(os.path.join('artifacts/model', name))
+                     for name in os.listdir('artifacts/model'))
+    cache = ArtifactCache(str(tmp_path), max_bytes=int(model_size * 1.5), grace_seconds=60)
+    registry = FakeRegistry()
+    old = cache.fetch('run-1', 'model', registry.download('run-1', 'model'))
+    last_used(cache, 'run-1', 'model', seconds_ago=120)
+    new = cache.fetch('run-2', 'model', registry.download('run-2', 'model'))
+    assert not os.path.exists(old) and os.path.exists(new)
+    assert not os.path.exists(cache.entry_dir('run-1', 'model') + '.lock')
+
+
+# entries another worker is replacing or removing while eviction lists them are skipped
+def test_eviction_skips_entries_in_change(tmp_path):
+    cache = ArtifactCache(str(tmp_path), max_bytes=1, grace_seconds=0)
+    registry = FakeRegistry()
+    os.makedirs(os.path.join(cache.entries_dir, 'removed'))
+    os.makedirs(os.path.join(cache.entries_dir, 'replaced'))
+    with open(os.path.join(cache.entries_dir, 'replaced', 'manifest.json'), 'w') as f:
+        f.write('{"key": ')
+    path = cache.fetch('run-1', 'dv.pkl', registry.download('run-1', 'dv.pkl'))
+    assert os.path.exists(path)
+
+
+# an entry another worker just got is kept while it loads, even above max_bytes
+def test_recently_used_entry_not_evicted(tmp_path):
+    cache = ArtifactCache(str(tmp_path), max_bytes=1, grace_seconds=60)
+    registry = FakeRegistry()
+    loading = cache.fetch('run-1', 'model', registry.download('run-1', 'model'))
+    new = cache.fetch('run-2', 'model', registry.download('run-2', 'model'))
+    assert os.path.exists(loading) and os.path.exists(new)
+
+    last_used(cache, 'run-1', 'model', seconds_ago=120)
+    cache.fetch('run-2', 'model', registry.download('run-2', 'model'))
+    assert not os.path.exists(loading) and os.path.exists(new)
+
+
+# s3 load path downloads through the cache, model location is a local folder
+def test_load_model_from_s3_cached(tmp_path, monkeypatch):
+    monkeypatch.setattr(predict, 'artifact_cache', ArtifactCache(str(tmp_path)))
+    monkeypatch.setenv('MODEL_LOCATION', os.path.abspath('artifacts/model'))
+    model, artifact_path, run_id = predict.load_model_from_s3('run-1', 'dv.pkl')
+    assert artifact_path.startswith(str(tmp_path)) and run_id == 'run-1'
+    assert model.metadata.flavors['xgboost']
+    entries = [name for name in os.listdir(tmp_path / 'entries') if not name.endswith('.lock')]
+    assert len(entries) == 2
+
+
+# registry load downloads the version whose run_id keys the cache, not the current stage
+def test_load_model_from_registry_pins_version(tmp_path, monkeypatch):
+    import types
+    import mlflow
+
+    monkeypatch.setattr(predict, 'artifact_cache', ArtifactCache(str(tmp_path)))
+    monkeypatch.setattr(predict, 'get_registry_version',
+                        lambda name: types.SimpleNamespace(run_id='run-7', version='7'))
+    monkeypatch.setattr(mlflow, 'set_tracking_uri', lambda uri: None)
+    uris = []
+
+    def download_artifacts(artifact_uri=None, run_id=None, artifact_path=None, dst_path=None):
+        uris.append(artifact_uri or f"runs:/{run_id}/{artifact_path}")
+        name = 'model' if artifact_uri else artifact_path
+        return FakeRegistry().download(run_id, name)(dst_path)
+
+    monkeypatch.setattr(mlflow.artifacts, 'download_artifacts', download_artifacts)
+    _, _, run_id = predict.load_model_from_registry('model', 'dv.pkl')
+    assert run_id == 'run-7'
+    assert uris == ['models:/model/7', 'runs:/run-7/dv.pkl']
@@ -0,0 +1,50 @@
+import os
+
+import pandas as pd
+import numpy as np
+import pytest
+from sklearn.feature_extraction import DictVectorizer
+from feature_encoder import FeatureEncoder, load_encoder
+
+categorical = ['sector']
+numerical = ['month_index', 'index_avg', 'alpha', 'beta', 'historical_vol', 'eom_10yr',
+             '10yr_avg', 'spread', 'vix_avg']
+records = pd.read_json('json_records.json')
+
+
+# same csr layout as fitted dv.pkl
+def test_parity_with_dict_vectorizer():
+    dv = load_encoder('artifacts/dv.pkl')
+    expected = DictVectorizer()
+    expected.fit(records[categorical + numerical].to_dict(orient='records'))
+    expected_output = expected.transform(records[categorical + numerical].to_dict(orient='records'))
+    actual_output = dv.transform(records, categorical, numerical)
+
+    assert dv.feature_names_ == expected.feature_names_
+    np.testing.assert_array_equal(actual_output.indptr, expected_output.indptr)
+    np.testing.assert_array_equal(actual_output.indices, expected_output.indices)
+    np.testing.assert_array_equal(actual_output.data, expected_output.data)
+
+
+# dense output and unknown sector
+def test_parity_dense_unknown_sector():
+    training_data = pd.read_json('tests/unit/test.json')
+    vectorizer = DictVectorizer(sparse=False)
+    vectorizer.fit(training_data[numerical + categorical].to_dict(orient='records'))
+    new_data = records.head(20).copy()
+    new_data.loc[new_data.index[:3], 'sector'] = 'Unknown'
+    expected_output = vectorizer.transform(new_data[numerical + categorical].to_dict(orient='records'))
+    actual_output = FeatureEncoder.from_dict_vectorizer(vectorizer).transform(
+        new_data, categorical, numerical)
+
+    np.testing.assert_array_equal(actual_output, expected_output)
+
+
+# training writes dv.pkl with its own copy of the encoder, both copies are the same
+def test_same_encoder_as_training():
+    training_copy = os.path.join(os.path.dirname(__file__), '..', '..', '..',
+                                 'model_training', 'code', 'feature_encoder.py')
+    if not os.path.exists(training_copy):
+        pytest.skip('model_training is not in this image')
+    with open(training_copy) as f, open('feature_encoder.py') as g:
+        assert f.read() == g.read()
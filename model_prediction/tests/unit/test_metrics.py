@@ -0,0 +1,39 @@
+import json
+
+import metrics
+from predict_app import app
+
+with open('json_records.json') as f:
+    body = json.dumps(json.load(f)[:5])
+
+
+def test_metrics_endpoint():
+    client = app.test_client()
+    assert client.post('/predict', data=body,
+                       headers={'Content-Type': 'application/json'}).status_code == 200
+    assert client.post('/predict', data='a', headers={'Content-Type': 'text/csv'}).status_code == 415
+
+    text = client.get('/metrics').get_data(as_text=True)
+    assert 'predict_requests_total{status="200"}' in text
+    assert 'predict_requests_total{status="415"} ' in text
+    assert 'predict_stage_seconds_count{stage="model_predict"}' in text
+    assert 'model_loads_total{source="local"}' in text
+    assert 'prediction_cache_hits_total' in text
+
+
+def test_histogram_buckets_and_disabled():
+    histogram = metrics.Histogram('test_seconds', 'test', ['stage'], buckets=(0.1, 1.0),
+                                  enabled=True)
+    metrics.REGISTRY.remove(histogram)
+    for value in (0.05, 0.1, 0.5, 5.0):
+        histogram.observe(value, stage='a')
+    lines = list(histogram.samples())
+    assert 'test_seconds_bucket{stage="a",le="0.1"} 2' in lines
+    assert 'test_seconds_bucket{stage="a",le="1.0"} 3' in lines
+    assert 'test_seconds_bucket{stage="a",le="+Inf"} 4' in lines
+    assert 'test_seconds_count{stage="a"} 4' in lines
+
+    disabled = metrics.Counter('test_total', 'test', enabled=False)
+    metrics.REGISTRY.remove(disabled)
+    disabled.inc()
+    assert disabled.value() == 0
@@ -0,0 +1,85 @@
+import threading
+
+import pandas as pd
+import predict
+from micro_batch import MicroBatcher
+
+records = pd.read_json('json_records.json')
+
+
+def predict_concurrently(batcher, requests):
+    results = [None] * len(requests)
+
+    def run(i):
+        results[i] = batcher.predict(requests[i].copy())
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(len(requests))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+# requests in one window are predicted together, each gets its own rows back
+def test_batched_matches_single_requests():
+    calls = []
+
+    def counting_predict(raw_data):
+        calls.append(len(raw_data))
+        return predict.predict(raw_data)
+
+    batcher = MicroBatcher(counting_predict, window_ms=200, max_rows=10_000)
+    requests = [records.iloc[i * 3:i * 3 + 3].reset_index(drop=True) for i in range(20)]
+    results = predict_concurrently(batcher, requests)
+
+    assert sum(calls) == 60 and len(calls) < 20
+    for request, result in zip(requests, results):
+        expected = predict.predict(request.copy())
+        pd.testing.assert_frame_equal(result, expected)
+
+
+# different dtypes are not mixed, errors go to the failing request only
+def test_dtype_groups_and_errors():
+    def failing_predict(raw_data):
+        if 'bad' in raw_data.columns:
+            raise ValueError('bad request')
+        return raw_data.assign(predicted_1m_return=0.0)
+
+    batcher = MicroBatcher(failing_predict, window_ms=200)
+    good = pd.DataFrame({'ticker': ['A'], 'date': [1751328000000]})
+    typed = pd.DataFrame({'ticker': ['B'], 'date': pd.to_datetime(['2025-07-01'])})
+    bad = pd.DataFrame({'ticker': ['C'], 'bad': [1]})
+    futures = [batcher.submit(df) for df in (good, typed, bad)]
+
+    assert futures[0].result()['date'].tolist() == [1751328000000]
+    assert futures[1].result()['date'].tolist() == [pd.Timestamp('2025-07-01')]
+    try:
+        futures[2].result()
+        assert False
+    except ValueError:
+        pass
+
+
+# a bad request batched with good ones fails alone, the others are predicted one by one
+def test_failing_request_in_batch():
+    calls = []
+
+    def failing_predict(raw_data):
+        calls.append(raw_data['ticker'].tolist())
+        if (raw_data['ticker'] == 'BAD').any():
+            raise ValueError('bad request')
+        return raw_data.assign(predicted_1m_return=0.0)
+
+    batcher = MicroBatcher(failing_predict, window_ms=200)
+    requests = [pd.DataFrame({'ticker': [ticker]}) for ticker in ['A', 'BAD', 'C']]
+    futures = [batcher.submit(df) for df in requests]
+
+    assert futures[0].result()['ticker'].tolist() == ['A']
+    assert futures[2].result()['ticker'].tolist() == ['C']
+    try:
+        futures[1].result()
+        assert False
+    except ValueError:
+        pass
+    assert calls == [['A', 'BAD', 'C'], ['A'], ['BAD'], ['C']]
@@ -0,0 +1,101 @@
+import predict
+
+real_load_model_artifact = predict.load_model_artifact
+load_calls = []
+model_key = ["run-1"]
+
+
+def fake_load_model_artifact():
+    load_calls.append(model_key[0])
+    return ("model", "dv.pkl", model_key[0], "registry")
+
+
+def fake_get_model_key():
+    return (model_key[0], None, None)
+
+
+def make_holder(monkeypatch, fake_key=True):
+    load_calls.clear()
+    model_key[0] = "run-1"
+    monkeypatch.setattr(predict, "load_model_artifact", fake_load_model_artifact)
+    monkeypatch.setattr(predict, "load_artifact", lambda path: "dv")
+    if fake_key:
+        monkeypatch.setattr(predict, "get_model_key", fake_get_model_key)
+    return predict.ModelHolder(refresh_seconds=0)
+
+
+# model loaded once, served from memory afterwards
+def test_load_once(monkeypatch):
+    holder = make_holder(monkeypatch)
+    for _ in range(5):
+        assert holder.get() == ("model", "dv", "run-1")
+    assert load_calls == ["run-1"]
+
+
+# reload only when production version changes
+def test_refresh_on_key_change(monkeypatch):
+    holder = make_holder(monkeypatch)
+    holder.get()
+    assert holder.refresh() is False
+    model_key[0] = "run-2"
+    assert holder.refresh() is True
+    assert holder.get() == ("model", "dv", "run-2")
+    assert load_calls == ["run-1", "run-2"]
+
+
+# preload loads without refresh thread, ready only after loading
+def test_preload_ready(monkeypatch):
+    holder = make_holder(monkeypatch)
+    assert not holder.ready
+    holder.preload()
+    assert holder.ready and holder._refresher_pid is None
+    assert load_calls == ["run-1"]
+
+
+# a registry outage keeps the production model instead of falling back to S3 or local
+def test_registry_outage_keeps_model(monkeypatch):
+    monkeypatch.setenv("MLFLOW_TRACKING_URI", "http://mlflow:5000")
+    monkeypatch.delenv("MODEL_LOCATION", raising=False)
+    monkeypatch.delenv("MLFLOW_RUN_ID", raising=False)
+    server_alive = [True]
+    monkeypatch.setattr(predict, "is_mlflow_server_alive", lambda: server_alive[0])
+    monkeypatch.setattr(predict, "get_run_id_from_registry", lambda name: model_key[0])
+    holder = make_holder(monkeypatch, fake_key=False)
+    holder.get()
+
+    server_alive[0] = False
+    assert holder.refresh() is False
+    assert holder.get() == ("model", "dv", "run-1")
+
+    server_alive[0] = True
+    model_key[0] = "run-2"
+    assert holder.refresh() is True
+    assert load_calls == ["run-1", "run-2"]
+
+
+
+# a fallback model loaded after the registry was probed alive is replaced on next refresh
+def test_failed_registry_load_reloads(monkeypatch):
+    monkeypatch.setenv("MLFLOW_TRACKING_URI", "http://mlflow:5000")
+    monkeypatch.delenv("MODEL_LOCATION", raising=False)
+    monkeypatch.delenv("MLFLOW_RUN_ID", raising=False)
+    monkeypatch.setattr(predict, "is_mlflow_server_alive", lambda: True)
+    monkeypatch.setattr(predict, "get_run_id_from_registry", lambda name: model_key[0])
+    download_fails = [True]
+
+    def fake_load_model_from_registry(model_name, artifact_name):
+        if download_fails[0]:
+            raise Exception("download failed")
+        return ("model", "dv.pkl", model_key[0])
+
+    holder = make_holder(monkeypatch, fake_key=False)
+    monkeypatch.setattr(predict, "load_model_artifact", real_load_model_artifact)
+    monkeypatch.setattr(predict, "load_model_from_registry", fake_load_model_from_registry)
+    monkeypatch.setattr(predict, "load_model_from_local",
+                        lambda path, name: ("local-model", "dv.pkl", "test"))
+    assert holder.get() == ("local-model", "dv", "test")
+
+    download_fails[0] = False
+    assert holder.refresh() is True
+    assert holder.get() == ("model", "dv", "run-1")
+    assert holder.refresh() is False
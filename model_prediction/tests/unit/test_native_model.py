@@ -0,0 +1,44 @@
+import mlflow
+import numpy as np
+import pandas as pd
+import xgboost as xgb
+import predict
+from feature_encoder import load_encoder
+
+
+# booster called directly gives the same prediction as pyfunc
+def test_booster_matches_pyfunc():
+    pyfunc_model = mlflow.pyfunc.load_model('artifacts/model')
+    model = predict.native_model(pyfunc_model)
+    assert isinstance(model, predict.BoosterModel)
+
+    data = pd.read_json('json_records.json')
+    X = predict.prepare_features(data, load_encoder('artifacts/dv.pkl'))
+    np.testing.assert_allclose(model.predict(X), pyfunc_model.predict(X), rtol=1e-6)
+
+
+# early stopped models predict with the trees pyfunc uses:
+# best_iteration for sklearn models, all trees for a plain booster
+def test_best_iteration_matches_pyfunc(tmp_path):
+    rng = np.random.default_rng(0)
+    X = rng.normal(size=(300, 5))
+    y = X[:, 0] * 0.1 + rng.normal(scale=0.05, size=300)
+    params = dict(max_depth=6, learning_rate=0.9, random_state=42)
+    regressor = xgb.XGBRegressor(n_estimators=50, early_stopping_rounds=5, **params)
+    regressor.fit(X[:200], y[:200], eval_set=[(X[200:], y[200:])], verbose=False)
+    booster = xgb.train(params, xgb.DMatrix(X[:200], y[:200]), 50,
+                        evals=[(xgb.DMatrix(X[200:], y[200:]), 'val')],
+                        early_stopping_rounds=5, verbose_eval=False)
+    assert booster.best_iteration + 1 < booster.num_boosted_rounds()
+
+    for name, raw_model in [('regressor', regressor), ('booster', booster)]:
+        mlflow.xgboost.save_model(raw_model, str(tmp_path / name))
+        pyfunc_model = mlflow.pyfunc.load_model(str(tmp_path / name))
+        model = predict.native_model(pyfunc_model)
+        np.testing.assert_allclose(model.predict(X[200:]), pyfunc_model.predict(X[200:]),
+                                   rtol=1e-6)
+
+
+# models without xgboost flavor are kept as they are
+def test_other_flavor_kept():
+    assert predict.native_model("model") == "model"
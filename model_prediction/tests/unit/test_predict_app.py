@@ -0,0 +1,76 @@
+import io
+import json
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import payload
+from predict_app import app
+
+with open('json_records.json') as f:
+    records = json.load(f)[:20]
+
+
+def post(body, content_type, accept=None):
+    headers = {'Content-Type': content_type}
+    if accept:
+        headers['Accept'] = accept
+    return app.test_client().post('/predict', data=body, headers=headers)
+
+
+def expected():
+    response = post(json.dumps(records), payload.JSON)
+    assert response.status_code == 200
+    return pd.DataFrame(response.get_json())
+
+
+# every request format and response format gives the same predictions as json records
+def test_formats_match_json_records():
+    reference = expected()
+    features = pd.DataFrame(records)
+    features['date'] = pd.to_datetime(features['date'], unit='ms')
+    bodies = {
+        payload.JSON_COLUMNS: json.dumps(pd.DataFrame(records).to_dict(orient='list')),
+        payload.ARROW: payload.encode(features, payload.ARROW),
+        payload.PARQUET: payload.encode(features, payload.PARQUET),
+    }
+    readers = {
+        payload.JSON: lambda r: pd.DataFrame(r.get_json()),
+        payload.JSON_COLUMNS: lambda r: pd.DataFrame(r.get_json()),
+        payload.ARROW: lambda r: pa.ipc.open_stream(r.data).read_all().to_pandas(),
+        payload.PARQUET: lambda r: pq.read_table(io.BytesIO(r.data)).to_pandas(),
+    }
+    for content_type, body in bodies.items():
+        for accept, read in readers.items():
+            response = post(body, content_type, accept)
+            assert response.status_code == 200
+            actual = read(response)
+            pd.testing.assert_frame_equal(actual[reference.columns], reference,
+                                          check_dtype=False)
+
+
+def test_accept_negotiation():
+    assert payload.response_format(None) == payload.JSON
+    assert payload.response_format('*/*') == payload.JSON
+    assert payload.response_format(
+        'application/json;q=0.5, application/vnd.apache.arrow.stream') == payload.ARROW
+    assert post(json.dumps(records), payload.JSON, 'text/csv').status_code == 406
+    assert post('a,b', 'text/csv').status_code == 415
+
+
+def test_malformed_body():
+    assert post('{"ticker": ', payload.JSON).status_code == 400
+    assert post(b'not arrow', payload.ARROW).status_code == 400
+
+
+def test_ready(monkeypatch):
+    import predict
+    import predict_app
+
+    monkeypatch.setattr(predict_app, 'model_holder', predict.ModelHolder(refresh_seconds=0))
+    client = app.test_client()
+    assert client.get('/health').status_code == 200
+    assert client.get('/ready').status_code == 503
+    predict_app.model_holder.preload()
+    response = client.get('/ready')
+    assert response.status_code == 200 and response.get_json()['model_version'] == 'test'
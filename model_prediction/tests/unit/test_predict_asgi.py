@@ -0,0 +1,52 @@
+import json
+import asyncio
+
+import payload
+import predict_asgi
+from predict_app import app as flask_app
+
+with open('json_records.json') as f:
+    body = json.dumps(json.load(f)[:20]).encode()
+
+
+async def call(app, method, path, body=b'', headers=()):
+    # minimal asgi client, returns status, headers and body
+    scope = {'type': 'http', 'method': method, 'path': path, 'query_string': b'',
+             'headers': [(k.lower().encode(), v.encode()) for k, v in headers]}
+    messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+    sent = []
+
+    async def receive():
+        return messages.pop(0) if messages else {'type': 'http.disconnect'}
+
+    async def send(message):
+        sent.append(message)
+
+    await app(scope, receive, send)
+    response_body = b''.join(m.get('body', b'') for m in sent
+                             if m['type'] == 'http.response.body')
+    return sent[0]['status'], dict(sent[0]['headers']), response_body
+
+
+# same response as the flask app
+def test_predict_matches_flask():
+    status, _, response_body = asyncio.run(call(
+        predict_asgi.app, 'POST', '/predict', body, [('Content-Type', payload.JSON)]))
+    expected = flask_app.test_client().post(
+        '/predict', data=body, headers={'Content-Type': payload.JSON}).get_json()
+    assert status == 200
+    assert json.loads(response_body) == expected
+
+    status, _, _ = asyncio.run(call(
+        predict_asgi.app, 'POST', '/predict', b'{"ticker": ', [('Content-Type', payload.JSON)]))
+    assert status == 400
+
+
+def test_health_and_overload(monkeypatch):
+    status, _, response_body = asyncio.run(call(predict_asgi.app, 'GET', '/health'))
+    assert status == 200 and json.loads(response_body)['status'] == 'ok'
+
+    monkeypatch.setattr(predict_asgi, 'PREDICT_QUEUE', 0)
+    status, headers, _ = asyncio.run(call(
+        predict_asgi.app, 'POST', '/predict', body, [('Content-Type', payload.JSON)]))
+    assert status == 503 and headers[b'retry-after'] == b'1'
@@ -0,0 +1,49 @@
+import pandas as pd
+import predict
+import predict_backfill
+from served_log import ServedLog
+
+
+def write_features(tmp_path):
+    features = pd.read_parquet('features.parquet')
+    features = features[features['date'] >= '2025-03-01'].iloc[::10]
+    input_path = tmp_path / 'features.parquet'
+    features.to_parquet(input_path, row_group_size=20)
+    return str(input_path), features
+
+
+# streamed months match predicting the whole file at once
+def test_backfill_matches_one_shot(tmp_path):
+    input_path, features = write_features(tmp_path)
+    output_path = str(tmp_path / 'backfill')
+    months = predict_backfill.backfill(input_path, output_path, batch_rows=7)
+
+    assert len(months) == 4
+    actual = (pd.read_parquet(output_path).drop(columns='month')
+              .sort_values(['date', 'ticker']).reset_index(drop=True))
+    expected = (predict.predict(features.reset_index(drop=True))
+                .sort_values(['date', 'ticker']).reset_index(drop=True))
+    pd.testing.assert_frame_equal(actual, expected[actual.columns], check_dtype=False)
+
+
+# completed months are skipped, a month without output file is done again
+def test_backfill_resume(tmp_path):
+    input_path, _ = write_features(tmp_path)
+    output_path = str(tmp_path / 'backfill')
+    predict_backfill.backfill(input_path, output_path, batch_rows=50)
+    (tmp_path / 'backfill' / 'month=2025-05' / 'part-0.parquet').unlink()
+
+    months = predict_backfill.backfill(input_path, output_path, batch_rows=50)
+    assert months == [pd.Timestamp('2025-05-01')]
+
+
+# backfill rows skip the prediction cache and are not logged as served traffic
+def test_backfill_not_served(tmp_path, monkeypatch):
+    monkeypatch.setattr(predict, 'served_log', ServedLog(str(tmp_path / 'served')))
+    hits, misses = predict.prediction_cache.hits, predict.prediction_cache.misses
+    input_path, _ = write_features(tmp_path)
+    predict_backfill.backfill(input_path, str(tmp_path / 'backfill'), batch_rows=50)
+    predict.served_log.flush()
+
+    assert not list(tmp_path.glob('served/*'))
+    assert (predict.prediction_cache.hits, predict.prediction_cache.misses) == (hits, misses)
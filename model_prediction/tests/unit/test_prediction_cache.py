@@ -0,0 +1,85 @@
+import numpy as np
+import pandas as pd
+import predict
+from feature_encoder import load_encoder
+from prediction_cache import MemoryBackend, PredictionCache, SqliteBackend
+
+records = pd.read_json('json_records.json')
+X = predict.prepare_features(records, load_encoder('artifacts/dv.pkl'))
+
+
+class CountingModel:
+    def __init__(self, offset=0.0):
+        self.offset = offset
+        self.rows = 0
+
+    def predict(self, X):
+        self.rows += X.shape[0]
+        return (np.asarray(X.sum(axis=1)).ravel() + self.offset).astype(np.float32)
+
+
+# second call is served from cache, a new run_id predicts again
+def test_cache_hits_and_version_switch():
+    cache = PredictionCache(max_size=1000)
+    model = CountingModel()
+    first = cache.predict(model, X, 'run-1')
+    second = cache.predict(model, X, 'run-1')
+    np.testing.assert_array_equal(first, second)
+    np.testing.assert_array_equal(first, model.predict(X))
+    assert cache.stats()['hits'] == X.shape[0]
+
+    new_model = CountingModel(offset=1.0)
+    third = cache.predict(new_model, X, 'run-2')
+    np.testing.assert_array_equal(third, first + 1)
+    assert new_model.rows == X.shape[0]
+
+
+# lru keeps max_size rows, shared backend serves other processes
+def test_lru_and_shared_backend(tmp_path):
+    for backend in (MemoryBackend(), SqliteBackend(str(tmp_path / 'cache.db'))):
+        cache = PredictionCache(max_size=10, backend=backend)
+        model = CountingModel()
+        expected = cache.predict(model, X, 'run-1')
+        assert cache.stats()['size'] == 10
+
+        other_process = PredictionCache(max_size=10, backend=backend)
+        other_model = CountingModel()
+        np.testing.assert_array_equal(other_process.predict(other_model, X, 'run-1'), expected)
+        assert other_model.rows == 0
+
+
+# NaN predictions are cached, they are not taken as missing rows
+def test_nan_prediction_cached(tmp_path):
+    for backend in (None, SqliteBackend(str(tmp_path / 'cache.db'))):
+        cache = PredictionCache(max_size=1000, backend=backend)
+        model = CountingModel(offset=np.nan)
+        assert np.isnan(cache.predict(model, X, 'run-1')).all()
+        assert np.isnan(cache.predict(model, X, 'run-1')).all()
+        assert model.rows == X.shape[0]
+        if backend is not None:
+            other_model = CountingModel()
+            other_process = PredictionCache(max_size=1000, backend=backend)
+            assert np.isnan(other_process.predict(other_model, X, 'run-1')).all()
+            assert other_model.rows == 0
+
+
+# another model under the same run_id, like a changed MODEL_LOCATION, predicts again
+def test_model_location_in_cache_key(monkeypatch):
+    monkeypatch.setattr(predict, 'prediction_cache', PredictionCache(max_size=1000))
+    monkeypatch.delenv('MLFLOW_TRACKING_URI', raising=False)
+    monkeypatch.setenv('MLFLOW_RUN_ID', 'run-1')
+    model = CountingModel()
+    holder = predict.ModelHolder(refresh_seconds=0)
+    monkeypatch.setattr(predict, 'model_holder', holder)
+    monkeypatch.setattr(predict, 'load_model_artifact',
+                        lambda: (model, 'artifacts/dv.pkl', 'run-1', 's3'))
+    monkeypatch.setattr(predict, 'native_model', lambda model: model)
+    monkeypatch.setenv('MODEL_LOCATION', 's3://bucket/a/model')
+    predict.predict(records.head(20).copy())
+    predict.predict(records.head(20).copy())
+    assert model.rows == 20
+
+    monkeypatch.setenv('MODEL_LOCATION', 's3://bucket/b/model')
+    assert holder.refresh() is True
+    predict.predict(records.head(20).copy())
+    assert model.rows == 40
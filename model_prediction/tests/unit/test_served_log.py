@@ -0,0 +1,40 @@
+import json
+
+import numpy as np
+import pandas as pd
+
+import predict
+from served_log import ServedLog
+
+records = pd.read_json('json_records.json').head(20)
+
+
+# every served batch is one json line with features, prediction and model version
+def test_predict_appends_served_batch(tmp_path, monkeypatch):
+    monkeypatch.setattr(predict, 'served_log', ServedLog(str(tmp_path)))
+    first = predict.predict(records.copy())
+    predict.predict(records.head(3).copy())
+    predict.served_log.flush()
+
+    [path] = tmp_path.iterdir()
+    lines = [json.loads(line) for line in path.read_text().splitlines()]
+    assert [len(line['columns']['ticker']) for line in lines] == [20, 3]
+    assert lines[0]['model_version'] == first['model_version'].iloc[0]
+    np.testing.assert_allclose(lines[0]['columns']['predicted_1m_return'],
+                               first['predicted_1m_return'])
+    assert set(lines[0]['columns']) == set(first.columns) - {'model_version'}
+
+
+def test_missing_values_and_disabled(tmp_path):
+    served = pd.DataFrame({'alpha': [0.1, np.nan], 'sector': ['Energy', None],
+                           'predicted_1m_return': [0.01, 0.02], 'model_version': 'run-1'})
+    log = ServedLog(str(tmp_path))
+    log.append(served)
+    log.flush()
+    [line] = next(tmp_path.iterdir()).read_text().splitlines()
+    assert json.loads(line)['columns']['alpha'] == [0.1, None]
+    assert json.loads(line)['columns']['sector'] == ['Energy', None]
+
+    disabled = ServedLog('')
+    disabled.append(served)
+    assert not disabled.enabled
@@ -0,0 +1,126 @@
+"""walk-forward backtest: for every month train on all prior months and predict that month"""
+import os
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import xgboost as xgb
+from sklearn.feature_extraction import DictVectorizer
+
+from preprocess_data import read_dataframe, preprocess
+from training_data import booster_params
+
+TARGET = 'future_1m_return'
+DEFAULT_PARAMS = dict(objective='reg:squarederror', n_estimators=100,
+                      learning_rate=0.1, max_depth=5, random_state=42)
+
+# encoded features of a worker process, set once by init_worker
+_worker_data = {}
+
+
+def encode_features(df: pd.DataFrame):
+    '''
+    encode all months once, rows sorted by date.
+    returns X, y and the first row of every month, month_starts[-1] is the number of rows
+    '''
+    df = df.sort_values('date', kind='stable').reset_index(drop=True)
+    X, _ = preprocess(df, DictVectorizer(), fit_dv=True)
+    months = df['date'].drop_duplicates()
+    month_starts = np.append(months.index.values, len(df))
+    return X, df[TARGET].values, months.to_numpy(), month_starts
+
+
+def init_worker(X, y, month_starts):
+    # DMatrix of all months, folds take row slices of it
+    _worker_data['dmatrix'] = xgb.DMatrix(X, y)
+    _worker_data['y'] = y
+    _worker_data['month_starts'] = month_starts
+
+
+def month_metrics(y_true, y_pred):
+    '''
+    out of sample metrics of one month, ic is the rank correlation of predicted and actual returns
+    '''
+    errors = y_pred - y_true
+    return {
+        'rows': len(y_true),
+        'rmse': float(np.sqrt(np.mean(errors ** 2))),
+        'mae': float(np.mean(np.abs(errors))),
+        'ic': float(pd.Series(y_pred).corr(pd.Series(y_true), method='spearman')),
+    }
+
+
+def run_folds(folds: list, params: dict, warm_start=True, trees_per_fold=0, n_jobs=None):
+    '''
+    train and predict consecutive folds, fold is the index of the predicted month.
+    the first fold trains params['n_estimators'] trees from scratch. with warm_start
+    every next fold refits the leaf values of the previous booster on all months before
+    its own, keeping its tree structure, then adds trees_per_fold new trees.
+    without warm_start every fold trains from scratch
+    '''
+    dmatrix, y, month_starts = (_worker_data['dmatrix'], _worker_data['y'],
+                                _worker_data['month_starts'])
+    native_params, num_rounds = booster_params(params, n_jobs)
+    refresh_params = dict(native_params, process_type='update', updater='refresh',
+                          refresh_leaf=True)
+    booster = None
+    results = []
+    for fold in folds:
+        train_end, test_end = month_starts[fold], month_starts[fold + 1]
+        dtrain = dmatrix.slice(np.arange(train_end))
+        if booster is None or not warm_start:
+            booster = xgb.train(native_params, dtrain, num_boost_round=num_rounds)
+        else:
+            booster = xgb.train(refresh_params, dtrain,
+                                num_boost_round=booster.num_boosted_rounds(), xgb_model=booster)
+            if trees_per_fold:
+                booster = xgb.train(native_params, dtrain, num_boost_round=trees_per_fold,
+                                    xgb_model=booster)
+        y_pred = booster.predict(dmatrix.slice(np.arange(train_end, test_end)))
+        results.append(dict(fold=fold, n_trees=booster.num_boosted_rounds(),
+                            **month_metrics(y[train_end:test_end], y_pred)))
+    return results
+
+
+def run_backtest(raw_data_path: str, params=None, min_train_months=12,
+                 warm_start=True, trees_per_fold=0, workers=1):
+    '''
+    per month out of sample metrics of a walk forward backtest on features.parquet,
+    starting with min_train_months months of training data.
+    folds are split into `workers` consecutive chunks trained in parallel processes,
+    each chunk trains its first fold from scratch and warm starts the others.
+    metrics depend on workers, the default of 1 warm starts every fold after the first
+    '''
+    params = dict(DEFAULT_PARAMS, **(params or {}))
+    df = read_dataframe(os.path.join(raw_data_path, "features.parquet"))
+    X, y, months, month_starts = encode_features(df)
+    folds = list(range(min_train_months, len(months)))
+    chunks = [list(chunk) for chunk in np.array_split(folds, max(1, min(workers, len(folds))))]
+    n_jobs = max(1, (os.cpu_count() or 1) // len(chunks))
+    with ProcessPoolExecutor(max_workers=len(chunks), initializer=init_worker,
+                             initargs=(X, y, month_starts)) as executor:
+        futures = [executor.submit(run_folds, chunk, params, warm_start, trees_per_fold, n_jobs)
+                   for chunk in chunks]
+        results = [result for future in futures for result in future.result()]
+    metrics = pd.DataFrame(results)
+    metrics.insert(0, 'month', months[metrics.pop('fold')])
+    return metrics
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--raw_data_path", default='../files/')
+    parser.add_argument("--output_path", default='../files/output/backtest.csv')
+    parser.add_argument("--min_train_months", type=int, default=12)
+    parser.add_argument("--no_warm_start", action="store_true")
+    parser.add_argument("--trees_per_fold", type=int, default=0)
+    # more workers are faster but restart more folds from scratch, metrics change with them
+    parser.add_argument("--workers", type=int, default=1)
+    args = parser.parse_args()
+    backtest = run_backtest(args.raw_data_path, min_train_months=args.min_train_months,
+                            warm_start=not args.no_warm_start,
+                            trees_per_fold=args.trees_per_fold, workers=args.workers)
+    backtest.to_csv(args.output_path, index=False)
+    print(backtest.to_string(index=False))
+    print(backtest[['rmse', 'mae', 'ic']].mean())
@@ -0,0 +1,133 @@
+"""columnar training dataset: one .npy file per column, memory-mapped on load, instead of pickled sparse matrices"""
+import os
+import json
+import shutil
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+FORMAT_VERSION = 1
+
+
+def write_dataset(df: pd.DataFrame, feature_names: list, path: str, categorical: str,
+                  numerical: list, target: str):
+    '''
+    store rows of df in folder path:
+    numerical.npy float32 (rows x numerical), <categorical>.npy int8 codes (-1 unknown),
+    target.npy, date.npy, ticker.npy int16 codes and meta.json with feature names
+    of the fitted DictVectorizer, categories and tickers.
+    the folder is written next to path and renamed into place
+    '''
+    prefix = f"{categorical}="
+    categories = [name[len(prefix):] for name in feature_names if name.startswith(prefix)]
+    codes = pd.Categorical(df[categorical], categories=categories).codes
+    tickers = pd.Categorical(df['ticker'])
+    meta = {
+        'format_version': FORMAT_VERSION,
+        'rows': len(df),
+        'feature_names': list(feature_names),
+        'numerical': list(numerical),
+        'categorical': categorical,
+        'categories': categories,
+        'target': target,
+        'tickers': list(tickers.categories),
+    }
+    tmp_path = f"{path.rstrip(os.sep)}.tmp"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+    np.save(os.path.join(tmp_path, 'numerical.npy'), df[numerical].to_numpy(dtype=np.float32))
+    np.save(os.path.join(tmp_path, f'{categorical}.npy'), codes.astype(np.int8))
+    np.save(os.path.join(tmp_path, 'target.npy'), df[target].to_numpy(dtype=np.float64))
+    np.save(os.path.join(tmp_path, 'date.npy'), df['date'].to_numpy(dtype='datetime64[D]'))
+    np.save(os.path.join(tmp_path, 'ticker.npy'), tickers.codes.astype(np.int16))
+    with open(os.path.join(tmp_path, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+    shutil.rmtree(path, ignore_errors=True)
+    os.rename(tmp_path, path)
+
+
+def is_dataset(path: str):
+    return os.path.exists(os.path.join(path, 'meta.json'))
+
+
+class ColumnarDataset:
+    '''
+    memory-mapped columns of a dataset folder, nothing is read before it is used
+    '''
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(os.path.join(path, 'meta.json')) as f:
+            self.meta = json.load(f)
+        self.feature_names = self.meta['feature_names']
+        self.numerical = self._column('numerical')
+        self.codes = self._column(self.meta['categorical'])
+        self.y = self._column('target')
+        self.dates = self._column('date')
+        self.ticker_codes = self._column('ticker')
+
+    def _column(self, name):
+        return np.load(os.path.join(self.path, f'{name}.npy'), mmap_mode='r')
+
+    def __len__(self):
+        return self.meta['rows']
+
+    def _positions(self):
+        index = {name: i for i, name in enumerate(self.feature_names)}
+        prefix = f"{self.meta['categorical']}="
+        numerical = np.array([index[name] for name in self.meta['numerical']])
+        categories = np.array([index[prefix + name] for name in self.meta['categories']])
+        return numerical, categories
+
+    def dense(self, start=0, stop=None):
+        '''
+        float32 feature matrix of rows start:stop in feature_names order.
+        one-hot columns that are not set are nan, missing like in the sparse matrix
+        '''
+        numerical_pos, category_pos = self._positions()
+        codes = np.asarray(self.codes[start:stop])
+        X = np.full((len(codes), len(self.feature_names)), np.nan, dtype=np.float32)
+        X[:, numerical_pos] = self.numerical[start:stop]
+        known = codes >= 0
+        X[np.flatnonzero(known), category_pos[codes[known]]] = 1
+        return X
+
+    def csr(self):
+        '''
+        same csr matrix as preprocess, one-hot zeros are not stored.
+        every row has the numerical columns in column order with the one-hot column
+        of a known category inserted between them, so entries are placed without sorting
+        '''
+        numerical_pos, category_pos = self._positions()
+        order = np.argsort(numerical_pos)
+        numerical_pos = numerical_pos[order]
+        n_rows, n_numerical = self.numerical.shape
+        codes = np.asarray(self.codes)
+        known = codes >= 0
+        category_col = category_pos[np.where(known, codes, 0)]
+        # slot of the one-hot entry within its row, after all numerical columns if unknown
+        slot = np.where(known, np.searchsorted(numerical_pos, category_col), n_numerical)
+        indptr = np.concatenate([[0], np.cumsum(n_numerical + known)])
+        numerical_dest = (indptr[:-1, None] + np.arange(n_numerical)
+                          + (np.arange(n_numerical) >= slot[:, None]))
+        category_dest = indptr[:-1][known] + slot[known]
+        data = np.empty(indptr[-1], dtype=np.float32)
+        indices = np.empty(indptr[-1], dtype=np.int32)
+        data[numerical_dest] = np.asarray(self.numerical)[:, order]
+        indices[numerical_dest] = numerical_pos
+        data[category_dest] = 1
+        indices[category_dest] = category_col[known]
+        return sparse.csr_matrix((data, indices, indptr),
+                                 shape=(n_rows, len(self.feature_names)))
+
+    def tickers(self):
+        return np.asarray(self.meta['tickers'])[self.ticker_codes]
+
+
+def load_dataset(path: str):
+    '''
+    (X, y) like load_pickle of the pickles written before, X is a csr matrix
+    '''
+    dataset = ColumnarDataset(path)
+    return dataset.csr(), np.asarray(dataset.y)
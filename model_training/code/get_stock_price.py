@@ -1,72 +1,159 @@
-import yfinance as yf
+import os
 import datetime
 import pandas as pd
 import pytz
 from datetime import timedelta
 from dateutil.relativedelta import relativedelta
-import pandas_datareader.data as web
-
-def download_stock_price(stock_tickers, start_date, end_date):
-    # Download data for all tickers
-
-    stock_data = yf.download(stock_tickers, start=start_date, end=end_date, auto_adjust=True) 
-
-    # Extract adjusted close prices
-    adj_close_prices = stock_data['Close']
-    adj_close_prices.reset_index(inplace=True)
-    df_unpivot = pd.melt(adj_close_prices, col_level=0, id_vars=['Date'], value_vars=adj_close_prices.columns.tolist())
-    price_df = df_unpivot.rename(columns={'value': 'price', 'Ticker': 'ticker', 'Date': 'date'})
-    price_filename = '../files/stock_price.csv'
-    price_df.to_csv(price_filename, columns=['date', 'ticker', 'price'], index=False)
-
-    return start_date.replace('-', '')
-
-def download_index_price(start_date, end_date):
-    index_data = yf.download("^GSPC", start=start_date, end=end_date, auto_adjust=True)
-
-    adj_close_prices = index_data['Close']
-    adj_close_prices.reset_index(inplace=True)
-    index_price = adj_close_prices.rename(columns={'Date': 'date', '^GSPC': 'price'})
-    index_price['ticker'] = 'SPX'
-
-    index_filename = '../files/index_price.csv'
-    index_price.to_csv(index_filename, columns=['date', 'ticker', 'price'], index=False)
 
+import price_store
+from market_data import YahooFredSource, fetch_concurrently
+
+INDEX_SYMBOLS = {'index': ('^GSPC', 'SPX'), 'vix': ('^VIX', 'VIX')}
+
+def update_series(name, fetch, symbols, start_date, end_date, store_path=price_store.STORE_PATH):
+    '''
+    append-only update of one series in the price store.
+    symbols not stored yet are fetched from start_date,
+    stored symbols only from the last stored date, plus history before the range
+    requested so far if start_date moved back. the last stored date is fetched again as overlap,
+    a symbol whose overlap price changed (split or dividend adjustment) is fetched in full.
+    fetch(symbols, start, end) returns long dataframe (date, ticker, price)
+    '''
+    start_date, end_date = pd.Timestamp(start_date), pd.Timestamp(end_date)
+    stored = price_store.stored_dates(name, store_path)
+    if stored is None:
+        requests = [(list(symbols), start_date, end_date)]
+        first_date, last_prices = None, pd.Series(dtype=float)
+    else:
+        first_date, last_date, last_prices = stored
+        coverage = price_store.read_coverage(name, store_path)
+        if coverage is not None:
+            first_date = min(first_date, coverage[0])
+        known = [symbol for symbol in symbols if symbol in last_prices.index]
+        new = [symbol for symbol in symbols if symbol not in last_prices.index]
+        requests = [(new, start_date, end_date), (known, last_date, end_date)]
+        if start_date < first_date:
+            requests.append((known, start_date, first_date))
+
+    frames = []
+    for request_symbols, request_start, request_end in requests:
+        if request_symbols and request_start < request_end:
+            frames.append(fetch(request_symbols, request_start, request_end))
+    if not frames:
+        return 0
+    price_df = pd.concat(frames, ignore_index=True)
+    coverage_start = start_date if first_date is None else min(start_date, first_date)
+
+    if stored is not None:
+        overlap = price_df[price_df['date'] == last_date].set_index('ticker')['price']
+        stored_price = last_prices.reindex(overlap.index)
+        changed = ((overlap - stored_price).abs() > 1e-6 * stored_price.abs()).to_numpy()
+        adjusted = overlap.index[changed].tolist()
+        if adjusted:
+            print(f"{name}: adjusted prices changed for {len(adjusted)} symbols, fetch full history")
+            price_df = price_df[~price_df['ticker'].isin(adjusted)]
+            price_df = pd.concat([price_df, fetch(adjusted, min(start_date, first_date), end_date)],
+                                 ignore_index=True)
+    price_store.write_series(price_df, name, store_path)
+    price_store.write_coverage(name, coverage_start, end_date, store_path)
+    print(f"{name}: stored {len(price_df)} rows")
+    return len(price_df)
+
+def download_stock_price(stock_tickers, start_date, end_date, source=None,
+                         store_path=price_store.STORE_PATH):
+    # Download missing data for all tickers
+    source = source or YahooFredSource()
+    update_series('stock', source.prices, stock_tickers, start_date, end_date, store_path)
     return start_date.replace('-', '')
 
-def download_vix_price(start_date, end_date):
-    index_data = yf.download("^VIX", start=start_date, end=end_date, auto_adjust=True)
+def download_index_price(start_date, end_date, source=None, store_path=price_store.STORE_PATH,
+                         name='index'):
+    source = source or YahooFredSource()
+    symbol, ticker = INDEX_SYMBOLS[name]
 
-    adj_close_prices = index_data['Close']
-    adj_close_prices.reset_index(inplace=True)
-    index_price = adj_close_prices.rename(columns={'Date': 'date', '^VIX': 'price'})
-    index_price['ticker'] = 'VIX'
-
-    index_filename = '../files/vix_price.csv'
-    index_price.to_csv(index_filename, columns=['date', 'ticker', 'price'], index=False)
+    def fetch(symbols, fetch_start, fetch_end):
+        index_price = source.prices([symbol], fetch_start, fetch_end)
+        index_price['ticker'] = ticker
+        return index_price
 
+    update_series(name, fetch, [ticker], start_date, end_date, store_path)
     return start_date.replace('-', '')
 
-def download_company_sector(company_list):
-    company_sector = []
-    for ticker in company_list:
-        stocks = yf.Ticker(ticker)
-        sector = stocks.info.get('sector', 'N/A')
-        company_sector.append({'ticker': ticker, 'sector': sector})
-    company_sector_path = '../files/company_sector.csv'
+def download_vix_price(start_date, end_date, source=None, store_path=price_store.STORE_PATH):
+    return download_index_price(start_date, end_date, source, store_path, name='vix')
+
+def download_company_sector(company_list, source=None, refresh_days=30, files_path='../files/',
+                            max_workers=8, retries=3, backoff=1.0, rate=10, checkpoint_every=25):
+    '''
+    sectors are cached in sector_cache.csv with the time they were fetched,
+    only tickers not cached or older than refresh_days are fetched again,
+    by max_workers threads, at most rate requests per second,
+    retries per ticker waiting backoff seconds, doubled each time.
+    the cache is saved every checkpoint_every tickers, a ticker failing all retries
+    does not lose the others and is fetched again next run.
+    company_sector.csv is written from the cache
+    '''
+    source = source or YahooFredSource()
+    cache_path = os.path.join(files_path, 'sector_cache.csv')
+    if os.path.exists(cache_path):
+        cache = pd.read_csv(cache_path, parse_dates=['fetched_at']).set_index('ticker')
+    else:
+        cache = pd.DataFrame(columns=['sector', 'fetched_at'], index=pd.Index([], name='ticker'))
+    now = pd.Timestamp.now()
+    fresh = cache.index[cache['fetched_at'] > now - pd.Timedelta(days=refresh_days)]
+    to_fetch = [ticker for ticker in company_list if ticker not in fresh]
+    print(f"fetch sector of {len(to_fetch)} of {len(company_list)} companies")
+
+    def save_cache():
+        cache.reset_index().to_csv(cache_path + '.tmp', columns=['ticker', 'sector', 'fetched_at'],
+                                   index=False)
+        os.replace(cache_path + '.tmp', cache_path)
+
+    fetched = []
+
+    def checkpoint(ticker, sector):
+        cache.loc[ticker, ['sector', 'fetched_at']] = [sector, pd.Timestamp.now()]
+        fetched.append(ticker)
+        if len(fetched) % checkpoint_every == 0:
+            save_cache()
+
+    _, failed = fetch_concurrently(source.company_sector, to_fetch, max_workers=max_workers,
+                                   retries=retries, backoff=backoff, rate=rate,
+                                   on_result=checkpoint)
+    if to_fetch:
+        save_cache()
+    if failed:
+        print(f"failed to fetch sector of {len(failed)} companies: {sorted(failed)}")
+
+    company_sector = [{'ticker': ticker,
+                       'sector': cache.loc[ticker, 'sector'] if ticker in cache.index else 'N/A'}
+                      for ticker in company_list]
+    company_sector_path = os.path.join(files_path, 'company_sector.csv')
     pd.DataFrame(company_sector).to_csv(company_sector_path, columns=['ticker', 'sector'], index=False)
     return company_sector
 
-def download_treasury_yield(start_date, end_date, maturity):
+def download_treasury_yield(start_date, end_date, maturity, source=None,
+                            store_path=price_store.STORE_PATH):
+    source = source or YahooFredSource()
     field = f'DGS{maturity}'
-    treasury_yield = web.DataReader(field, "fred", start_date, end_date)
-    treasury_yield.reset_index(inplace=True)
-    treasury_yield = treasury_yield.rename(columns={'DATE': 'date'})
-    yield_path = f'../files/treasury_yield_{maturity}yr.csv'
-    treasury_yield.to_csv(yield_path, columns=['date', field], index=False)
-    return treasury_yield
-
-def download_data(data_span, ticker_file_path):
+
+    def fetch(symbols, fetch_start, fetch_end):
+        # FRED end date is inclusive
+        treasury_yield = source.treasury_yield(maturity, fetch_start, fetch_end - timedelta(days=1))
+        return price_store.treasury_to_long(treasury_yield, maturity)
+
+    update_series(f'treasury_{maturity}yr', fetch, [field], start_date, end_date, store_path)
+    return price_store.read_treasury(maturity, start_date, end_date, store_path)
+
+def download_data(data_span, ticker_file_path, source=None, files_path='../files/',
+                  sector_refresh_days=30):
+    '''
+    download prices, index, vix, treasury yields and sectors into files_path.
+    only dates not in the price store yet are fetched, sectors are refreshed
+    after sector_refresh_days. source defaults to yfinance and FRED
+    '''
+    source = source or YahooFredSource()
+    store_path = os.path.join(files_path, 'prices')
     ct = datetime.datetime.now(pytz.timezone('America/New_York'))
     if ct.hour >= 16:
         current_date = ct.strftime('%Y-%m-%d')
@@ -78,12 +165,14 @@ def download_data(data_span, ticker_file_path):
     price_start = (ct - relativedelta(years=data_span)).strftime('%Y-%m-01')
     index_start = (ct - relativedelta(years=data_span)).strftime('%Y-%m-01')
     vix_start = (ct - relativedelta(years=data_span)).strftime('%Y-%m-01')
-    price_data = download_stock_price(stock_tickers, price_start, current_date)
-    index_data = download_index_price(index_start, current_date)
-    vix_data = download_vix_price(vix_start, current_date)
-    company_sector = download_company_sector(stock_tickers)
-    treasury_10y = download_treasury_yield(index_start, current_date, 10)
-    treasury_2y = download_treasury_yield(index_start, current_date, 2)
+    # csv files of earlier downloads become the starting point of the store
+    price_store.import_csv_files(files_path, store_path)
+    price_data = download_stock_price(stock_tickers, price_start, current_date, source, store_path)
+    index_data = download_index_price(index_start, current_date, source, store_path)
+    vix_data = download_vix_price(vix_start, current_date, source, store_path)
+    company_sector = download_company_sector(stock_tickers, source, sector_refresh_days, files_path)
+    treasury_10y = download_treasury_yield(index_start, current_date, 10, source, store_path)
+    treasury_2y = download_treasury_yield(index_start, current_date, 2, source, store_path)
     
     return None
 
@@ -1,63 +1,247 @@
 import os
-import pickle
+import math
+from concurrent.futures import ProcessPoolExecutor
 import mlflow
 import numpy as np
-from hyperopt import STATUS_OK, Trials, fmin, hp, tpe
+from hyperopt import STATUS_OK, JOB_STATE_DONE, Trials, fmin, hp, tpe, space_eval
+from hyperopt.base import Domain
 from hyperopt.pyll import scope
-import xgboost as xgb
+from hyperopt.pyll.stochastic import sample
 from sklearn.metrics import root_mean_squared_error
 
+from training_data import TrainingData, fit_booster
+
+EARLY_STOPPING_ROUNDS = 20
+
 def set_mlflow_tracking_uri():
     tracking_uri = os.environ.get("MLFLOW_TRACKING_URI", "http://127.0.0.1:5000")
     mlflow.set_tracking_uri(tracking_uri)
     print(f"MLFlow tracking URI set to: {tracking_uri}")
 
-def load_pickle(filename: str):
-    with open(filename, "rb") as f_in:
-        return pickle.load(f_in)
 
+SEARCH_SPACE = {
+    'max_depth': scope.int(hp.quniform('max_depth', 5, 100, 5)),
+    'n_estimators': scope.int(hp.quniform('n_estimators', 50, 300, 50)),
+    'learning_rate': hp.loguniform('learning_rate', -7, 0),
+    'reg_alpha': hp.loguniform('reg_alpha', -5, -1),
+    'reg_lambda': hp.loguniform('reg_lambda', -6, -1),
+    'min_child_weight': hp.loguniform('min_child_weight', -1, 3),
+    'objective': 'reg:squarederror',
+    'random_state': 42
+}
+
+
+def fit_model(params: dict, data: TrainingData, early_stopping_rounds=EARLY_STOPPING_ROUNDS,
+              n_jobs=None, xgb_model=None):
+    '''
+    fit xgboost on the cached train matrix, stop when val rmse did not improve
+    for early_stopping_rounds (None trains all n_estimators).
+    xgb_model continues training a previous booster.
+    returns booster, val rmse and number of trees used for prediction
+    '''
+    booster = fit_booster(params, data, n_jobs, early_stopping_rounds, xgb_model)
+    if early_stopping_rounds:
+        n_trees = booster.best_iteration + 1
+    else:
+        n_trees = booster.num_boosted_rounds()
+    y_pred = booster.predict(data.dmatrix('val'), iteration_range=(0, n_trees))
+    rmse = root_mean_squared_error(data.label('val'), y_pred)
+    return booster, rmse, n_trees
+
+
+def logged_params(params: dict, n_trees: int):
+    '''
+    params as logged in mlflow, n_estimators is the number of trees evaluated,
+    so register_model trains the same model again
+    '''
+    return dict(params, n_estimators=n_trees)
+
+
+# training data of a worker process, loaded once by init_worker
+_worker_data = {}
+
+
+def init_worker(data_path: str):
+    _worker_data['data'] = TrainingData(data_path)
+
+
+def fit_trial(params: dict, n_jobs: int, early_stopping_rounds=EARLY_STOPPING_ROUNDS):
+    '''
+    fit one trial in a worker process, return val rmse and number of trees
+    '''
+    _, rmse, n_trees = fit_model(params, _worker_data['data'], early_stopping_rounds, n_jobs)
+    return rmse, n_trees
+
+
+def fit_rung(params: dict, n_jobs: int, budget: int, previous=None,
+             early_stopping_rounds=EARLY_STOPPING_ROUNDS, previous_budget=0):
+    '''
+    train one config of successive halving up to budget trees in a worker process,
+    continuing from (model, rmse, n_trees) of the previous rung with previous_budget trees.
+    a config whose training stopped early before previous_budget is not trained again,
+    one that used its whole budget continues, also when its best tree is not the last.
+    early stopping of the continued training only sees the new trees, so when none of them
+    improves on the previous best, the previous rmse and n_trees are kept.
+    returns (model, rmse, n_trees)
+    '''
+    if previous is None:
+        return fit_model(dict(params, n_estimators=budget), _worker_data['data'],
+                         early_stopping_rounds, n_jobs)
+    model, rmse, n_trees = previous
+    done = model.num_boosted_rounds()
+    if done < previous_budget:
+        return previous
+    continued = fit_model(dict(params, n_estimators=budget - done), _worker_data['data'],
+                         early_stopping_rounds, n_jobs, xgb_model=model)
+    if continued[1] < rmse:
+        return continued
+    # previous trees are the first trees of the continued model
+    continued[0].set_attr(best_iteration=str(n_trees - 1))
+    return continued[0], rmse, n_trees
 
-def run_optimization(data_path: str, num_trials: int):
+
+def log_trial(params: dict, rmse: float, tags=None):
+    with mlflow.start_run():
+        mlflow.set_tag("model", "xgboost")
+        for key, value in (tags or {}).items():
+            mlflow.set_tag(key, value)
+        mlflow.log_params(params)
+        mlflow.log_metric("rmse", rmse)
+
+
+def run_parallel_trials(data_path: str, num_trials: int, workers: int, rstate,
+                        early_stopping_rounds=EARLY_STOPPING_ROUNDS):
+    '''
+    ask and tell loop over hyperopt tpe: suggest a batch of `workers` trials,
+    fit them in a process pool with cores / workers xgboost threads each,
+    then log them to mlflow and report them to tpe from this process.
+    seeds are drawn from rstate in order and a batch is reported when complete,
+    so results only depend on rstate and workers, not on which trial finishes first
+    '''
+    domain = Domain(lambda params: None, SEARCH_SPACE)
+    trials = Trials()
+    n_jobs = max(1, (os.cpu_count() or 1) // workers)
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                             initargs=(data_path,)) as executor:
+        while len(trials) < num_trials:
+            new_ids = trials.new_trial_ids(min(workers, num_trials - len(trials)))
+            docs = []
+            for new_id in new_ids:
+                docs.extend(tpe.suggest([new_id], domain, trials, rstate.integers(2**31 - 1)))
+            params = [
+                space_eval(SEARCH_SPACE, {key: val[0] for key, val in doc['misc']['vals'].items() if val})
+                for doc in docs
+            ]
+            futures = [executor.submit(fit_trial, trial_params, n_jobs, early_stopping_rounds)
+                       for trial_params in params]
+            for doc, trial_params, future in zip(docs, params, futures):
+                rmse, n_trees = future.result()
+                log_trial(logged_params(trial_params, n_trees), rmse)
+                doc['state'] = JOB_STATE_DONE
+                doc['result'] = {'loss': rmse, 'status': STATUS_OK, 'n_trees': n_trees}
+            trials.insert_trial_docs(docs)
+            trials.refresh()
+            print(f"{len(trials)} of {num_trials} trials, best rmse {min(trials.losses())}")
+    return best_params(trials)
+
+
+def best_params(trials: Trials):
+    '''
+    params of the best trial as logged in mlflow, decoded from the search space
+    '''
+    return logged_params(space_eval(SEARCH_SPACE, trials.argmin),
+                         trials.best_trial['result']['n_trees'])
+
+
+def halving_budgets(min_budget: int, max_budget: int, eta: int):
+    '''
+    trees per rung: max_budget / eta^k for every k where this is at least min_budget,
+    smallest first, so the first rung can have more than min_budget trees
+    '''
+    n_rungs = int(math.floor(math.log(max_budget / min_budget, eta) + 1e-9)) + 1
+    return [int(round(max_budget / eta ** (n_rungs - 1 - rung))) for rung in range(n_rungs)]
+
+
+def run_successive_halving(data_path: str, num_configs: int, workers: int, rstate,
+                           min_budget=12, max_budget=300, eta=3,
+                           early_stopping_rounds=EARLY_STOPPING_ROUNDS):
+    '''
+    successive halving: num_configs random configs are trained with the budget of the
+    first rung from halving_budgets, the best 1/eta of them continue training to eta times
+    more trees, and so on up to max_budget. every config is logged once, at the last rung it reached.
+    n_estimators of the search space is replaced by the budget
+    '''
+    configs = [sample(SEARCH_SPACE, rng=rstate) for _ in range(num_configs)]
+    results = [None] * num_configs
+    alive = list(range(num_configs))
+    n_jobs = max(1, (os.cpu_count() or 1) // workers)
+    best = (np.inf, None)
+    budgets = halving_budgets(min_budget, max_budget, eta)
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                             initargs=(data_path,)) as executor:
+        for rung, budget in enumerate(budgets):
+            previous_budget = budgets[rung - 1] if rung else 0
+            futures = {i: executor.submit(fit_rung, configs[i], n_jobs, budget, results[i],
+                                          early_stopping_rounds, previous_budget)
+                       for i in alive}
+            for i, future in futures.items():
+                results[i] = future.result()
+            last_rung = rung == len(budgets) - 1
+            n_promoted = 0 if last_rung else max(1, len(alive) // eta)
+            ranked = sorted(alive, key=lambda i: results[i][1])
+            for i in ranked[n_promoted:]:
+                _, rmse, n_trees = results[i]
+                log_trial(logged_params(configs[i], n_trees), rmse, tags={"rung": rung})
+                results[i] = None
+                if rmse < best[0]:
+                    best = (rmse, logged_params(configs[i], n_trees))
+            alive = ranked[:n_promoted]
+            print(f"rung {rung}: {len(futures)} configs with up to {budget} trees, "
+                  f"best rmse {results[ranked[0]][1] if n_promoted else best[0]}")
+    return best[1]
+
+
+def run_optimization(data_path: str, num_trials: int, workers: int = 1,
+                     scheduler: str = 'tpe', early_stopping_rounds=EARLY_STOPPING_ROUNDS):
+    '''
+    search xgboost parameters by val rmse, every trial logged in mlflow.
+    trials stop early when val rmse does not improve for early_stopping_rounds.
+    workers > 1 runs trials in a process pool.
+    scheduler 'halving' runs successive halving over num_trials random configs instead of tpe.
+    every scheduler returns the params of the best trial as logged,
+    n_estimators is the number of trees it used
+    '''
     set_mlflow_tracking_uri()
     mlflow.set_experiment("stock-return-prediction-hyperopt")
 
-    X_train, y_train = load_pickle(os.path.join(data_path, "train.pkl"))
-    X_val, y_val = load_pickle(os.path.join(data_path, "val.pkl"))
-
-    
-    search_space = {
-        'max_depth': scope.int(hp.quniform('max_depth', 5, 100, 5)),
-        'n_estimators': scope.int(hp.quniform('n_estimators', 50, 300, 50)),
-        'learning_rate': hp.loguniform('learning_rate', -7, 0),
-        'reg_alpha': hp.loguniform('reg_alpha', -5, -1),
-        'reg_lambda': hp.loguniform('reg_lambda', -6, -1),
-        'min_child_weight': hp.loguniform('min_child_weight', -1, 3),
-        'objective': 'reg:squarederror',
-        'random_state': 42
-    }
+    rstate = np.random.default_rng(42)  # for reproducible results
+    if scheduler == 'halving':
+        return run_successive_halving(data_path, num_trials, max(workers, 1), rstate,
+                                      early_stopping_rounds=early_stopping_rounds)
+    if workers > 1:
+        return run_parallel_trials(data_path, num_trials, workers, rstate, early_stopping_rounds)
+
+    data = TrainingData(data_path)
 
     def objective(params):
         with mlflow.start_run():
             mlflow.set_tag("model", "xgboost")
-            mlflow.log_params(params)
-            xgb_model = xgb.XGBRegressor(**params)
-            xgb_model.fit(X_train, y_train)
-            y_pred = xgb_model.predict(X_val)
-            rmse = root_mean_squared_error(y_val, y_pred)
+            _, rmse, n_trees = fit_model(params, data, early_stopping_rounds)
+            mlflow.log_params(logged_params(params, n_trees))
             mlflow.log_metric("rmse", rmse)
 
-        return {'loss': rmse, 'status': STATUS_OK}
+        return {'loss': rmse, 'status': STATUS_OK, 'n_trees': n_trees}
 
-    rstate = np.random.default_rng(42)  # for reproducible results
-    best_result = fmin(
+    trials = Trials()
+    fmin(
         fn=objective,
-        space=search_space,
+        space=SEARCH_SPACE,
         algo=tpe.suggest,
         max_evals=num_trials,
-        trials=Trials(),
+        trials=trials,
         rstate=rstate
     )
-    return best_result
+    return best_params(trials)
 
 if __name__ == '__main__':
-    run_optimization('../files/output', 15)
\ No newline at end of file
+    run_optimization('../files/output', 15, workers=os.cpu_count() or 1)
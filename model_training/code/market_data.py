@@ -0,0 +1,167 @@
+"""market data sources used by get_stock_price, yfinance/FRED or local fixture files"""
+import os
+import time
+import threading
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import pandas as pd
+
+
+class MarketDataSource(ABC):
+    '''
+    interface of a market data provider.
+    prices returns long dataframe (date, ticker, price) of adjusted close prices
+    for dates in [start_date, end_date), ticker is the symbol asked for.
+    treasury_yield returns dataframe (date, DGS10) or (date, DGS2).
+    company_sector returns the sector name of one ticker.
+    '''
+
+    @abstractmethod
+    def prices(self, symbols, start_date, end_date):
+        pass
+
+    @abstractmethod
+    def treasury_yield(self, maturity, start_date, end_date):
+        pass
+
+    @abstractmethod
+    def company_sector(self, ticker):
+        pass
+
+
+class YahooFredSource(MarketDataSource):
+    '''
+    prices and sectors from yfinance, treasury yields from FRED
+    '''
+
+    def prices(self, symbols, start_date, end_date):
+        import yfinance as yf
+
+        stock_data = yf.download(list(symbols), start=start_date, end=end_date, auto_adjust=True)
+
+        # Extract adjusted close prices
+        adj_close_prices = stock_data['Close']
+        adj_close_prices.reset_index(inplace=True)
+        df_unpivot = pd.melt(adj_close_prices, col_level=0, id_vars=['Date'],
+                             value_vars=adj_close_prices.columns.tolist())
+        return df_unpivot.rename(columns={'value': 'price', 'Ticker': 'ticker', 'Date': 'date'})
+
+    def treasury_yield(self, maturity, start_date, end_date):
+        import pandas_datareader.data as web
+
+        field = f'DGS{maturity}'
+        treasury_yield = web.DataReader(field, "fred", start_date, end_date)
+        treasury_yield.reset_index(inplace=True)
+        return treasury_yield.rename(columns={'DATE': 'date'})
+
+    def company_sector(self, ticker):
+        import yfinance as yf
+
+        return yf.Ticker(ticker).info.get('sector', 'N/A')
+
+
+class LocalFixtureSource(MarketDataSource):
+    '''
+    offline stand-in for yfinance and FRED, reads csv files in the layout
+    get_stock_price used to write: stock_price.csv, index_price.csv (^GSPC),
+    vix_price.csv (^VIX), treasury_yield_10yr.csv, treasury_yield_2yr.csv
+    and company_sector.csv. every call is recorded in requests.
+    '''
+
+    INDEX_FILES = {'^GSPC': 'index_price.csv', '^VIX': 'vix_price.csv'}
+
+    def __init__(self, fixture_path):
+        self.fixture_path = fixture_path
+        self.requests = []
+
+    def read_csv(self, file_name, **kwargs):
+        return pd.read_csv(os.path.join(self.fixture_path, file_name), **kwargs)
+
+    def prices(self, symbols, start_date, end_date):
+        self.requests.append(('prices', tuple(symbols), pd.Timestamp(start_date), pd.Timestamp(end_date)))
+        frames = []
+        stock_symbols = [symbol for symbol in symbols if symbol not in self.INDEX_FILES]
+        if stock_symbols:
+            stock_df = self.read_csv('stock_price.csv', parse_dates=['date'])
+            frames.append(stock_df[stock_df['ticker'].isin(stock_symbols)])
+        for symbol in symbols:
+            if symbol in self.INDEX_FILES:
+                index_df = self.read_csv(self.INDEX_FILES[symbol], parse_dates=['date'])
+                frames.append(index_df.assign(ticker=symbol))
+        price_df = pd.concat(frames, ignore_index=True)
+        mask = (price_df['date'] >= pd.Timestamp(start_date)) & (price_df['date'] < pd.Timestamp(end_date))
+        return price_df.loc[mask, ['date', 'ticker', 'price']].reset_index(drop=True)
+
+    def treasury_yield(self, maturity, start_date, end_date):
+        self.requests.append(('treasury', maturity, pd.Timestamp(start_date), pd.Timestamp(end_date)))
+        treasury_df = self.read_csv(f'treasury_yield_{maturity}yr.csv', parse_dates=['date'])
+        mask = (treasury_df['date'] >= pd.Timestamp(start_date)) & (treasury_df['date'] <= pd.Timestamp(end_date))
+        return treasury_df[mask].reset_index(drop=True)
+
+    def company_sector(self, ticker):
+        self.requests.append(('sector', ticker))
+        sector_df = self.read_csv('company_sector.csv').set_index('ticker')
+        return sector_df['sector'].get(ticker, 'N/A')
+
+
+class RateLimiter:
+    '''
+    allow at most rate calls per second, shared by all threads.
+    rate None or 0 means no limit
+    '''
+
+    def __init__(self, rate=None):
+        self.interval = 1.0 / rate if rate else 0.0
+        self._lock = threading.Lock()
+        self._next_call = time.monotonic()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            delay = self._next_call - now
+            self._next_call = max(now, self._next_call) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+def fetch_with_retry(fetch, item, retries, backoff, rate_limiter):
+    '''
+    call fetch(item), retry with exponential backoff on exceptions
+    '''
+    for attempt in range(retries + 1):
+        rate_limiter.wait()
+        try:
+            return fetch(item)
+        except Exception:
+            if attempt == retries:
+                raise
+            time.sleep(backoff * 2 ** attempt)
+
+
+def fetch_concurrently(fetch, items, max_workers=8, retries=3, backoff=1.0, rate=None,
+                       on_result=None):
+    '''
+    call fetch(item) for every item in a bounded thread pool,
+    with per item retries and a shared rate limit.
+    on_result(item, value) runs in the calling thread as results arrive, for checkpointing.
+    a failed item does not stop the others,
+    returns dict of results and dict of exceptions of failed items
+    '''
+    rate_limiter = RateLimiter(rate)
+    results, failed = {}, {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(fetch_with_retry, fetch, item, retries, backoff, rate_limiter): item
+                   for item in items}
+        for future in as_completed(futures):
+            item = futures[future]
+            try:
+                results[item] = future.result()
+            except Exception as e:
+                failed[item] = e
+                continue
+            if on_result is not None:
+                on_result(item, results[item])
+    return results, failed
@@ -4,6 +4,14 @@ import pandas as pd
 import numpy as np
 from sklearn.feature_extraction import DictVectorizer
 
+from feature_encoder import FeatureEncoder
+from columnar_dataset import write_dataset
+
+CATEGORICAL = ['sector']
+NUMERICAL = ['month_index', 'index_avg', 'alpha', 'beta', 'historical_vol', 'eom_10yr',
+             '10yr_avg', 'spread', 'vix_avg']
+TARGET = 'future_1m_return'
+
 
 def dump_pickle(obj, filename: str):
     with open(filename, "wb") as f_out:
@@ -19,14 +27,13 @@ def read_dataframe(filename: str):
 
 
 def preprocess(df: pd.DataFrame, dv: DictVectorizer, fit_dv: bool = False):
-    categorical = ['sector']
-    numerical = ['month_index', 'index_avg', 'alpha', 'beta', 'historical_vol', 'eom_10yr',
-                 '10yr_avg', 'spread', 'vix_avg']
-    dicts = df[categorical + numerical].to_dict(orient='records')
+    categorical = CATEGORICAL
+    numerical = NUMERICAL
     if fit_dv:
-        X = dv.fit_transform(dicts)
-    else:
-        X = dv.transform(dicts)
+        # vocabulary only depends on distinct categories, no need to fit every row
+        distinct = df[categorical + numerical].drop_duplicates(subset=categorical)
+        dv.fit(distinct.to_dict(orient='records'))
+    X = FeatureEncoder.from_dict_vectorizer(dv).transform(df, categorical, numerical)
     return X, dv
 
 
@@ -47,26 +54,21 @@ def run_data_prep(raw_data_path: str, dest_path: str):
     df_val = df[df['date'].isin(val_dates)]
     df_test = df[df['date'].isin(test_dates)]
     
-    # Extract the target
-    target = 'future_1m_return'
-    y_train = df_train[target].values
-    y_val = df_val[target].values
-    y_test = df_test[target].values
-
-    # Fit the DictVectorizer and preprocess data
+    # Fit the DictVectorizer, columns are encoded when loaded
     dv = DictVectorizer()
-    X_train, dv = preprocess(df_train, dv, fit_dv=True)
-    X_val, _ = preprocess(df_val, dv, fit_dv=False)
-    X_test, _ = preprocess(df_test, dv, fit_dv=False)
+    _, dv = preprocess(df_train, dv, fit_dv=True)
     
     # Create dest_path folder unless it already exists
     os.makedirs(dest_path, exist_ok=True)
 
-    # Save DictVectorizer and datasets
+    # Save DictVectorizer and columnar datasets, train/, val/ and test/ replace the pickles
     dump_pickle(dv, os.path.join(dest_path, "dv.pkl"))
-    dump_pickle((X_train, y_train), os.path.join(dest_path, "train.pkl"))
-    dump_pickle((X_val, y_val), os.path.join(dest_path, "val.pkl"))
-    dump_pickle((X_test, y_test), os.path.join(dest_path, "test.pkl"))
+    for name, df_split in (('train', df_train), ('val', df_val), ('test', df_test)):
+        write_dataset(df_split, dv.feature_names_, os.path.join(dest_path, name),
+                      CATEGORICAL[0], NUMERICAL, TARGET)
+        # pickles of an earlier run are stale now
+        if os.path.exists(os.path.join(dest_path, f"{name}.pkl")):
+            os.remove(os.path.join(dest_path, f"{name}.pkl"))
 
 
 if __name__ == '__main__':
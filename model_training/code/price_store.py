@@ -0,0 +1,226 @@
+"""date partitioned parquet store for raw market data, replacing the csv files"""
+import os
+import glob
+import json
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+STORE_PATH = '../files/prices/'
+
+# yfinance prices are float32 precision already, treasury yields are decimals from FRED
+SERIES_PRICE_TYPE = {
+    'stock': pa.float32(),
+    'index': pa.float32(),
+    'vix': pa.float32(),
+    'treasury_10yr': pa.float64(),
+    'treasury_2yr': pa.float64(),
+}
+
+# csv files written by get_stock_price before the store existed
+LEGACY_CSV = {
+    'stock': 'stock_price.csv',
+    'index': 'index_price.csv',
+    'vix': 'vix_price.csv',
+    'treasury_10yr': 'treasury_yield_10yr.csv',
+    'treasury_2yr': 'treasury_yield_2yr.csv',
+}
+
+
+def series_schema(name):
+    return pa.schema([
+        ('date', pa.date32()),
+        ('ticker', pa.dictionary(pa.int32(), pa.string())),
+        ('price', SERIES_PRICE_TYPE[name]),
+    ])
+
+
+def series_path(name, store_path=STORE_PATH):
+    return os.path.join(store_path, name)
+
+
+def partition_file(name, year, month, store_path=STORE_PATH):
+    return os.path.join(series_path(name, store_path), f'year={year}', f'month={month}', 'part-0.parquet')
+
+
+def has_series(name, store_path=STORE_PATH):
+    return bool(glob.glob(os.path.join(series_path(name, store_path), 'year=*', 'month=*', '*.parquet')))
+
+
+def treasury_to_long(treasury_df, maturity):
+    '''
+    treasury yield (date, DGS10) to store format (date, ticker, price)
+    '''
+    field = f'DGS{maturity}'
+    long_df = treasury_df[['date', field]].rename(columns={field: 'price'})
+    long_df['ticker'] = field
+    return long_df
+
+
+def write_series(df, name, store_path=STORE_PATH):
+    '''
+    merge long dataframe (date, ticker, price) into the store,
+    one parquet file per year and month. rows of the same date and ticker
+    already stored are replaced, files are replaced atomically.
+    '''
+    df = df[['date', 'ticker', 'price']].copy()
+    df['date'] = pd.to_datetime(df['date'])
+    months = df['date'].dt.year * 100 + df['date'].dt.month
+    for key, month_df in df.groupby(months):
+        year, month = divmod(int(key), 100)
+        path = partition_file(name, year, month, store_path)
+        if os.path.exists(path):
+            stored_df = read_partition(path)
+            month_df = pd.concat([stored_df, month_df], ignore_index=True)
+        month_df = (month_df.drop_duplicates(['date', 'ticker'], keep='last')
+                    .sort_values(['ticker', 'date'], kind='stable'))
+        table = pa.Table.from_pandas(
+            pd.DataFrame({
+                'date': month_df['date'].dt.date.to_numpy(),
+                'ticker': month_df['ticker'].astype(str).to_numpy(),
+                'price': month_df['price'].to_numpy(dtype=np.float64),
+            }),
+            schema=series_schema(name), preserve_index=False, safe=False,
+        )
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        pq.write_table(table, path + '.tmp')
+        os.replace(path + '.tmp', path)
+
+
+def read_partition(path):
+    table = pq.read_table(path)
+    return table_to_frame(table)
+
+
+def table_to_frame(table):
+    df = table.to_pandas(date_as_object=False)
+    df['date'] = df['date'].astype('datetime64[ns]')
+    df['ticker'] = df['ticker'].cat.set_categories(sorted(df['ticker'].cat.categories))
+    df['price'] = df['price'].astype(np.float64)
+    return df
+
+
+def month_filter(start, end):
+    '''
+    expression on partition columns, so files outside [start, end) are not opened
+    '''
+    expr = None
+    if start is not None:
+        start = pd.Timestamp(start)
+        expr = (ds.field('year') > start.year) | (
+            (ds.field('year') == start.year) & (ds.field('month') >= start.month))
+    if end is not None:
+        end = pd.Timestamp(end)
+        end_expr = (ds.field('year') < end.year) | (
+            (ds.field('year') == end.year) & (ds.field('month') <= end.month))
+        expr = end_expr if expr is None else expr & end_expr
+    return expr
+
+
+def read_series(name, start=None, end=None, tickers=None, store_path=STORE_PATH):
+    '''
+    read long dataframe (date, ticker, price) with date in [start, end)
+    and ticker in tickers, filters are pushed down to partitions and row groups.
+    ticker is categorical, price float64, date datetime64
+    '''
+    dataset = ds.dataset(series_path(name, store_path), format='parquet', partitioning='hive')
+    expr = month_filter(start, end)
+    if start is not None:
+        date_expr = ds.field('date') >= pa.scalar(pd.Timestamp(start).date(), pa.date32())
+        expr = expr & date_expr
+    if end is not None:
+        date_expr = ds.field('date') < pa.scalar(pd.Timestamp(end).date(), pa.date32())
+        expr = expr & date_expr
+    if tickers is not None:
+        ticker_expr = ds.field('ticker').isin(list(tickers))
+        expr = ticker_expr if expr is None else expr & ticker_expr
+    table = dataset.to_table(columns=['date', 'ticker', 'price'], filter=expr)
+    df = table_to_frame(table)
+    return df.sort_values(['ticker', 'date'], kind='stable', ignore_index=True)
+
+
+def read_treasury(maturity, start=None, end=None, store_path=STORE_PATH):
+    '''
+    treasury yield in the csv layout, columns date and DGS10 or DGS2
+    '''
+    field = f'DGS{maturity}'
+    df = read_series(f'treasury_{maturity}yr', start, end, store_path=store_path)
+    df = df.rename(columns={'price': field}).sort_values('date', ignore_index=True)
+    return df[['date', field]]
+
+
+def first_date(name, store_path=STORE_PATH):
+    '''
+    first stored date of a series, only the earliest partition is read
+    '''
+    files = glob.glob(os.path.join(series_path(name, store_path), 'year=*', 'month=*', '*.parquet'))
+    if not files:
+        return None
+
+    def year_month(path):
+        month_dir = os.path.dirname(path)
+        year_dir = os.path.dirname(month_dir)
+        return int(year_dir.rsplit('=', 1)[1]), int(month_dir.rsplit('=', 1)[1])
+
+    earliest = min(year_month(path) for path in files)
+    partition = [path for path in files if year_month(path) == earliest]
+    return min(read_partition(path)['date'].min() for path in partition)
+
+
+def stored_dates(name, store_path=STORE_PATH):
+    '''
+    first and last stored date of a series, and stored price per ticker on the last date.
+    None if series is not stored yet
+    '''
+    if not has_series(name, store_path):
+        return None
+    dataset = ds.dataset(series_path(name, store_path), format='parquet', partitioning='hive')
+    dates = table_to_frame(dataset.to_table(columns=['date', 'ticker', 'price']))
+    last_date = dates['date'].max()
+    last_prices = dates[dates['date'] == last_date].set_index('ticker')['price']
+    last_prices.index = last_prices.index.astype(str)
+    return dates['date'].min(), last_date, last_prices
+
+
+def read_coverage(name, store_path=STORE_PATH):
+    '''
+    date range [start, end) already requested from the data source,
+    None if never recorded
+    '''
+    coverage_path = os.path.join(series_path(name, store_path), '_coverage.json')
+    if not os.path.exists(coverage_path):
+        return None
+    with open(coverage_path) as f:
+        coverage = json.load(f)
+    return pd.Timestamp(coverage['start']), pd.Timestamp(coverage['end'])
+
+
+def write_coverage(name, start, end, store_path=STORE_PATH):
+    coverage_path = os.path.join(series_path(name, store_path), '_coverage.json')
+    os.makedirs(os.path.dirname(coverage_path), exist_ok=True)
+    with open(coverage_path + '.tmp', 'w') as f:
+        json.dump({'start': str(pd.Timestamp(start).date()), 'end': str(pd.Timestamp(end).date())}, f)
+    os.replace(coverage_path + '.tmp', coverage_path)
+
+
+def import_csv_files(files_path='../files/', store_path=STORE_PATH):
+    '''
+    one time migration of csv files into the store,
+    series already in the store are skipped
+    '''
+    for name, file_name in LEGACY_CSV.items():
+        csv_path = os.path.join(files_path, file_name)
+        if has_series(name, store_path) or not os.path.exists(csv_path):
+            continue
+        df = pd.read_csv(csv_path, parse_dates=['date'])
+        if name.startswith('treasury'):
+            df = treasury_to_long(df, int(name[len('treasury_'):-len('yr')]))
+        write_series(df, name, store_path)
+        print(f"imported {csv_path} into price store")
+
+
+if __name__ == '__main__':
+    import_csv_files()
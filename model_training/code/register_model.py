@@ -1,12 +1,12 @@
 import os
-import pickle
 import mlflow
 
 from mlflow.entities import ViewType
 from mlflow.tracking import MlflowClient
-import xgboost as xgb
 from sklearn.metrics import root_mean_squared_error
 
+from training_data import TrainingData, fit_booster, as_regressor
+
 HPO_EXPERIMENT_NAME = "stock-return-prediction-hyperopt"
 EXPERIMENT_NAME = "xgboost-best-models"
 XGBOOST_PARAMS = ['max_depth', 'n_estimators', 'learning_rate', 
@@ -19,17 +19,14 @@ def set_mlflow_tracking_uri():
     mlflow.set_tracking_uri(tracking_uri)
     print(f"MLFlow tracking URI set to: {tracking_uri}")
 
-def load_pickle(filename):
-    with open(filename, "rb") as f_in:
-        return pickle.load(f_in)
-
-
-def train_and_log_model(data_path, params):
+def train_and_log_model(data_path, params, data=None):
+    '''
+    data is a TrainingData of data_path shared by the top n models, loaded here if None
+    '''
     set_mlflow_tracking_uri()
     mlflow.set_experiment(EXPERIMENT_NAME)
-    X_train, y_train = load_pickle(os.path.join(data_path, "train.pkl"))
-    X_val, y_val = load_pickle(os.path.join(data_path, "val.pkl"))
-    X_test, y_test = load_pickle(os.path.join(data_path, "test.pkl"))
+    if data is None:
+        data = TrainingData(data_path)
 
     with mlflow.start_run():
         mlflow.autolog(disable=True)
@@ -42,15 +39,15 @@ def train_and_log_model(data_path, params):
             if param in ['max_depth', 'n_estimators', 'random_state']:
                 new_params[param] = int(params[param])
         # print(new_params)
-        xgb_model = xgb.XGBRegressor(**new_params)
-        xgb_model.fit(X_train, y_train)
+        booster = fit_booster(new_params, data)
+        xgb_model = as_regressor(booster, new_params)
         mlflow.set_tag("model", "xgboost")
         mlflow.log_params(new_params)
 
         # Evaluate model on the validation and test sets
-        val_rmse = root_mean_squared_error(y_val, xgb_model.predict(X_val))
+        val_rmse = root_mean_squared_error(data.label('val'), booster.predict(data.dmatrix('val')))
         mlflow.log_metric("val_rmse", val_rmse)
-        test_rmse = root_mean_squared_error(y_test, xgb_model.predict(X_test))
+        test_rmse = root_mean_squared_error(data.label('test'), booster.predict(data.dmatrix('test')))
         mlflow.log_metric("test_rmse", test_rmse)
         mlflow.xgboost.log_model(xgb_model, artifact_path="model")
         mlflow.log_artifact(os.path.join(data_path, "dv.pkl"))
@@ -68,8 +65,9 @@ def run_register_model(data_path: str, top_n: int):
         order_by=["metrics.rmse ASC"]
     )
     
+    data = TrainingData(data_path)
     for run in runs:
-        train_and_log_model(data_path=data_path, params=run.data.params)
+        train_and_log_model(data_path=data_path, params=run.data.params, data=data)
 
     # Select the model with the lowest test RMSE
     experiment = client.get_experiment_by_name(EXPERIMENT_NAME)
@@ -0,0 +1,21 @@
+import os
+import pickle
+
+import numpy as np
+import pytest
+from scipy import sparse
+
+
+@pytest.fixture
+def training_pickles(tmp_path):
+    '''
+    train.pkl and val.pkl of random sparse features in tmp_path,
+    shared by the hpo and training data tests
+    '''
+    rng = np.random.default_rng(0)
+    for name, n_rows in (('train', 300), ('val', 100)):
+        X = rng.normal(size=(n_rows, 5))
+        y = X[:, 0] * 0.1 + rng.normal(scale=0.05, size=n_rows)
+        with open(os.path.join(tmp_path, f'{name}.pkl'), 'wb') as f:
+            pickle.dump((sparse.csr_matrix(X), y), f)
+    return tmp_path
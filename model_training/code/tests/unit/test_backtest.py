@@ -0,0 +1,37 @@
+import pandas as pd
+
+import backtest
+
+
+def write_features(path, n_months=8, n_tickers=40):
+    # first months of tickers in every month of ../files/features.parquet
+    df = pd.read_parquet('../files/features.parquet')
+    df = df[df['date'].isin(sorted(df['date'].unique())[:n_months])]
+    counts = df['ticker'].value_counts()
+    tickers = sorted(counts.index[counts == n_months])[:n_tickers]
+    # shuffled rows, backtest sorts by date
+    df[df['ticker'].isin(tickers)].sample(frac=1, random_state=0).to_parquet(
+        path / 'features.parquet')
+
+
+# one out of sample row per month after the first min_train_months
+def test_walk_forward(tmp_path):
+    write_features(tmp_path)
+    params = dict(n_estimators=10)
+    scratch = backtest.run_backtest(str(tmp_path), params, min_train_months=3, warm_start=False)
+    assert scratch['month'].tolist() == list(pd.date_range('2023-10-01', periods=5, freq='MS'))
+    assert (scratch['rows'] == 40).all() and (scratch['n_trees'] == 10).all()
+
+    warm = backtest.run_backtest(str(tmp_path), params, min_train_months=3, workers=2)
+    # the first fold of every chunk trains from scratch
+    assert warm['rmse'][0] == scratch['rmse'][0]
+    assert warm['rmse'][3] == scratch['rmse'][3]
+    assert (warm['n_trees'] == 10).all()
+
+    # by default only the first fold trains from scratch
+    single = backtest.run_backtest(str(tmp_path), params, min_train_months=3)
+    assert single['rmse'][0] == scratch['rmse'][0]
+    assert single['rmse'][3] != scratch['rmse'][3]
+
+    grown = backtest.run_backtest(str(tmp_path), params, min_train_months=3, trees_per_fold=2)
+    assert grown['n_trees'].tolist() == [10, 12, 14, 16, 18]
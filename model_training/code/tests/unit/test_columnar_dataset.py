@@ -0,0 +1,61 @@
+import os
+
+import numpy as np
+import pandas as pd
+import xgboost as xgb
+from sklearn.feature_extraction import DictVectorizer
+
+from columnar_dataset import ColumnarDataset, load_dataset
+from preprocess_data import preprocess, run_data_prep
+from training_data import TrainingData, fit_booster
+
+PARAMS = dict(max_depth=4, n_estimators=20, learning_rate=0.3, random_state=42)
+
+
+def prepare(tmp_path):
+    # first 10 months of ../files/features.parquet: 7 train, 1 val and 2 test months
+    df = pd.read_parquet('../files/features.parquet')
+    df = df[df['date'].isin(sorted(df['date'].unique())[:10])].reset_index(drop=True)
+    # a sector the train months have not seen is encoded as unknown
+    df.loc[df['date'] == df['date'].max(), 'sector'] = 'Conglomerates'
+    df.to_parquet(tmp_path / 'features.parquet')
+    run_data_prep(str(tmp_path), str(tmp_path / 'output'))
+    return df
+
+
+# columnar train/val/test load as the same csr matrices preprocess builds
+def test_same_matrix_as_preprocess(tmp_path):
+    df = prepare(tmp_path)
+    output = tmp_path / 'output'
+    assert sorted(os.listdir(output)) == ['dv.pkl', 'test', 'train', 'val']
+
+    dates = sorted(df['date'].unique())
+    df_train = df[df['date'] < dates[7]]
+    df_test = df[df['date'] >= dates[8]]
+    dv = DictVectorizer()
+    X_expected, dv = preprocess(df_train, dv, fit_dv=True)
+    X_test_expected, _ = preprocess(df_test, dv)
+
+    X, y = load_dataset(str(output / 'train'))
+    assert X.shape == X_expected.shape and X.nnz == X_expected.nnz
+    np.testing.assert_array_equal(X.indices, X_expected.indices)
+    np.testing.assert_array_equal(X.data, X_expected.data.astype(np.float32))
+    np.testing.assert_array_equal(y, df_train['future_1m_return'].values)
+    X_test, _ = load_dataset(str(output / 'test'))
+    assert X_test.nnz == X_test_expected.nnz
+
+    dataset = ColumnarDataset(str(output / 'train'))
+    assert dataset.tickers().tolist() == df_train['ticker'].tolist()
+    assert (dataset.dates == df_train['date'].values.astype('datetime64[D]')).all()
+
+
+# models trained from memory-mapped columns are the same as from the csr matrices
+def test_same_model_as_csr(tmp_path):
+    prepare(tmp_path)
+    data = TrainingData(str(tmp_path / 'output'))
+    X_train, y_train = data.load('train')
+    X_val, _ = data.load('val')
+    expected = xgb.XGBRegressor(**PARAMS).fit(X_train, y_train).predict(X_val)
+
+    booster = fit_booster(PARAMS, TrainingData(str(tmp_path / 'output')))
+    np.testing.assert_array_equal(booster.predict(xgb.DMatrix(X_val)), expected)
@@ -0,0 +1,124 @@
+import time
+import shutil
+import threading
+import pandas as pd
+import numpy as np
+import get_stock_price
+import price_store
+from market_data import LocalFixtureSource
+
+tickers = ['AAA', 'BBB']
+
+
+def make_fixture(path):
+    # two stocks made from index prices, other files copied from ../files
+    index_df = pd.read_csv('../files/index_price.csv', parse_dates=['date'])
+    stock_df = pd.concat([index_df.assign(ticker='AAA', price=index_df['price'] / 10),
+                          index_df.assign(ticker='BBB', price=index_df['price'] / 20)])
+    stock_df.to_csv(path / 'stock_price.csv', columns=['date', 'ticker', 'price'], index=False)
+    for file_name in ['index_price.csv', 'vix_price.csv', 'treasury_yield_10yr.csv',
+                      'treasury_yield_2yr.csv', 'company_sector.csv']:
+        shutil.copy(f'../files/{file_name}', path / file_name)
+    return LocalFixtureSource(str(path))
+
+
+def expected_prices(source, start, end):
+    expected = source.read_csv('stock_price.csv', parse_dates=['date'])
+    expected = expected[(expected['date'] >= start) & (expected['date'] < end)]
+    return expected.sort_values(['ticker', 'date']).reset_index(drop=True)
+
+
+# second download only asks for the missing range
+def test_incremental_download(tmp_path):
+    source = make_fixture(tmp_path)
+    store_path = str(tmp_path / 'prices')
+    get_stock_price.download_stock_price(tickers, '2023-01-01', '2024-01-01', source, store_path)
+    get_stock_price.download_stock_price(tickers, '2023-01-01', '2024-03-01', source, store_path)
+
+    last_date = expected_prices(source, '2023-01-01', '2024-01-01')['date'].max()
+    assert source.requests == [
+        ('prices', ('AAA', 'BBB'), pd.Timestamp('2023-01-01'), pd.Timestamp('2024-01-01')),
+        ('prices', ('AAA', 'BBB'), last_date, pd.Timestamp('2024-03-01')),
+    ]
+    stored = price_store.read_series('stock', store_path=store_path)
+    expected = expected_prices(source, '2023-01-01', '2024-03-01')
+    assert (stored['ticker'].astype(str) == expected['ticker']).all()
+    np.testing.assert_array_equal(stored['date'], expected['date'])
+    np.testing.assert_allclose(stored['price'], expected['price'], rtol=1e-6)
+
+
+# changed adjusted price on overlap date refetches full history of that ticker
+def test_adjusted_history_refetched(tmp_path):
+    source = make_fixture(tmp_path)
+    store_path = str(tmp_path / 'prices')
+    get_stock_price.download_stock_price(tickers, '2023-01-01', '2024-01-01', source, store_path)
+    stock_df = source.read_csv('stock_price.csv')
+    stock_df.loc[stock_df['ticker'] == 'BBB', 'price'] /= 2
+    stock_df.to_csv(tmp_path / 'stock_price.csv', index=False)
+    get_stock_price.download_stock_price(tickers, '2023-01-01', '2024-03-01', source, store_path)
+
+    assert source.requests[-1] == ('prices', ('BBB',), pd.Timestamp('2023-01-01'),
+                                   pd.Timestamp('2024-03-01'))
+    stored = price_store.read_series('stock', tickers=['BBB'], store_path=store_path)
+    expected = expected_prices(source, '2023-01-01', '2024-03-01')
+    np.testing.assert_allclose(stored['price'], expected.loc[expected['ticker'] == 'BBB', 'price'],
+                               rtol=1e-6)
+
+
+# sectors cached until refresh interval
+def test_sector_cache(tmp_path):
+    source = make_fixture(tmp_path)
+    companies = ['NVDA', 'MSFT']
+    get_stock_price.download_company_sector(companies, source, 30, str(tmp_path))
+    get_stock_price.download_company_sector(companies, source, 30, str(tmp_path))
+    assert source.requests == [('sector', 'NVDA'), ('sector', 'MSFT')]
+    get_stock_price.download_company_sector(companies, source, 0, str(tmp_path))
+    assert len(source.requests) == 4
+    sector_df = pd.read_csv(tmp_path / 'company_sector.csv')
+    assert sector_df['sector'].tolist() == ['Technology', 'Technology']
+
+
+class SlowFlakySource(LocalFixtureSource):
+    # sector lookup with latency, FAIL tickers fail first two calls, DEAD always fails,
+    # peak_in_flight is the largest number of lookups running at the same time
+    def __init__(self, fixture_path, latency=0.05):
+        super().__init__(fixture_path)
+        self.latency = latency
+        self.calls = {}
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.lock = threading.Lock()
+
+    def company_sector(self, ticker):
+        with self.lock:
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+            self.calls[ticker] = self.calls.get(ticker, 0) + 1
+            n_calls = self.calls[ticker]
+        time.sleep(self.latency)
+        with self.lock:
+            self.in_flight -= 1
+        if ticker == 'DEAD' or (ticker.startswith('FAIL') and n_calls <= 2):
+            raise ConnectionError(ticker)
+        return 'Technology'
+
+
+# concurrent fetch with retries, a dead ticker keeps the others
+def test_concurrent_sector_fetch(tmp_path):
+    make_fixture(tmp_path)
+    source = SlowFlakySource(str(tmp_path))
+    companies = [f'T{i}' for i in range(40)] + ['FAIL1', 'FAIL2', 'DEAD']
+    company_sector = get_stock_price.download_company_sector(
+        companies, source, 30, str(tmp_path), max_workers=10, retries=2, backoff=0.01,
+        rate=None, checkpoint_every=10)
+
+    assert 1 < source.peak_in_flight <= 10
+    assert source.calls['FAIL1'] == 3 and source.calls['DEAD'] == 3
+    assert company_sector[-1] == {'ticker': 'DEAD', 'sector': 'N/A'}
+    cache = pd.read_csv(tmp_path / 'sector_cache.csv')
+    assert sorted(cache['ticker']) == sorted(companies[:-1])
+
+    # next run only retries the dead ticker
+    get_stock_price.download_company_sector(companies, source, 30, str(tmp_path), rate=None,
+                                            retries=0)
+    assert source.calls['DEAD'] == 4 and source.calls['T0'] == 1
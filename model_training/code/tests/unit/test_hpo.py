@@ -0,0 +1,88 @@
+import mlflow
+
+import hpo
+from training_data import TrainingData
+
+
+# parallel trials are reproducible and logged from the parent process
+def test_parallel_optimization(training_pickles, monkeypatch):
+    monkeypatch.setenv('MLFLOW_TRACKING_URI', (training_pickles / 'mlruns').as_uri())
+    monkeypatch.setitem(hpo.SEARCH_SPACE, 'n_estimators', 20)
+
+    first = hpo.run_optimization(str(training_pickles), 6, workers=2)
+    second = hpo.run_optimization(str(training_pickles), 6, workers=2)
+    assert first == second
+
+    experiment = mlflow.get_experiment_by_name('stock-return-prediction-hyperopt')
+    runs = mlflow.search_runs([experiment.experiment_id])
+    assert len(runs) == 12 and runs['metrics.rmse'].notna().all()
+
+
+def assert_logged_params(params, runs):
+    best_run = runs.loc[runs['metrics.rmse'].idxmin()]
+    assert set(params) == set(hpo.SEARCH_SPACE)
+    assert params['objective'] == 'reg:squarederror' and params['random_state'] == 42
+    assert isinstance(params['max_depth'], int) and isinstance(params['n_estimators'], int)
+    assert {key: str(value) for key, value in params.items()} == {
+        key: best_run[f'params.{key}'] for key in params}
+
+
+# serial, parallel and halving searches all return the logged params of the best trial
+def test_run_optimization_returns_params(training_pickles, monkeypatch):
+    monkeypatch.setitem(hpo.SEARCH_SPACE, 'n_estimators', 20)
+    for i, kwargs in enumerate([dict(workers=1), dict(workers=2), dict(scheduler='halving')]):
+        monkeypatch.setenv('MLFLOW_TRACKING_URI', (training_pickles / f'mlruns{i}').as_uri())
+        params = hpo.run_optimization(str(training_pickles), 4, **kwargs)
+        experiment = mlflow.get_experiment_by_name('stock-return-prediction-hyperopt')
+        assert_logged_params(params, mlflow.search_runs([experiment.experiment_id]))
+
+
+def test_halving_budgets():
+    assert hpo.halving_budgets(12, 300, 3) == [33, 100, 300]
+    assert hpo.halving_budgets(10, 90, 3) == [10, 30, 90]
+
+
+# successive halving logs every config once, only the best reach the full budget
+def test_successive_halving(training_pickles, monkeypatch):
+    monkeypatch.setenv('MLFLOW_TRACKING_URI', (training_pickles / 'mlruns').as_uri())
+    best = hpo.run_optimization(str(training_pickles), 9, scheduler='halving')
+
+    experiment = mlflow.get_experiment_by_name('stock-return-prediction-hyperopt')
+    runs = mlflow.search_runs([experiment.experiment_id])
+    assert len(runs) == 9
+    assert runs['tags.rung'].value_counts().to_dict() == {'0': 6, '1': 2, '2': 1}
+    assert (runs['params.n_estimators'].astype(int) <= 300).all()
+    assert best['n_estimators'] == int(runs.loc[runs['metrics.rmse'].idxmin(), 'params.n_estimators'])
+
+
+# early stopping logs the number of trees used
+def test_early_stopping(training_pickles):
+    data = TrainingData(str(training_pickles))
+    params = dict(max_depth=6, n_estimators=300, learning_rate=0.5, random_state=42)
+    model, rmse, n_trees = hpo.fit_model(params, data, early_stopping_rounds=5)
+    assert n_trees < 300
+    full_model, full_rmse, _ = hpo.fit_model(params, data, early_stopping_rounds=None)
+    assert rmse <= full_rmse
+
+
+# a rung that used its whole budget continues even if its best tree is not the last one,
+# a rung stopped by early stopping is not trained again
+def test_fit_rung_continues_unless_stopped(training_pickles):
+    hpo.init_worker(str(training_pickles))
+    params = dict(max_depth=2, learning_rate=0.1, random_state=42)
+    first = hpo.fit_rung(params, 1, 33, early_stopping_rounds=20)
+    model, _, n_trees = first
+    assert n_trees < model.num_boosted_rounds() == 33
+    second = hpo.fit_rung(params, 1, 100, first, early_stopping_rounds=20, previous_budget=33)
+    assert second[0].num_boosted_rounds() > 33
+
+    stopped = hpo.fit_rung(dict(params, learning_rate=0.3), 1, 33, early_stopping_rounds=5)
+    assert stopped[0].num_boosted_rounds() < 33
+    assert hpo.fit_rung(params, 1, 100, stopped, early_stopping_rounds=5, previous_budget=33) is stopped
+
+    # continued trees that do not improve keep the previous best
+    params = dict(max_depth=6, learning_rate=0.9, random_state=42)
+    first = hpo.fit_rung(params, 1, 10, early_stopping_rounds=50)
+    second = hpo.fit_rung(params, 1, 30, first, early_stopping_rounds=50, previous_budget=10)
+    assert second[0].num_boosted_rounds() == 30
+    assert second[1:] == first[1:] and second[0].best_iteration == first[2] - 1
@@ -0,0 +1,40 @@
+import os
+
+import numpy as np
+import xgboost as xgb
+
+from training_data import TrainingData, fit_booster, as_regressor
+
+PARAMS = dict(max_depth=4, n_estimators=30, learning_rate=0.3, random_state=42)
+
+
+# cached matrices train the same model as XGBRegressor.fit on the pickles
+def test_same_model_as_regressor(training_pickles):
+    data = TrainingData(str(training_pickles))
+    X_train, y_train = data.load('train')
+    X_val, _ = data.load('val')
+    expected = xgb.XGBRegressor(**PARAMS).fit(X_train, y_train).predict(X_val)
+
+    booster = fit_booster(PARAMS, data)
+    assert data.dmatrix('train') is data.dmatrix('train')
+    np.testing.assert_array_equal(booster.predict(data.dmatrix('val')), expected)
+    np.testing.assert_array_equal(as_regressor(booster, PARAMS).predict(X_val), expected)
+
+
+# binary cache is written once and rebuilt when the pickle is newer
+def test_binary_cache(training_pickles):
+    expected = fit_booster(PARAMS, TrainingData(str(training_pickles))).predict(
+        TrainingData(str(training_pickles)).dmatrix('val'))
+
+    data = TrainingData(str(training_pickles), binary_cache=True)
+    booster = fit_booster(PARAMS, data)
+    cache_path = os.path.join(training_pickles, 'train.dmatrix')
+    assert os.path.exists(cache_path)
+    np.testing.assert_allclose(booster.predict(data.dmatrix('val')), expected, rtol=1e-6)
+
+    mtime = os.path.getmtime(cache_path)
+    TrainingData(str(training_pickles), binary_cache=True).dmatrix('train')
+    assert os.path.getmtime(cache_path) == mtime
+    os.utime(os.path.join(training_pickles, 'train.pkl'), (mtime + 10, mtime + 10))
+    TrainingData(str(training_pickles), binary_cache=True).dmatrix('train')
+    assert os.path.getmtime(cache_path) > mtime
@@ -0,0 +1,88 @@
+import numpy as np
+import pandas as pd
+from dateutil.relativedelta import relativedelta
+
+from transform_stock_price import PricePanel, feature_months, get_return
+
+TICKERS = ['AAA', 'BBB', 'CCC', 'DDD', 'EEE']
+
+
+def price_panel_frames(seed=0):
+    '''
+    two years of daily prices with gaps: CCC starts late, DDD misses days, EEE stops early
+    '''
+    rng = np.random.default_rng(seed)
+    dates = pd.bdate_range('2021-01-04', '2023-03-31')
+    index_price = 3000 * np.cumprod(1 + rng.normal(0.0003, 0.01, len(dates)))
+    index_df = pd.DataFrame({'date': dates, 'ticker': '^SPX', 'price': index_price})
+    stocks = []
+    for i, ticker in enumerate(TICKERS):
+        returns = 0.0002 * i + (0.5 + 0.3 * i) * np.diff(np.log(index_price), prepend=0)
+        price = 50 * (i + 1) * np.exp(np.cumsum(returns + rng.normal(0, 0.01, len(dates))))
+        stock = pd.DataFrame({'date': dates, 'ticker': ticker, 'price': price})
+        if ticker == 'CCC':
+            stock = stock[stock['date'] >= '2021-05-17']
+        if ticker == 'DDD':
+            stock = stock.drop(stock.index[rng.choice(len(stock), 60, replace=False)])
+        if ticker == 'EEE':
+            stock = stock[stock['date'] < '2022-09-15']
+        stocks.append(stock)
+    stock_df = pd.concat(stocks, ignore_index=True).sort_values(['ticker', 'date'], ignore_index=True)
+    vix_df = pd.DataFrame({'date': dates, 'ticker': '^VIX', 'price': rng.uniform(12, 35, len(dates))})
+    treasury_10y = pd.DataFrame({'date': dates, 'DGS10': rng.uniform(1, 5, len(dates))})
+    treasury_2y = pd.DataFrame({'date': dates, 'DGS2': rng.uniform(0.1, 5, len(dates))})
+    return get_return(stock_df), get_return(index_df), treasury_10y, treasury_2y, vix_df
+
+
+def loop_features(stock_df, index_df, treasury_10y, treasury_2y, vix_df, month_starts):
+    '''
+    the per month, per ticker calculation PricePanel replaced, kept as reference
+    '''
+    results = []
+    for month_index, end_date in enumerate(month_starts):
+        capm_start_date = end_date.replace(year=end_date.year - 1)
+        capm_stock_df = stock_df[(stock_df['date'] > capm_start_date) & (stock_df['date'] < end_date)]
+        capm_index_df = index_df[(index_df['date'] > capm_start_date) & (index_df['date'] < end_date)]
+        return_pivot = capm_stock_df.pivot(index='date', columns='ticker', values='return').ffill().bfill()
+        spx = capm_index_df.set_index('date')['return'].reindex(return_pivot.index).ffill().bfill()
+        X = np.column_stack([np.ones(len(spx)), spx.to_numpy()])
+        coef = np.linalg.lstsq(X, return_pivot.to_numpy(), rcond=None)[0]
+        month = pd.DataFrame({'ticker': return_pivot.columns, 'alpha': coef[0], 'beta': coef[1]})
+
+        avg_start_date = end_date - relativedelta(months=1)
+        in_month = lambda df: df[(df['date'] >= avg_start_date) & (df['date'] < end_date)]
+        vol = in_month(stock_df).groupby('ticker')['return'].std().rename('historical_vol')
+        previous_10yr, previous_2yr = in_month(treasury_10y), in_month(treasury_2y)
+        target_df = stock_df[(stock_df['date'] >= end_date)
+                             & (stock_df['date'] < end_date + relativedelta(months=1))]
+        target_pivot = target_df.pivot(index='date', columns='ticker', values='price')
+        target = ((target_pivot.iloc[-1] - target_pivot.iloc[0]) / target_pivot.iloc[0]).rename('future_1m_return')
+
+        month = month.merge(vol, on='ticker').merge(target, on='ticker')
+        month.insert(0, 'date', end_date)
+        month['month_index'] = month_index
+        month['index_avg'] = in_month(index_df)['return'].mean()
+        month['eom_10yr'] = previous_10yr['DGS10'].iloc[-1]
+        month['10yr_avg'] = previous_10yr['DGS10'].mean()
+        month['spread'] = previous_10yr['DGS10'].iloc[-1] - previous_2yr['DGS2'].iloc[-1]
+        month['vix_avg'] = in_month(vix_df)['price'].mean()
+        results.append(month)
+    return pd.concat(results, ignore_index=True)
+
+
+# vectorized features give the same rows and values as the per month loop
+def test_price_panel_matches_loop():
+    frames = price_panel_frames()
+    stock_df = frames[0]
+    month_starts = feature_months(stock_df['date'].min(), stock_df['date'].max())
+    expected = loop_features(*frames, month_starts)
+    panel = PricePanel(*frames)
+
+    for features in [panel.features(month_starts, range(len(month_starts))),
+                     pd.concat([panel.features([end_date], [i]) for i, end_date in enumerate(month_starts)],
+                               ignore_index=True)]:
+        features = features.sort_values(['date', 'ticker'], ignore_index=True)
+        expected = expected.sort_values(['date', 'ticker'], ignore_index=True)[features.columns]
+        pd.testing.assert_frame_equal(features, expected, check_dtype=False, rtol=1e-9)
+    assert set(features['ticker'][features['date'] == '2022-06-01']) == set(TICKERS)
+    assert 'EEE' not in set(features['ticker'][features['date'] == '2022-10-01'])
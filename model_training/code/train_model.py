@@ -1,28 +1,24 @@
 import os
-import pickle
 
-import xgboost as xgb
 from sklearn.metrics import root_mean_squared_error
 
 import mlflow
 from mlflow.models.signature import infer_signature
 
+from training_data import TrainingData, fit_booster, as_regressor
+
 
 def set_mlflow_tracking_uri():
     tracking_uri = os.environ.get("MLFLOW_TRACKING_URI", "http://127.0.0.1:5000")
     mlflow.set_tracking_uri(tracking_uri)
     print(f"MLFlow tracking URI set to: {tracking_uri}")
 
-def load_pickle(filename: str):
-    with open(filename, "rb") as f_in:
-        return pickle.load(f_in)
-
-
-def run_train(data_path: str):
+def run_train(data_path: str, data=None):
     set_mlflow_tracking_uri()
     mlflow.set_experiment("stock-1month-return-prediction")
-    X_train, y_train = load_pickle(os.path.join(data_path, "train.pkl"))
-    X_val, y_val = load_pickle(os.path.join(data_path, "val.pkl"))
+    if data is None:
+        data = TrainingData(data_path)
+    X_train, _ = data.load("train")
     
     with mlflow.start_run():
 
@@ -39,14 +35,18 @@ def run_train(data_path: str):
         mlflow.log_param("learning_rate", learning_rate)
         mlflow.log_param("max_depth", max_depth)
         
-        xgb_model = xgb.XGBRegressor(objective='reg:squarederror', n_estimators=n_estimators, 
-                                     learning_rate=learning_rate, max_depth=max_depth)
-        xgb_model.fit(X_train, y_train)
-        y_pred = xgb_model.predict(X_val)
-        rmse = root_mean_squared_error(y_val, y_pred)
+        params = dict(objective='reg:squarederror', n_estimators=n_estimators,
+                      learning_rate=learning_rate, max_depth=max_depth)
+        booster = fit_booster(params, data)
+        xgb_model = as_regressor(booster, params)
+        y_pred = booster.predict(data.dmatrix("val"))
+        rmse = root_mean_squared_error(data.label("val"), y_pred)
         mlflow.log_metric("rmse", rmse)
 
-        mlflow.log_artifact(local_path=os.path.join(data_path, "train.pkl"), artifact_path="models_pickle")
+        if data.is_columnar("train"):
+            mlflow.log_artifacts(os.path.join(data_path, "train"), artifact_path="models_pickle/train")
+        else:
+            mlflow.log_artifact(local_path=os.path.join(data_path, "train.pkl"), artifact_path="models_pickle")
 
         input_example = X_train[:5].toarray()  
         signature = infer_signature(X_train.toarray(), xgb_model.predict(X_train))
@@ -0,0 +1,118 @@
+"""train, val and test matrices loaded once and shared by every xgboost fit of a process"""
+import os
+import pickle
+
+import numpy as np
+import xgboost as xgb
+
+from columnar_dataset import ColumnarDataset, is_dataset, load_dataset
+
+
+class TrainingData:
+    """
+    handle on the datasets of preprocess_data in data_path, columnar folders
+    train/, val/ and test/, or train.pkl, val.pkl and test.pkl written before them.
+    each (X, y) is loaded once, dmatrix(name) builds the xgboost matrix once,
+    so hpo trials and register_model retraining skip loading and quantile sketching.
+    a columnar dataset is built into the matrix from its memory-mapped columns directly.
+    train is a QuantileDMatrix, val and test use the quantile cuts of train
+    like XGBRegressor.fit does with an eval_set, so models are the same.
+    binary_cache=True stores plain DMatrix binaries next to the datasets instead
+    and loads them from there while they are newer than the datasets,
+    xgboost builds the histogram index of such a DMatrix on the first fit and keeps it.
+    """
+
+    def __init__(self, data_path: str, binary_cache: bool = False):
+        self.data_path = data_path
+        self.binary_cache = binary_cache
+        self._arrays = {}
+        self._datasets = {}
+        self._matrices = {}
+
+    def load(self, name: str):
+        '''
+        (X, y) of dataset name, loaded once
+        '''
+        if name not in self._arrays:
+            if self.is_columnar(name):
+                self._arrays[name] = load_dataset(os.path.join(self.data_path, name))
+            else:
+                with open(os.path.join(self.data_path, f"{name}.pkl"), "rb") as f_in:
+                    self._arrays[name] = pickle.load(f_in)
+        return self._arrays[name]
+
+    def is_columnar(self, name: str):
+        return is_dataset(os.path.join(self.data_path, name))
+
+    def columns(self, name: str):
+        '''
+        memory-mapped ColumnarDataset of dataset name
+        '''
+        if name not in self._datasets:
+            self._datasets[name] = ColumnarDataset(os.path.join(self.data_path, name))
+        return self._datasets[name]
+
+    def dmatrix(self, name: str):
+        '''
+        xgboost matrix of dataset name, built once
+        '''
+        if name not in self._matrices:
+            if self.binary_cache:
+                self._matrices[name] = self._cached_dmatrix(name)
+            else:
+                ref = None if name == 'train' else self.dmatrix('train')
+                if self.is_columnar(name):
+                    X, y = self.columns(name).dense(), self.columns(name).y
+                else:
+                    X, y = self.load(name)
+                self._matrices[name] = xgb.QuantileDMatrix(X, y, ref=ref)
+        return self._matrices[name]
+
+    def _cached_dmatrix(self, name: str):
+        if self.is_columnar(name):
+            source_path = os.path.join(self.data_path, name, "meta.json")
+        else:
+            source_path = os.path.join(self.data_path, f"{name}.pkl")
+        cache_path = os.path.join(self.data_path, f"{name}.dmatrix")
+        if (not os.path.exists(cache_path)
+                or os.path.getmtime(cache_path) < os.path.getmtime(source_path)):
+            X, y = self.load(name)
+            tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+            xgb.DMatrix(X, y).save_binary(tmp_path, silent=True)
+            os.replace(tmp_path, cache_path)
+        return xgb.DMatrix(cache_path)
+
+    def label(self, name: str):
+        if self.is_columnar(name):
+            return np.asarray(self.columns(name).y)
+        return self.load(name)[1]
+
+
+def booster_params(params: dict, n_jobs=None):
+    '''
+    XGBRegressor params as params and number of rounds of xgb.train
+    '''
+    model = xgb.XGBRegressor(**params, n_jobs=n_jobs)
+    return model.get_xgb_params(), model.n_estimators or 100
+
+
+def fit_booster(params: dict, data: TrainingData, n_jobs=None,
+                early_stopping_rounds=None, xgb_model=None):
+    '''
+    train XGBRegressor params on the train matrix of data, with early stopping on val.
+    xgb_model continues training a previous booster
+    '''
+    native_params, num_rounds = booster_params(params, n_jobs)
+    evals = [(data.dmatrix('val'), 'val')] if early_stopping_rounds else []
+    return xgb.train(native_params, data.dmatrix('train'), num_boost_round=num_rounds,
+                     evals=evals, early_stopping_rounds=early_stopping_rounds,
+                     xgb_model=xgb_model, verbose_eval=False)
+
+
+def as_regressor(booster, params: dict):
+    '''
+    XGBRegressor holding booster, for mlflow.xgboost.log_model
+    '''
+    model = xgb.XGBRegressor(**params)
+    model.load_model(bytearray(booster.save_raw("json")))
+    return model
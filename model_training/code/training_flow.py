@@ -24,18 +24,19 @@ def transform_task(last_date=date.today(), output_file_path='../files/features.p
 @task
 def preprocess_task(raw_data_path='../files/', dest_path='../files/output/') -> None:
     '''
-    dump four pickle files into output folder 
-    dictVectorizer from training, X_train, X_val, X_test
+    dump dictVectorizer from training as dv.pkl into output folder,
+    with train, val and test as columnar dataset folders
     '''
     run_data_prep(raw_data_path, dest_path)
 
 @task()
-def hyperopt_task(dest_path='../files/output/', num_trials=15):
+def hyperopt_task(dest_path='../files/output/', num_trials=15, workers=1, scheduler='tpe'):
     '''
     start mlflow server, searching best pamameters based on val rmse, logging in mlflow
+    workers > 1 runs trials in parallel processes, scheduler 'halving' for successive halving
     '''
     # add data_path to experiment_tracking/output instead of default ./output
-    run_optimization(dest_path, num_trials)
+    run_optimization(dest_path, num_trials, workers, scheduler)
 
 @task()
 def register_task(dest_path='../files/output/', top_n=2):
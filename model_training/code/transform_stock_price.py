@@ -1,161 +1,342 @@
+import os
+import json
+import hashlib
 import pandas as pd
 import numpy as np
 from dateutil.relativedelta import relativedelta
 from datetime import datetime
 
+import price_store
+
 def get_return(df):
     '''
     add column simple daily return to dataframe
     '''
-    df['return'] = df.groupby('ticker')['price'].pct_change()
+    df['return'] = df.groupby('ticker', observed=True)['price'].pct_change()
     return df
 
-def cal_alpha_beta(stock_df, index_df, end_date):
-    '''
-    calulating alpha and beta according to CAPM
-    this function will use column symbol, date and dailyreturn from stock_df
-    column symbol, date and dailyreturn from index_df
-    the window to calulating alpha and beta is set to 1 as default
-    given the end_date, this function will find data within 1 year of end date,
-    running simple regression be get parameters.
-    returned dataframe format is 'Date' as end_date, 'Symbol' as stock ticker,
-    'Beta' as CAPM beta, 'Alpha' as CAPM alpha
-    '''
-    return_pivot = stock_df.pivot(index='date', columns='ticker', values='return')
-    spx_series = index_df.set_index('date')['return']
-    return_pivot = return_pivot.ffill().bfill()
-    spx_series = spx_series.reindex(return_pivot.index).ffill().bfill()
-    spx_vec = return_pivot.index.to_series().map(spx_series).values
-    Y = return_pivot.values
-    X = spx_vec.reshape(-1, 1)
-    X_design = np.hstack([np.ones_like(X), X])
-    beta_matrix, _, _, _ = np.linalg.lstsq(X_design, Y, rcond=None)
-    alphas = beta_matrix[0]
-    betas = beta_matrix[1]
-
-    result_df = pd.DataFrame({
-        'date': end_date,
-        'ticker': return_pivot.columns,
-        'alpha': alphas,
-        'beta': betas
-    })
-    return result_df
-
-def avg_index_return(index_df):
-    avg_return_num = index_df['return'].mean()
-    return avg_return_num
-
-def historical_volatility(stock_df, end_date):
-    # get one month historical volatility of each stock
-    stock_vol = stock_df.groupby('ticker')['return'].std()
-    stock_vol.name = 'historical_vol'
-    stock_vol = stock_vol.to_frame()
-    stock_vol['date'] = end_date
-    return stock_vol
-
-def treasury_yield(previous_month_10yr, previous_month_2yr, end_date):
-    previous_month_10yr_avg = previous_month_10yr.mean()
-    eom_10yr = previous_month_10yr.iloc[-1]['DGS10']
-    eom_2yr = previous_month_2yr.iloc[-1]['DGS2']
-    spread = eom_10yr - eom_2yr
-    return pd.DataFrame([{'date': end_date, 'eom_10yr': eom_10yr, 
-                          '10yr_avg': previous_month_10yr_avg['DGS10'], 'spread': spread}])
-
-def get_vix_avg(vix_df):
-    avg_vix_num = vix_df['price'].mean()
-    return avg_vix_num
-
-def get_target(stock_df, end_date):
-    price_df = stock_df.pivot(index='date', columns='ticker', values='price')
-    eom_price = price_df.iloc[-1]
-    bom_price = price_df.iloc[0]
-    future_1m_return = (eom_price - bom_price) / bom_price
-    future_1m_return.name = 'future_1m_return'
-    future_1m_return = future_1m_return.to_frame()
-    future_1m_return['date'] = end_date
-    return future_1m_return
-
-def rolling_calulation(stock_df, index_df, treasury_10y, treasury_2y, vix_df, min_date, max_date):
-    '''
-    rolling time window 
-    from min_date(in data file)+1year 
-    to max_date(in file)-1month or current month-1month, whichever is smaller
-    calculating time window mask for each function
-    apply each function, merge results
+def pivot_panel(df, value_columns):
+    '''
+    pivot long dataframe (date, ticker, values) into date x ticker arrays in one pass,
+    dates and tickers sorted the same way as DataFrame.pivot.
+    returns dates, tickers, mask of existing (date, ticker) rows and one array per value column
+    '''
+    dates, date_codes = np.unique(df['date'].to_numpy(), return_inverse=True)
+    tickers, ticker_codes = np.unique(df['ticker'].to_numpy(), return_inverse=True)
+    exists = np.zeros((len(dates), len(tickers)), dtype=bool)
+    exists[date_codes, ticker_codes] = True
+    arrays = {}
+    for col in value_columns:
+        arr = np.full(exists.shape, np.nan)
+        arr[date_codes, ticker_codes] = df[col].to_numpy(dtype=np.float64)
+        arrays[col] = arr
+    return pd.DatetimeIndex(dates), tickers, exists, arrays
+
+def cumsum0(arr):
+    '''
+    cumulative sum along dates with a leading zero row,
+    sum over rows [lo, hi) is c[hi] - c[lo]
+    '''
+    arr = np.asarray(arr, dtype=np.float64)
+    return np.concatenate([np.zeros((1,) + arr.shape[1:]), np.cumsum(arr, axis=0)])
+
+def window_mean(dates, values, start_date, end_date):
+    '''
+    mean of values with date in [start_date, end_date), dates sorted
+    '''
+    lo = dates.searchsorted(start_date, 'left')
+    hi = dates.searchsorted(end_date, 'left')
+    window = values[lo:hi]
+    window = window[~np.isnan(window)]
+    return window.mean() if len(window) else np.nan
+
+def window_last(dates, values, start_date, end_date):
+    '''
+    last value with date in [start_date, end_date), dates sorted
+    '''
+    lo = dates.searchsorted(start_date, 'left')
+    hi = dates.searchsorted(end_date, 'left')
+    return values[hi - 1] if hi > lo else np.nan
+
+class PricePanel:
+    '''
+    raw market data loaded once and indexed for feature calculation,
+    shared by the training transform and the latest month feature job.
+    stock price and return are pivoted once into date x ticker arrays,
+    index, vix and treasury series are sorted by date.
+    features(month_starts) calculates any set of month starts, one or many,
+    same result as the former loop over months, kept as reference in
+    tests/unit/test_transform_stock_price.py.
+    '''
+
+    def __init__(self, stock_df, index_df, treasury_10y, treasury_2y, vix_df):
+        self.stock_df = stock_df
+        self.index_df = index_df.sort_values('date', kind='stable')
+        self.treasury_10y = treasury_10y.sort_values('date', kind='stable')
+        self.treasury_2y = treasury_2y.sort_values('date', kind='stable')
+        self.vix_df = vix_df.sort_values('date', kind='stable')
+
+        self.dates, self.tickers, self.exists, panel = pivot_panel(stock_df, ['price', 'return'])
+        self.price, self.ret = panel['price'], panel['return']
+        self.spx = (self.index_df.drop_duplicates('date').set_index('date')['return']
+                    .reindex(self.dates).to_numpy())
+        # forward filled over the whole history, equal to forward fill inside a window
+        # as long as the first row of the window has a value.
+        # columns without value on first row are filled inside the window (slow path)
+        self.ret_ff = pd.DataFrame(self.ret).ffill().to_numpy()
+        self.spx_ff = pd.Series(self.spx).ffill().to_numpy()
+        self.c_exists = cumsum0(self.exists)
+        self._cumsums = None
+        self.first_date = None
+
+        self.index_dates = pd.DatetimeIndex(self.index_df['date'])
+        self.index_return = self.index_df['return'].to_numpy(dtype=np.float64)
+        self.vix_dates = pd.DatetimeIndex(self.vix_df['date'])
+        self.vix_price = self.vix_df['price'].to_numpy(dtype=np.float64)
+        self.dates_10yr = pd.DatetimeIndex(self.treasury_10y['date'])
+        self.yield_10yr = self.treasury_10y['DGS10'].to_numpy(dtype=np.float64)
+        self.dates_2yr = pd.DatetimeIndex(self.treasury_2y['date'])
+        self.yield_2yr = self.treasury_2y['DGS2'].to_numpy(dtype=np.float64)
+
+    @classmethod
+    def from_files(cls, files_path='../files/', start=None, end=None):
+        '''
+        read raw data from the price store in files_path/prices and add daily returns,
+        stock and index prices can be limited to dates in [start, end).
+        csv files of earlier downloads are imported into the store on first use
+        '''
+        store_path = os.path.join(files_path, 'prices')
+        price_store.import_csv_files(files_path, store_path)
+        stock_df = price_store.read_series('stock', start, end, store_path=store_path)
+        index_df = price_store.read_series('index', start, end, store_path=store_path)
+        vix_df = price_store.read_series('vix', store_path=store_path)
+        treasury_10y = price_store.read_treasury(10, store_path=store_path)
+        treasury_10y= treasury_10y.ffill().bfill()
+        treasury_2y = price_store.read_treasury(2, store_path=store_path)
+        treasury_2y= treasury_2y.ffill().bfill()
+        stock_df = get_return(stock_df)
+        index_df = get_return(index_df)
+        panel = cls(stock_df, index_df, treasury_10y, treasury_2y, vix_df)
+        panel.first_date = price_store.first_date('stock', store_path)
+        return panel
+
+    @property
+    def min_date(self):
+        # first date of the whole history, also when only a date range is loaded
+        return self.first_date if self.first_date is not None else self.dates.min()
+
+    @property
+    def max_date(self):
+        return self.dates.max()
+
+    def cumsums(self):
+        '''
+        cumulative sums for regression of every 1 year window,
+        built on first use, when more than one month is calculated
+        '''
+        if self._cumsums is None:
+            x0 = np.nan_to_num(self.spx_ff)
+            y0 = np.nan_to_num(self.ret_ff)
+            self._cumsums = (cumsum0(x0), cumsum0(x0 * x0), cumsum0(y0), cumsum0(x0[:, None] * y0))
+        return self._cumsums
+
+    def window_sums(self, lo, hi, use_cumsums):
+        '''
+        sum x, x^2, y, xy over rows [lo, hi) of forward filled returns
+        '''
+        if use_cumsums:
+            c_x, c_xx, c_y, c_xy = self.cumsums()
+            return c_x[hi] - c_x[lo], c_xx[hi] - c_xx[lo], c_y[hi] - c_y[lo], c_xy[hi] - c_xy[lo]
+        x = np.nan_to_num(self.spx_ff[lo:hi])
+        y = np.nan_to_num(self.ret_ff[lo:hi])
+        return x.sum(), (x * x).sum(), y.sum(axis=0), x @ y
+
+    def features(self, month_starts, month_indexes, target=True):
+        '''
+        calculate features for a list of month starts,
+        CAPM alpha and beta of every 1 year window come from cumulative sums,
+        one month features (volatility, index average, treasury yield, vix, target)
+        from the slice of each month.
+        if target is False, future_1m_return is not calculated (latest month).
+        '''
+        dates, tickers, price, ret = self.dates, self.tickers, self.price, self.ret
+        use_cumsums = len(month_starts) > 1
+        columns = {name: [] for name in ['date', 'ticker', 'alpha', 'beta', 'month_index',
+                                         'index_avg', 'historical_vol', 'eom_10yr', '10yr_avg',
+                                         'spread', 'vix_avg', 'future_1m_return']}
+        for end_date, month_index in zip(month_starts, month_indexes):
+            end_date = pd.Timestamp(end_date)
+            capm_start_date = end_date.replace(year=end_date.year - 1)
+            avg_start_date = end_date - relativedelta(months=1)
+            target_end_date = end_date + relativedelta(months=1)
+            lo = dates.searchsorted(capm_start_date, 'right')
+            hi = dates.searchsorted(end_date, 'left')
+            vol_lo = dates.searchsorted(avg_start_date, 'left')
+            target_hi = dates.searchsorted(target_end_date, 'left')
+
+            # tickers having rows in every window, like the inner merges of the former loop
+            c_exists = self.c_exists
+            keep = (c_exists[hi] - c_exists[lo] > 0) & (c_exists[hi] - c_exists[vol_lo] > 0)
+            if target:
+                keep &= c_exists[target_hi] - c_exists[hi] > 0
+
+            with np.errstate(divide='ignore', invalid='ignore'):
+                # alpha and beta, simple regression on 1 year of daily returns
+                n = hi - lo
+                s_x, s_xx, s_y, s_xy = self.window_sums(lo, hi, use_cumsums)
+                if n > 0 and np.isnan(self.spx[lo]):
+                    slow = np.ones(len(tickers), dtype=bool)
+                    x = pd.Series(self.spx[lo:hi]).ffill().bfill().to_numpy()
+                    s_x, s_xx = x.sum(), (x * x).sum()
+                else:
+                    slow = np.isnan(ret[lo]) if n > 0 else np.zeros(len(tickers), dtype=bool)
+                    x = self.spx_ff[lo:hi]
+                slow &= keep
+                if slow.any():
+                    y = pd.DataFrame(ret[lo:hi, slow]).ffill().bfill().to_numpy()
+                    s_y, s_xy = s_y.copy(), s_xy.copy()
+                    s_y[slow], s_xy[slow] = y.sum(axis=0), x @ y
+                beta = (s_xy - s_x * s_y / n) / (s_xx - s_x * s_x / n)
+                alpha = (s_y - beta * s_x) / n
+
+                # one month historical volatility
+                vol_window = ret[vol_lo:hi, keep]
+                count = (~np.isnan(vol_window)).sum(axis=0)
+                mean = np.nansum(vol_window, axis=0) / count
+                historical_vol = np.sqrt(np.nansum((vol_window - mean) ** 2, axis=0) / (count - 1))
+                historical_vol[count < 2] = np.nan
+
+                # future one month return
+                if target:
+                    bom_price, eom_price = price[hi, keep], price[target_hi - 1, keep]
+                    future_1m_return = (eom_price - bom_price) / bom_price
+                else:
+                    future_1m_return = np.full(keep.sum(), np.nan)
+
+            eom_10yr = window_last(self.dates_10yr, self.yield_10yr, avg_start_date, end_date)
+            eom_2yr = window_last(self.dates_2yr, self.yield_2yr, avg_start_date, end_date)
+            n_keep = keep.sum()
+            columns['date'].append(np.full(n_keep, end_date.to_datetime64()))
+            columns['ticker'].append(tickers[keep])
+            columns['alpha'].append(alpha[keep])
+            columns['beta'].append(beta[keep])
+            columns['month_index'].append(np.full(n_keep, month_index, dtype=np.int64))
+            columns['index_avg'].append(np.full(n_keep, window_mean(
+                self.index_dates, self.index_return, avg_start_date, end_date)))
+            columns['historical_vol'].append(historical_vol)
+            columns['eom_10yr'].append(np.full(n_keep, eom_10yr))
+            columns['10yr_avg'].append(np.full(n_keep, window_mean(
+                self.dates_10yr, self.yield_10yr, avg_start_date, end_date)))
+            columns['spread'].append(np.full(n_keep, eom_10yr - eom_2yr))
+            columns['vix_avg'].append(np.full(n_keep, window_mean(
+                self.vix_dates, self.vix_price, avg_start_date, end_date)))
+            columns['future_1m_return'].append(future_1m_return)
+
+        if not target:
+            del columns['future_1m_return']
+        result_df = pd.DataFrame({
+            name: np.concatenate(values) if values else np.array([])
+            for name, values in columns.items()
+        })
+        result_df['date'] = pd.to_datetime(result_df['date'])
+        return result_df
+
+def feature_months(min_date, max_date):
+    '''
+    month starts having 1 year of history and a full month of target data
     '''
     month_starts = pd.date_range(min_date+relativedelta(years=1), 
                                  max_date-relativedelta(months=1), freq='MS')
-    result_df = pd.DataFrame()
-    capm_window_year = 1
-    month_index = 0
-    for end_date in month_starts:
-        # get alpha and beta
-        capm_start_date = end_date.replace(year=end_date.year - capm_window_year)
-        capm_window_mask = (stock_df['date'] > capm_start_date) & (stock_df['date'] < end_date)
-        capm_stock_df = stock_df.loc[capm_window_mask]
-        capm_index_df = index_df.loc[capm_window_mask]
-        end_date_results = cal_alpha_beta(capm_stock_df, capm_index_df, end_date)
-        
-        # get index average
-        avg_start_date = end_date  - relativedelta(months=1)
-        avg_window_mask = (index_df['date'] >= avg_start_date) & (index_df['date'] < end_date)
-        end_date_index_avg = avg_index_return(index_df.loc[avg_window_mask])
-
-        # get historical volatility
-        vol_window_mask = (stock_df['date'] >= avg_start_date) & (stock_df['date'] < end_date)
-        end_date_hvol = historical_volatility(stock_df[vol_window_mask], end_date)
-
-        # get treasury yield
-        treasury_mask_10yr = (treasury_10y['date'] >= avg_start_date) & (treasury_10y['date'] < end_date)
-        treasury_mask_2yr = (treasury_2y['date'] >= avg_start_date) & (treasury_2y['date'] < end_date)
-        previous_month_10yr = treasury_10y[treasury_mask_10yr]
-        previous_month_2yr = treasury_2y[treasury_mask_2yr]
-        treasury_results = treasury_yield(previous_month_10yr, previous_month_2yr, end_date)
-        
-        # get average vix
-        vix_mask = (vix_df['date'] >= avg_start_date) & (vix_df['date'] < end_date)
-        end_date_vix_df = vix_df[vix_mask]
-        end_date_vix_avg = get_vix_avg(end_date_vix_df)
-        end_date_vix_avg_df = pd.DataFrame([{'date': end_date, 'vix_avg': end_date_vix_avg}])
-        
-        # get target value
-        target_mask = (stock_df['date'] >= end_date) & (stock_df['date'] < end_date + relativedelta(months=1))
-        if max_date < end_date + relativedelta(months=1):
-            continue
-        target_df = get_target(stock_df[target_mask], end_date)
-
-        # combine results
-        index_avg_df = pd.DataFrame([{'date': end_date, 'month_index': month_index, 'index_avg': end_date_index_avg}])
-        end_date_results = pd.merge(end_date_results, index_avg_df, on='date', how='inner')
-        end_date_results = pd.merge(end_date_results, end_date_hvol, on=['date', 'ticker'], how='inner')
-        end_date_results = pd.merge(end_date_results, treasury_results, on='date', how='inner')
-        end_date_results = pd.merge(end_date_results, end_date_vix_avg_df, on='date', how='inner')
-        end_date_results = pd.merge(end_date_results, target_df, on=['date', 'ticker'], how='inner')
-        result_df = pd.concat([result_df, end_date_results], ignore_index=True)
-
-        month_index += 1
-    return result_df
-
-
-def transform_data(end_date):
-    # read data
-    stock_df = pd.read_csv('../files/stock_price.csv', parse_dates=['date'])
-    index_df = pd.read_csv('../files/index_price.csv', parse_dates=['date'])
-    vix_df = pd.read_csv('../files/vix_price.csv', parse_dates=['date'])
+    return [end_date for end_date in month_starts
+            if max_date >= end_date + relativedelta(months=1)]
+
+def monthly_digest(df, columns):
+    '''
+    one hash per calendar month of the rows in df, independent of row order
+    '''
+    row_hash = pd.util.hash_pandas_object(df[columns], index=False)
+    month = df['date'].to_numpy().astype('datetime64[M]')
+    return row_hash.groupby(month).sum().to_dict()
+
+def window_fingerprint(digests, end_date):
+    '''
+    fingerprint of all inputs a month start depends on,
+    from 13 months before (1 year window plus previous price for returns)
+    to the target month
+    '''
+    months = pd.date_range(end_date - relativedelta(months=13), end_date, freq='MS')
+    parts = [f"{name}:{digest.get(month, 0)}" for name, digest in digests.items() for month in months]
+    return hashlib.sha1('|'.join(parts).encode()).hexdigest()
+
+def read_manifest(features_dir):
+    manifest_path = os.path.join(features_dir, '_manifest.json')
+    if not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path) as f:
+        return json.load(f)
+
+def write_manifest(manifest, features_dir):
+    manifest_path = os.path.join(features_dir, '_manifest.json')
+    with open(manifest_path + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(manifest_path + '.tmp', manifest_path)
+
+def partition_path(features_dir, end_date):
+    return os.path.join(features_dir, f"date={end_date.strftime('%Y-%m-%d')}.parquet")
+
+def materialize_features(panel, month_starts, features_dir, full_refresh=False):
+    '''
+    features of month_starts calculated incrementally.
+    every month start is stored as one parquet partition in features_dir,
+    with a fingerprint of its input windows in _manifest.json.
+    only months not materialized yet, or whose input windows changed, are calculated.
+    month_index only depends on the first month, it is set when partitions are combined
+    '''
+    os.makedirs(features_dir, exist_ok=True)
+    digests = {
+        'stock': monthly_digest(panel.stock_df, ['date', 'ticker', 'price']),
+        'index': monthly_digest(panel.index_df, ['date', 'price']),
+        'vix': monthly_digest(panel.vix_df, ['date', 'price']),
+        '10yr': monthly_digest(panel.treasury_10y, ['date', 'DGS10']),
+        '2yr': monthly_digest(panel.treasury_2y, ['date', 'DGS2']),
+    }
+    fingerprints = {end_date: window_fingerprint(digests, end_date) for end_date in month_starts}
+    manifest = {} if full_refresh else read_manifest(features_dir)
+    missing = [end_date for end_date in month_starts
+               if manifest.get(end_date.strftime('%Y-%m-%d')) != fingerprints[end_date]
+               or not os.path.exists(partition_path(features_dir, end_date))]
+    print(f"calculate {len(missing)} of {len(month_starts)} months")
+
+    if missing:
+        new_df = panel.features(missing, [0] * len(missing))
+        for end_date in missing:
+            new_df[new_df['date'] == end_date].to_parquet(
+                partition_path(features_dir, end_date), engine='pyarrow', index=False)
+            manifest[end_date.strftime('%Y-%m-%d')] = fingerprints[end_date]
+        write_manifest(manifest, features_dir)
+
+    features_df = pd.concat([pd.read_parquet(partition_path(features_dir, end_date))
+                             for end_date in month_starts], ignore_index=True)
+    first_month = month_starts[0]
+    features_df['month_index'] = ((features_df['date'].dt.year - first_month.year) * 12
+                                  + features_df['date'].dt.month - first_month.month).astype('int64')
+    return features_df
+
+
+def transform_data(end_date, features_dir='../files/features/', full_refresh=False):
+    '''
+    read raw data, calculate features of every month start up to end_date.
+    months already in features_dir are read back instead of recalculated,
+    set full_refresh to recalculate all months
+    '''
+    panel = PricePanel.from_files('../files/')
     sector_df = pd.read_csv('../files/company_sector.csv')
-    treasury_10y = pd.read_csv('../files/treasury_yield_10yr.csv', parse_dates=['date'])
-    treasury_10y= treasury_10y.ffill().bfill()
-    treasury_2y = pd.read_csv('../files/treasury_yield_2yr.csv', parse_dates=['date'])
-    treasury_2y= treasury_2y.ffill().bfill()
-    # transform data
-    stock_df = get_return(stock_df)
-    index_df = get_return(index_df)
-    min_date = stock_df['date'].min()
-    df_max_date = stock_df['date'].max()
     end_month = pd.to_datetime(end_date.replace(day=1))
-    max_date = end_month if end_month < df_max_date else df_max_date
-    # features_df = pd.DataFrame()
-    features_df = rolling_calulation(stock_df, index_df, treasury_10y, treasury_2y, vix_df, min_date, max_date)
+    max_date = end_month if end_month < panel.max_date else panel.max_date
+    month_starts = feature_months(panel.min_date, max_date)
+    if not month_starts:
+        raise ValueError("need more than 1 year of price data to calculate features")
+    features_df = materialize_features(panel, month_starts, features_dir, full_refresh)
     
     # get company sector
     features_df = pd.merge(features_df, sector_df, on='ticker', how='inner')
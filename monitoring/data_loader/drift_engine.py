@@ -0,0 +1,114 @@
+"""
+drift metrics of all months in one pass, without evidently.
+reference distributions are computed once, current data is grouped by month and every
+statistic is calculated for all months at once. drift scores are the default evidently
+stattests for a reference of more than 1000 rows: wasserstein distance normed by the
+reference std for numerical columns, jensen-shannon distance for categorical columns,
+a column drifts when its score is at least DRIFT_THRESHOLD.
+"""
+import numpy as np
+import pandas as pd
+from scipy.special import rel_entr
+
+DRIFT_THRESHOLD = 0.1
+# besides nan and None, as in evidently DatasetMissingValuesMetric
+MISSING_VALUES = ["", np.inf, -np.inf]
+
+
+class ReferenceProfile:
+	'''
+	sorted values and std of numerical columns, category shares of categorical columns
+	'''
+
+	def __init__(self, reference_data, num_features, cat_features, prediction, target):
+		self.num_columns = [target, prediction] + list(num_features)
+		self.cat_columns = list(cat_features)
+		self.numerical = {}
+		for column in self.num_columns:
+			values = reference_data[column].to_numpy(dtype=np.float64)
+			values = np.sort(values[np.isfinite(values)])
+			self.numerical[column] = (values, max(np.std(values), 0.001))
+		self.categorical = {
+			column: reference_data[column].dropna().value_counts(normalize=True)
+			for column in self.cat_columns
+		}
+
+	def wasserstein(self, column, values, groups, n_groups):
+		'''
+		normed first wasserstein distance of every group to the reference,
+		the integral of |cdf reference - cdf group| over all values as in scipy
+		'''
+		reference, norm = self.numerical[column]
+		keep = np.isfinite(values)
+		values, groups = values[keep], groups[keep]
+		grid = np.unique(np.concatenate([reference, values]))
+		reference_cdf = np.searchsorted(reference, grid[:-1], side='right') / len(reference)
+		counts = np.bincount(groups * len(grid) + np.searchsorted(grid, values),
+			minlength=n_groups * len(grid)).reshape(n_groups, len(grid))
+		sizes = counts.sum(axis=1)
+		with np.errstate(invalid='ignore', divide='ignore'):
+			cdf = np.cumsum(counts, axis=1)[:, :-1] / sizes[:, None]
+			distance = np.abs(cdf - reference_cdf) @ np.diff(grid) / norm
+		return np.where(sizes > 0, distance, np.nan)
+
+	def jensenshannon(self, column, values, groups, n_groups):
+		'''
+		jensen-shannon distance (natural log) of category shares of every group to the reference
+		'''
+		keep = pd.notna(values)
+		values, groups = values[keep], groups[keep]
+		reference = self.categorical[column]
+		categories = reference.index.union(pd.Index(pd.unique(values)))
+		reference_shares = reference.reindex(categories, fill_value=0).to_numpy()
+		codes = categories.get_indexer(values)
+		counts = np.bincount(groups * len(categories) + codes,
+			minlength=n_groups * len(categories)).reshape(n_groups, len(categories))
+		sizes = counts.sum(axis=1)
+		with np.errstate(invalid='ignore', divide='ignore'):
+			shares = counts / sizes[:, None]
+			mixture = (shares + reference_shares) / 2
+			divergence = (rel_entr(shares, mixture).sum(axis=1)
+				+ rel_entr(reference_shares, mixture).sum(axis=1)) / 2
+		return np.where(sizes > 0, np.sqrt(divergence), np.nan)
+
+	def drift_scores(self, current_data, groups, n_groups):
+		'''
+		drift score of every column (columns) for every group (rows)
+		'''
+		scores = {}
+		for column in self.num_columns:
+			values = current_data[column].to_numpy(dtype=np.float64)
+			scores[column] = self.wasserstein(column, values, groups, n_groups)
+		for column in self.cat_columns:
+			values = current_data[column].to_numpy(dtype=object)
+			scores[column] = self.jensenshannon(column, values, groups, n_groups)
+		return pd.DataFrame(scores)
+
+
+def monthly_metrics(profile, current_data, date_column='date', quantile_column='future_1m_return',
+		range_column='alpha', value_range=(-0.0025, 0.0025), prediction='predicted_1m_return'):
+	'''
+	one row of dummy_metrics per month of current_data:
+	prediction drift score, number of drifted columns, share of missing cells,
+	median of quantile_column and share of range_column values outside value_range
+	'''
+	groups, months = pd.factorize(current_data[date_column], sort=True)
+	scores = profile.drift_scores(current_data, groups, len(months))
+	by_month = current_data.groupby(groups)
+
+	missing = current_data.isna() | current_data.isin(MISSING_VALUES)
+	share_missing = missing.groupby(groups).sum().sum(axis=1) / (
+		by_month.size() * current_data.shape[1])
+
+	in_range = current_data[range_column].between(*value_range, inclusive='both')
+	has_value = current_data[range_column].notna()
+	out_of_range = (has_value & ~in_range).groupby(groups).sum() / has_value.groupby(groups).sum()
+
+	return pd.DataFrame({
+		'timestamp': months,
+		'prediction_drift': scores[prediction].to_numpy(),
+		'num_drifted_columns': (scores >= DRIFT_THRESHOLD).sum(axis=1).to_numpy(),
+		'share_missing_values': share_missing.to_numpy(),
+		'median_return': by_month[quantile_column].median().to_numpy(),
+		'alpha_out_of_range_share': out_of_range.to_numpy(),
+	})
@@ -0,0 +1,114 @@
+"""
+metrics tables in postgres, or sqlite for tests and local runs: dummy_metrics of the backfill
+and online_metrics of the stream monitor. rows are upserted by timestamp,
+so running the backfill again replaces months instead of duplicating them.
+"""
+import time
+import sqlite3
+
+TABLES = {
+	'dummy_metrics': {
+		'timestamp': 'timestamp',
+		'prediction_drift': 'float',
+		'num_drifted_columns': 'integer',
+		'share_missing_values': 'float',
+		'median_return': 'float',
+		'alpha_out_of_range_share': 'float',
+	},
+	# served predictions have no realized return yet, median of predictions instead
+	'online_metrics': {
+		'timestamp': 'timestamp',
+		'rows': 'integer',
+		'prediction_drift': 'float',
+		'num_drifted_columns': 'integer',
+		'share_missing_values': 'float',
+		'median_prediction': 'float',
+		'alpha_out_of_range_share': 'float',
+	},
+}
+METRIC_COLUMNS = list(TABLES['dummy_metrics'])
+
+
+def create_table_statements(table):
+	columns = ",\n".join(f"\t\t{name} {kind}" for name, kind in TABLES[table].items())
+	return [
+		f"create table if not exists {table}(\n{columns}\n\t)",
+		# tables created by earlier versions have no key, a unique index works for both
+		f"create unique index if not exists {table}_timestamp on {table}(timestamp)",
+	]
+
+
+def upsert_statement(table, placeholder):
+	names = list(TABLES[table])
+	columns = ", ".join(names)
+	values = ", ".join([placeholder] * len(names))
+	updates = ", ".join(f"{column} = excluded.{column}" for column in names[1:])
+	return (f"insert into {table}({columns}) values ({values}) "
+		f"on conflict (timestamp) do update set {updates}")
+
+
+def metric_rows(metrics, table='dummy_metrics'):
+	'''
+	tuples in column order of table from a dataframe like drift_engine.monthly_metrics
+	'''
+	return [tuple(row) for row in metrics[list(TABLES[table])].itertuples(index=False)]
+
+
+class MetricsStore:
+	'''
+	writes to one metrics table on a DB-API connection,
+	placeholder is %s for psycopg and ? for sqlite3
+	'''
+
+	def __init__(self, conn, placeholder='%s', table='dummy_metrics'):
+		self.conn = conn
+		self.placeholder = placeholder
+		self.table = table
+
+	@classmethod
+	def from_url(cls, url, table='dummy_metrics'):
+		'''
+		sqlite:///path, anything else is passed to psycopg as conninfo or postgresql:// url
+		'''
+		if url.startswith("sqlite:///"):
+			return cls(sqlite3.connect(url[len("sqlite:///"):]), placeholder='?', table=table)
+		import psycopg
+		return cls(psycopg.connect(url), table=table)
+
+	def prepare(self):
+		cur = self.conn.cursor()
+		for statement in create_table_statements(self.table):
+			cur.execute(statement)
+		self.conn.commit()
+
+	def _params(self, rows):
+		if self.placeholder != '?':
+			return rows
+		# sqlite3 has no adapter for pandas timestamps
+		return [(str(row[0]),) + tuple(row[1:]) for row in rows]
+
+	def upsert(self, rows):
+		'''
+		write all rows with one executemany in one transaction
+		'''
+		cur = self.conn.cursor()
+		try:
+			cur.executemany(upsert_statement(self.table, self.placeholder), self._params(rows))
+			self.conn.commit()
+		except Exception:
+			self.conn.rollback()
+			raise
+
+	def replay(self, rows, interval, sleep=time.sleep):
+		'''
+		live replay for grafana demos: one row every interval seconds, each committed on its own
+		'''
+		start = time.monotonic()
+		for i, row in enumerate(rows):
+			delay = start + i * interval - time.monotonic()
+			if delay > 0:
+				sleep(delay)
+			self.upsert([row])
+
+	def close(self):
+		self.conn.close()
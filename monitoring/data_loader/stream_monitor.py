@@ -0,0 +1,449 @@
+"""
+online monitoring of served predictions.
+tails the served-*.jsonl files the prediction service writes to SERVED_LOG_DIR,
+keeps streaming statistics of every time window of WINDOW_SECONDS and writes one row
+of online_metrics per finished window. nothing of a window is kept but fixed size
+histograms on reference quantile edges, so memory does not grow with traffic.
+drift scores are those of drift_engine computed on the histograms: wasserstein distance normed
+by the reference std for numerical columns, jensen-shannon distance for categorical columns.
+the realized return is not known when a prediction is served, so it is not monitored here.
+offsets of the files and open windows are checkpointed after every poll,
+a restarted monitor continues where it stopped.
+"""
+import os
+import glob
+import json
+import math
+import time
+import logging
+
+import numpy as np
+import pandas as pd
+from scipy.special import rel_entr
+
+from drift_engine import DRIFT_THRESHOLD
+from metrics_store import MetricsStore, metric_rows
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s]: %(message)s")
+
+SERVED_LOG_DIR = os.getenv("SERVED_LOG_DIR", "served_log")
+WINDOW_SECONDS = float(os.getenv("WINDOW_SECONDS", "300"))
+# a window is written when no batch older than this can still arrive
+ALLOWED_LATENESS = float(os.getenv("ALLOWED_LATENESS", "30"))
+POLL_SECONDS = float(os.getenv("POLL_SECONDS", "5"))
+CHECKPOINT_PATH = os.getenv("CHECKPOINT_PATH", os.path.join(SERVED_LOG_DIR, "monitor_checkpoint.json"))
+HISTOGRAM_BINS = 256
+
+NUM_FEATURES = ['alpha', 'beta', 'month_index', 'index_avg', 'historical_vol',
+	'eom_10yr', '10yr_avg', 'spread', 'vix_avg']
+CAT_FEATURES = ['sector']
+PREDICTION = 'predicted_1m_return'
+RANGE_COLUMN = 'alpha'
+VALUE_RANGE = (-0.0025, 0.0025)
+
+
+class Histogram:
+	'''
+	values counted on fixed edges: how many are equal to every edge and count, sum,
+	min and max of the values between two edges. sums[0] and sums[-1] are of the
+	values below the first and above the last edge
+	'''
+
+	def __init__(self, edges, state=None):
+		self.edges = np.asarray(edges, dtype=np.float64)
+		n_edges = len(self.edges)
+		state = state or {}
+		self.at_edges = np.array(state.get('at_edges', np.zeros(n_edges)), dtype=np.int64)
+		self.counts = np.array(state.get('counts', np.zeros(n_edges + 1)), dtype=np.int64)
+		self.sums = np.array(state.get('sums', np.zeros(n_edges + 1)), dtype=np.float64)
+		self.lows = np.array(state.get('lows', np.full(n_edges + 1, np.inf)), dtype=np.float64)
+		self.highs = np.array(state.get('highs', np.full(n_edges + 1, -np.inf)), dtype=np.float64)
+
+	def update(self, values):
+		values = values[np.isfinite(values)]
+		n_edges = len(self.edges)
+		bins = np.searchsorted(self.edges, values, side='left')
+		on_edge = bins != np.searchsorted(self.edges, values, side='right')
+		self.at_edges += np.bincount(bins[on_edge], minlength=n_edges)
+		bins, values = bins[~on_edge], values[~on_edge]
+		self.counts += np.bincount(bins, minlength=n_edges + 1)
+		self.sums += np.bincount(bins, weights=values, minlength=n_edges + 1)
+		np.minimum.at(self.lows, bins, values)
+		np.maximum.at(self.highs, bins, values)
+
+	@property
+	def size(self):
+		return int(self.at_edges.sum() + self.counts.sum())
+
+	def cdf(self):
+		'''
+		share of values up to every edge
+		'''
+		return np.cumsum(self.at_edges + self.counts[:-1]) / self.size
+
+	def median(self):
+		'''
+		median with values between two edges spread evenly from their min to their max
+		'''
+		cdf = self.cdf()
+		# the median is in the bin below edge i or at edge i
+		i = int(np.searchsorted(cdf, 0.5))
+		below = cdf[i - 1] if i else 0
+		share = self.counts[i] / self.size
+		if below + share < 0.5:
+			return self.edges[i]
+		if i == 0 or i == len(self.edges):
+			# outer bins are open, the mean of their values is the best guess
+			return self.sums[i] / self.counts[i]
+		return self.lows[i] + (0.5 - below) / share * (self.highs[i] - self.lows[i])
+
+	def state(self):
+		return {
+			'at_edges': self.at_edges.tolist(),
+			'counts': self.counts.tolist(),
+			'sums': self.sums.tolist(),
+			'lows': self.lows.tolist(),
+			'highs': self.highs.tolist(),
+		}
+
+
+def uniform_cdf(x, low, high, right_limit):
+	'''
+	share of values evenly spread on [low, high] up to x, all at low when low == high.
+	right_limit counts values at x, for the start of an interval
+	'''
+	span = high - low
+	with np.errstate(invalid='ignore', divide='ignore'):
+		spread = np.clip((x - low) / span, 0, 1)
+	point = x >= low if right_limit else x > low
+	return np.where(span > 0, spread, point)
+
+
+def abs_linear_integral(start, end, width):
+	'''
+	integral of |f| over intervals of width where f is linear from start to end
+	'''
+	total = np.abs(start) + np.abs(end)
+	with np.errstate(invalid='ignore', divide='ignore'):
+		# f changes sign within the interval, two triangles
+		crossing = (start ** 2 + end ** 2) / (2 * total)
+	return width * np.where(start * end >= 0, total / 2, crossing)
+
+
+def wasserstein_distance(current, reference):
+	'''
+	first wasserstein distance of two histograms on the same edges, the integral of
+	|cdf current - cdf reference|. between two edges both cdfs are piecewise linear
+	from the min to the max of their values there, so the integral is exact for this model.
+	values below the first or above the last edge are exact when only one histogram has them,
+	the reference never has because its min and max are edges
+	'''
+	edges = current.edges
+	inner_bins = []
+	outer = []
+	for histogram in (current, reference):
+		counts = histogram.counts[1:-1]
+		inner_bins.append((
+			histogram.cdf()[:-1],
+			counts / histogram.size,
+			np.where(counts > 0, histogram.lows[1:-1], edges[1:]),
+			np.where(counts > 0, histogram.highs[1:-1], edges[1:]),
+		))
+		outer.append(np.array([
+			histogram.counts[0] * edges[0] - histogram.sums[0],
+			histogram.sums[-1] - histogram.counts[-1] * edges[-1],
+		]) / histogram.size)
+
+	def difference(x, right_limit):
+		(start, share, low, high), (ref_start, ref_share, ref_low, ref_high) = inner_bins
+		return (start[:, None] + share[:, None] * uniform_cdf(x, low[:, None], high[:, None], right_limit)
+			- ref_start[:, None] - ref_share[:, None] * uniform_cdf(x, ref_low[:, None], ref_high[:, None], right_limit))
+
+	# no cdf has a kink between two consecutive points of a bin
+	points = np.sort(np.column_stack([edges[:-1], edges[1:]] + [
+		bound for _, _, low, high in inner_bins for bound in (low, high)]), axis=1)
+	start, end = points[:, :-1], points[:, 1:]
+	inner = abs_linear_integral(difference(start, True), difference(end, False), end - start).sum()
+	return inner + np.abs(outer[0] - outer[1]).sum()
+
+
+def reference_edges(values, bins=HISTOGRAM_BINS):
+	'''
+	up to `bins` histogram edges, all reference values: 3/4 of them quantiles and 1/4
+	evenly spaced from the min to the max, so bins in sparse tails stay narrow.
+	a column with fewer unique values has all of them as edges
+	'''
+	values = np.sort(values)
+	quantiles = np.quantile(values, np.linspace(0, 1, bins - bins // 4), method='lower')
+	grid = np.linspace(values[0], values[-1], bins // 4)
+	spaced = values[np.minimum(np.searchsorted(values, grid), len(values) - 1)]
+	return np.unique(np.concatenate([quantiles, spaced]))
+
+
+class StreamingReference:
+	'''
+	histograms on reference_edges and std of numerical reference columns,
+	category shares of categorical reference columns
+	'''
+
+	def __init__(self, reference_data, num_features, cat_features, prediction, bins=HISTOGRAM_BINS):
+		self.num_columns = [prediction] + list(num_features)
+		self.cat_columns = list(cat_features)
+		self.prediction = prediction
+		self.numerical = {}
+		for column in self.num_columns:
+			values = reference_data[column].to_numpy(dtype=np.float64)
+			values = values[np.isfinite(values)]
+			histogram = Histogram(reference_edges(values, bins))
+			histogram.update(values)
+			self.numerical[column] = (histogram, max(np.std(values), 0.001))
+		self.categorical = {
+			column: reference_data[column].dropna().value_counts(normalize=True)
+			for column in self.cat_columns
+		}
+
+
+class WindowStats:
+	'''
+	streaming statistics of one window, a histogram on the reference edges per numerical column
+	'''
+
+	def __init__(self, reference, state=None):
+		self.reference = reference
+		state = state or {}
+		self.rows = state.get('rows', 0)
+		self.cells = state.get('cells', 0)
+		self.missing = state.get('missing', 0)
+		self.range_values = state.get('range_values', 0)
+		self.out_of_range = state.get('out_of_range', 0)
+		self.histograms = {
+			column: Histogram(histogram.edges, state.get('histograms', {}).get(column))
+			for column, (histogram, _) in reference.numerical.items()
+		}
+		self.categories = {column: dict(state.get('categories', {}).get(column, {}))
+			for column in reference.cat_columns}
+
+	def update(self, batch):
+		'''
+		add a dataframe of served rows
+		'''
+		self.rows += len(batch)
+		self.cells += batch.size
+		self.missing += int((batch.isna() | batch.isin(["", np.inf, -np.inf])).to_numpy().sum())
+		for column, histogram in self.histograms.items():
+			if column in batch:
+				histogram.update(pd.to_numeric(batch[column], errors='coerce').to_numpy(dtype=np.float64))
+		for column in self.reference.cat_columns:
+			if column not in batch:
+				continue
+			for category, count in batch[column].dropna().astype(str).value_counts().items():
+				self.categories[column][category] = self.categories[column].get(category, 0) + int(count)
+		if RANGE_COLUMN in batch:
+			values = pd.to_numeric(batch[RANGE_COLUMN], errors='coerce').dropna()
+			self.range_values += len(values)
+			self.out_of_range += int((~values.between(*VALUE_RANGE, inclusive='both')).sum())
+
+	def wasserstein(self, column):
+		'''
+		wasserstein distance to the reference normed by the reference std
+		'''
+		histogram = self.histograms[column]
+		if histogram.size == 0:
+			return np.nan
+		reference, norm = self.reference.numerical[column]
+		return wasserstein_distance(histogram, reference) / norm
+
+	def jensenshannon(self, column):
+		reference = self.reference.categorical[column]
+		counts = pd.Series(self.categories[column], dtype=np.float64)
+		if counts.sum() == 0:
+			return np.nan
+		categories = reference.index.union(counts.index)
+		reference_shares = reference.reindex(categories, fill_value=0).to_numpy()
+		shares = counts.reindex(categories, fill_value=0).to_numpy() / counts.sum()
+		mixture = (shares + reference_shares) / 2
+		divergence = (rel_entr(shares, mixture).sum() + rel_entr(reference_shares, mixture).sum()) / 2
+		return np.sqrt(divergence)
+
+	def drift_scores(self):
+		scores = {column: self.wasserstein(column) for column in self.reference.num_columns}
+		scores.update({column: self.jensenshannon(column) for column in self.reference.cat_columns})
+		return pd.Series(scores, dtype=np.float64)
+
+	def metrics(self, timestamp):
+		'''
+		one row of online_metrics
+		'''
+		scores = self.drift_scores()
+		prediction = self.histograms[self.reference.prediction]
+		return {
+			'timestamp': timestamp,
+			'rows': self.rows,
+			'prediction_drift': scores[self.reference.prediction],
+			'num_drifted_columns': int((scores >= DRIFT_THRESHOLD).sum()),
+			'share_missing_values': self.missing / self.cells if self.cells else np.nan,
+			'median_prediction': prediction.median() if prediction.size else np.nan,
+			'alpha_out_of_range_share': (self.out_of_range / self.range_values
+				if self.range_values else np.nan),
+		}
+
+	def state(self):
+		return {
+			'rows': self.rows,
+			'cells': self.cells,
+			'missing': self.missing,
+			'range_values': self.range_values,
+			'out_of_range': self.out_of_range,
+			'histograms': {column: histogram.state() for column, histogram in self.histograms.items()},
+			'categories': self.categories,
+		}
+
+
+class StreamMonitor:
+	'''
+	reads served batches from log_dir into windows and writes finished windows to store
+	'''
+
+	def __init__(self, reference, store, log_dir=SERVED_LOG_DIR, window_seconds=WINDOW_SECONDS,
+			allowed_lateness=ALLOWED_LATENESS, checkpoint_path=CHECKPOINT_PATH):
+		self.reference = reference
+		self.store = store
+		self.log_dir = log_dir
+		self.window_seconds = window_seconds
+		self.allowed_lateness = allowed_lateness
+		self.checkpoint_path = checkpoint_path
+		self.offsets = {}
+		self.windows = {}
+		# start of the first window that is not written yet, later batches of written windows are dropped
+		self.watermark = -math.inf
+		self.late_batches = 0
+		self._load_checkpoint()
+
+	def _load_checkpoint(self):
+		if not self.checkpoint_path or not os.path.exists(self.checkpoint_path):
+			return
+		with open(self.checkpoint_path) as f:
+			state = json.load(f)
+		self.offsets = state['offsets']
+		self.watermark = state['watermark']
+		self.late_batches = state.get('late_batches', 0)
+		self.windows = {float(start): WindowStats(self.reference, window)
+			for start, window in state['windows'].items()}
+
+	def save_checkpoint(self):
+		if not self.checkpoint_path:
+			return
+		state = {
+			'offsets': self.offsets,
+			'watermark': self.watermark,
+			'late_batches': self.late_batches,
+			'windows': {str(start): window.state() for start, window in self.windows.items()},
+		}
+		tmp_path = f"{self.checkpoint_path}.tmp"
+		with open(tmp_path, 'w') as f:
+			json.dump(state, f)
+		os.replace(tmp_path, self.checkpoint_path)
+
+	def read_new_lines(self, path):
+		'''
+		complete lines appended to path since the last read, a partial last line is read next time
+		'''
+		offset = self.offsets.get(path, 0)
+		if os.path.getsize(path) < offset:
+			# the file was truncated or replaced
+			offset = 0
+		with open(path, 'rb') as f:
+			f.seek(offset)
+			data = f.read()
+		end = data.rfind(b"\n") + 1
+		self.offsets[path] = offset + end
+		return data[:end].splitlines()
+
+	def add_batch(self, record):
+		served_at = record['served_at']
+		start = math.floor(served_at / self.window_seconds) * self.window_seconds
+		if start < self.watermark:
+			self.late_batches += 1
+			return
+		if start not in self.windows:
+			self.windows[start] = WindowStats(self.reference)
+		self.windows[start].update(pd.DataFrame(record['columns']))
+
+	def poll(self):
+		'''
+		read every served log file, returns the number of batches read
+		'''
+		n_batches = 0
+		for path in sorted(glob.glob(os.path.join(self.log_dir, "served-*.jsonl"))):
+			for line in self.read_new_lines(path):
+				try:
+					record = json.loads(line)
+				except ValueError:
+					logging.warning(f"skipping unreadable line in {path}")
+					continue
+				self.add_batch(record)
+				n_batches += 1
+		return n_batches
+
+	def finished_windows(self, now):
+		return sorted(start for start in self.windows
+			if start + self.window_seconds + self.allowed_lateness <= now)
+
+	def flush(self, now=None):
+		'''
+		write windows that ended allowed_lateness before now (wall clock by default),
+		returns their metrics
+		'''
+		now = time.time() if now is None else now
+		starts = self.finished_windows(now)
+		if not starts:
+			return pd.DataFrame()
+		metrics = pd.DataFrame([
+			self.windows[start].metrics(pd.Timestamp(start, unit='s')) for start in starts
+		])
+		# the store is written before the checkpoint, a crash in between writes the same rows again
+		self.store.upsert(metric_rows(metrics, table='online_metrics'))
+		for start in starts:
+			del self.windows[start]
+		self.watermark = max(self.watermark, starts[-1] + self.window_seconds)
+		return metrics
+
+	def step(self, now=None):
+		self.poll()
+		metrics = self.flush(now)
+		self.save_checkpoint()
+		return metrics
+
+	def run(self, poll_seconds=POLL_SECONDS):
+		while True:
+			metrics = self.step()
+			for row in metrics.itertuples(index=False):
+				logging.info(f"window {row.timestamp}: {row.rows} rows, "
+					f"prediction drift {row.prediction_drift:.3f}, {row.num_drifted_columns} drifted columns")
+			time.sleep(poll_seconds)
+
+
+def load_reference(path='backfill.parquet', start='2024-01-01', end='2025-01-01'):
+	'''
+	streaming reference of the same months as the reference of metrics_calculation
+	'''
+	backfill = pd.read_parquet(path)
+	backfill['date'] = pd.to_datetime(backfill['date'])
+	reference_data = backfill.loc[(backfill['date'] > start) & (backfill['date'] < end)]
+	return StreamingReference(reference_data, NUM_FEATURES, CAT_FEATURES, PREDICTION)
+
+
+if __name__ == '__main__':
+	# same database as metrics_calculation
+	host = os.getenv("PGHOST")
+	user = os.getenv("PGUSER")
+	password = os.getenv("PGPASSWORD")
+	dbname = os.getenv("PGDATABASE")
+	metrics_db_url = os.getenv("METRICS_DB_URL",
+		f"host={host} port=5432 dbname={dbname} user={user} password={password}")
+	store = MetricsStore.from_url(metrics_db_url, table='online_metrics')
+	store.prepare()
+	os.makedirs(SERVED_LOG_DIR, exist_ok=True)
+	monitor = StreamMonitor(load_reference(), store)
+	logging.info(f"monitoring {SERVED_LOG_DIR} in windows of {WINDOW_SECONDS:.0f} seconds")
+	monitor.run()
@@ -0,0 +1,78 @@
+import numpy as np
+import pandas as pd
+from scipy.spatial.distance import jensenshannon
+from scipy.stats import wasserstein_distance
+
+from drift_engine import DRIFT_THRESHOLD, ReferenceProfile, monthly_metrics
+
+NUM_FEATURES = ['alpha', 'vix_avg']
+CAT_FEATURES = ['sector']
+
+
+def month_data(rng, month, n_rows, shift=0.0, sectors=('Energy', 'Health Care', 'Utilities')):
+	return pd.DataFrame({
+		'date': pd.Timestamp(month),
+		'alpha': rng.normal(shift, 0.002, n_rows),
+		'vix_avg': np.full(n_rows, 15.0 + 10 * shift),
+		'sector': rng.choice(list(sectors), n_rows),
+		'predicted_1m_return': rng.normal(0.01 + shift, 0.02, n_rows),
+		'future_1m_return': rng.normal(0.01, 0.05, n_rows),
+	})
+
+
+def expected_scores(reference, month):
+	'''
+	drift scores of one month with scipy, as evidently calculates them
+	'''
+	scores = {}
+	for column in ['future_1m_return', 'predicted_1m_return'] + NUM_FEATURES:
+		ref_values = reference[column].dropna().to_numpy()
+		values = month[column].dropna().to_numpy()
+		scores[column] = wasserstein_distance(ref_values, values) / max(np.std(ref_values), 0.001)
+	for column in CAT_FEATURES:
+		ref_counts = reference[column].value_counts()
+		counts = month[column].value_counts()
+		categories = ref_counts.index.union(counts.index)
+		scores[column] = jensenshannon(ref_counts.reindex(categories, fill_value=0).to_numpy(),
+			counts.reindex(categories, fill_value=0).to_numpy())
+	return pd.Series(scores)
+
+
+# all months in one pass give the scores of scipy computed month by month
+def test_monthly_metrics_match_scipy():
+	rng = np.random.default_rng(3)
+	reference = pd.concat([month_data(rng, f'2024-{m:02d}-01', 200) for m in range(1, 7)])
+	current = pd.concat([
+		month_data(rng, '2025-01-01', 150),
+		month_data(rng, '2025-02-01', 120, shift=0.003),
+		# unseen category
+		month_data(rng, '2025-03-01', 100, sectors=('Energy', 'Real Estate')),
+	], ignore_index=True)
+	# missing values in one month
+	april = month_data(rng, '2025-04-01', 80, shift=-0.001)
+	april.loc[::4, 'alpha'] = np.nan
+	april.loc[::5, 'sector'] = None
+	april.loc[::7, 'predicted_1m_return'] = np.inf
+	current = pd.concat([current, april], ignore_index=True)
+
+	profile = ReferenceProfile(reference, NUM_FEATURES, CAT_FEATURES,
+		prediction='predicted_1m_return', target='future_1m_return')
+	metrics = monthly_metrics(profile, current)
+
+	assert len(metrics) == 4
+	for row, (month, month_rows) in zip(metrics.itertuples(index=False), current.groupby('date')):
+		month_rows = month_rows.replace([np.inf, -np.inf], np.nan)
+		expected = expected_scores(reference, month_rows)
+		assert row.timestamp == month
+		assert np.isclose(row.prediction_drift, expected['predicted_1m_return'], atol=1e-8)
+		assert row.num_drifted_columns == (expected >= DRIFT_THRESHOLD).sum()
+		assert np.isclose(row.share_missing_values, month_rows.isna().to_numpy().mean())
+		assert np.isclose(row.median_return, month_rows['future_1m_return'].median())
+		alpha = month_rows['alpha'].dropna()
+		assert np.isclose(row.alpha_out_of_range_share, (alpha.abs() > 0.0025).mean())
+
+	groups, months = pd.factorize(current['date'], sort=True)
+	scores = profile.drift_scores(current, groups, len(months))
+	for i, (_, month_rows) in enumerate(current.groupby('date')):
+		expected = expected_scores(reference, month_rows.replace([np.inf, -np.inf], np.nan))
+		assert np.allclose(scores.iloc[i][expected.index], expected, atol=1e-8)
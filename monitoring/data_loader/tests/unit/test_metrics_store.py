@@ -0,0 +1,48 @@
+import sqlite3
+
+import pandas as pd
+
+from metrics_store import MetricsStore, metric_rows
+
+
+def metrics(median_return):
+	return pd.DataFrame({
+		'timestamp': pd.to_datetime(['2025-01-01', '2025-02-01', '2025-03-01']),
+		'prediction_drift': [0.26, 0.25, 0.23],
+		'num_drifted_columns': [3, 2, 4],
+		'share_missing_values': [0.0, 0.0, 0.01],
+		'median_return': median_return,
+		'alpha_out_of_range_share': [0.03, 0.03, 0.04],
+	})
+
+
+def table(path):
+	with sqlite3.connect(path) as conn:
+		return conn.execute("select * from dummy_metrics order by timestamp").fetchall()
+
+
+# a second backfill replaces months by timestamp instead of adding rows
+def test_upsert_is_idempotent(tmp_path):
+	url = f"sqlite:///{tmp_path / 'metrics.db'}"
+	store = MetricsStore.from_url(url)
+	store.prepare()
+	store.upsert(metric_rows(metrics([0.04, 0.01, -0.02])))
+	store.prepare()
+	store.upsert(metric_rows(metrics([0.05, 0.01, -0.02]).iloc[:2]))
+	store.close()
+
+	rows = table(tmp_path / 'metrics.db')
+	assert [row[0] for row in rows] == ['2025-01-01 00:00:00', '2025-02-01 00:00:00', '2025-03-01 00:00:00']
+	assert [row[4] for row in rows] == [0.05, 0.01, -0.02]
+
+
+# live replay writes one month per interval
+def test_replay(tmp_path):
+	store = MetricsStore.from_url(f"sqlite:///{tmp_path / 'metrics.db'}")
+	store.prepare()
+	sleeps = []
+	store.replay(metric_rows(metrics([0.04, 0.01, -0.02])), 10, sleep=sleeps.append)
+	store.close()
+
+	assert len(sleeps) == 2 and all(9 < seconds <= 20 for seconds in sleeps)
+	assert len(table(tmp_path / 'metrics.db')) == 3
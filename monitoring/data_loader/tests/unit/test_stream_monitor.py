@@ -0,0 +1,90 @@
+import json
+import sqlite3
+
+import numpy as np
+import pandas as pd
+
+from drift_engine import ReferenceProfile
+from metrics_store import MetricsStore
+from stream_monitor import StreamingReference, StreamMonitor, WindowStats
+
+NUM_FEATURES = ['alpha', 'vix_avg']
+
+
+def served_data(rng, n_rows, shift=0.0, vix=20.0):
+	return pd.DataFrame({
+		'ticker': [f"T{i}" for i in range(n_rows)],
+		'alpha': rng.standard_t(3, n_rows) * 0.002 + shift,
+		'vix_avg': np.full(n_rows, vix),
+		'sector': rng.choice(['Energy', 'Health Care', 'Utilities'], n_rows),
+		'predicted_1m_return': rng.normal(0.01 + shift, 0.02, n_rows),
+	})
+
+
+def reference_data(rng):
+	return pd.concat([served_data(rng, 300, vix=vix) for vix in [14.0, 16.5, 21.0, 30.0]])
+
+
+def batch_line(data, served_at):
+	columns = {name: data[name].tolist() for name in data.columns}
+	return json.dumps({"served_at": served_at, "model_version": "run", "columns": columns}) + "\n"
+
+
+# histograms on reference edges give the drift scores of the batch calculation
+def test_scores_match_drift_engine():
+	rng = np.random.default_rng(1)
+	reference = reference_data(rng)
+	current = served_data(rng, 500, shift=0.001, vix=18.2)
+	profile = ReferenceProfile(reference.assign(target=0.0), NUM_FEATURES, ['sector'],
+		prediction='predicted_1m_return', target='target')
+	exact = profile.drift_scores(current.assign(target=0.0), np.zeros(len(current), dtype=int), 1).iloc[0]
+
+	window = WindowStats(StreamingReference(reference, NUM_FEATURES, ['sector'], 'predicted_1m_return'))
+	for batch in np.array_split(np.arange(len(current)), 7):
+		window.update(current.iloc[batch])
+	scores = window.drift_scores()
+
+	assert np.allclose(scores, exact[scores.index], atol=0.005)
+	assert abs(window.histograms['predicted_1m_return'].median()
+		- current['predicted_1m_return'].median()) < 0.001
+
+
+# finished windows are written once, a restarted monitor continues from its checkpoint
+def test_monitor_windows_and_checkpoint(tmp_path):
+	rng = np.random.default_rng(2)
+	reference = StreamingReference(reference_data(rng), NUM_FEATURES, ['sector'], 'predicted_1m_return')
+	log_dir = tmp_path / 'served'
+	log_dir.mkdir()
+	url = f"sqlite:///{tmp_path / 'metrics.db'}"
+
+	def monitor():
+		store = MetricsStore.from_url(url, table='online_metrics')
+		store.prepare()
+		return StreamMonitor(reference, store, str(log_dir), window_seconds=60,
+			allowed_lateness=10, checkpoint_path=str(tmp_path / 'checkpoint.json'))
+
+	late_line = batch_line(served_data(rng, 5), 1210.0)
+	with open(log_dir / 'served-host-1.jsonl', 'w') as f:
+		f.write(batch_line(served_data(rng, 20), 1200.0))
+		f.write(batch_line(served_data(rng, 30), 1230.0))
+		f.write(batch_line(served_data(rng, 40), 1270.0))
+		f.write(late_line[:50])
+
+	first = monitor()
+	metrics = first.step(now=1275.0)
+	assert metrics['rows'].tolist() == [50]
+	first.store.close()
+
+	with open(log_dir / 'served-host-1.jsonl', 'a') as f:
+		f.write(late_line[50:])
+		f.write(batch_line(served_data(rng, 10), 1280.0))
+	second = monitor()
+	assert second.step(now=1300.0).empty
+	assert second.late_batches == 1
+	metrics = second.step(now=1400.0)
+	second.store.close()
+
+	assert metrics['rows'].tolist() == [50]
+	with sqlite3.connect(tmp_path / 'metrics.db') as conn:
+		rows = conn.execute("select timestamp, rows from online_metrics order by timestamp").fetchall()
+	assert rows == [('1970-01-01 00:20:00', 50), ('1970-01-01 00:21:00', 50)]